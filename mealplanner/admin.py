@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Recipe, Ingredient, IngredientInRecipe, Tag, RecipeTag, MealPlan, MealPlanItem, RecipeNutrition
+from .models import Recipe, Ingredient, IngredientInRecipe, Tag, RecipeTag, MealPlan, MealPlanItem, RecipeNutrition, NutritionCacheEntry, Job
+from .jobs import NUTRITION_JOB, enqueue_many, retry_failed_jobs
 
 # Custom admin for IngredientInRecipe to display related ingredient and recipe names
 class IngredientInRecipeInline(admin.TabularInline):
@@ -18,6 +19,14 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('difficulty', 'public')
     search_fields = ('name', 'instructions')
     inlines = [IngredientInRecipeInline]  # Allow adding ingredients directly in the Recipe admin
+    actions = ['queue_nutrition_estimates']
+
+    # Queue the selected recipes for the background workers rather than estimating them here,
+    # so thousands of recipes can be recomputed without holding up the request
+    @admin.action(description='Recompute nutrition for the selected recipes')
+    def queue_nutrition_estimates(self, request, queryset):
+        count = enqueue_many(NUTRITION_JOB, queryset.values_list('id', flat=True).iterator())
+        self.message_user(request, f'Queued nutrition estimates for {count} recipes.')
 
 # Ingredient admin configuration
 @admin.register(Ingredient)
@@ -57,4 +66,23 @@ class MealPlanItemAdmin(admin.ModelAdmin):
     list_display = ('meal_plan', 'recipe', 'weekday')
     list_filter = ('meal_plan', 'weekday')
 
+# NutritionCacheEntry admin configuration
+@admin.register(NutritionCacheEntry)
+class NutritionCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('line', 'calories', 'hits', 'fetched_at', 'last_used')
+    search_fields = ('line',)
+
+# Job admin configuration, for keeping an eye on the background workers
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'key', 'status', 'attempts', 'run_after', 'locked_by', 'updated_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('key', 'last_error')
+    actions = ['retry_jobs']
+
+    @admin.action(description='Retry the selected failed jobs')
+    def retry_jobs(self, request, queryset):
+        count = retry_failed_jobs(queryset)
+        self.message_user(request, f'Queued {count} failed jobs again.')
+
 admin.site.register(RecipeNutrition)
\ No newline at end of file
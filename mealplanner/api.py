@@ -0,0 +1,272 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Prefetch, Q
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.duration import duration_string
+from django.views.decorators.http import require_GET
+
+from .models import (
+    WEEKDAY_CHOICES, Recipe, IngredientInRecipe, RecipeTag, RecipeNutrition, MealPlan, MealPlanItem, MealPlanDaySummary,
+    MealPlanIngredientTotal,
+)
+from .filters import RecipeFilter
+from .pagination import keyset_page
+from .search import search_recipes
+from .summaries import NUTRIENTS, get_day_summaries
+from .pantry import match_pantry, parse_pantry
+
+# Read-only JSON API, version 1, for recipes and meal plans.
+#
+# Visibility matches the HTML views: anyone can read public recipes, users can also read
+# their own, and meal plans can only be read by their owner. ?fields=a,b picks which
+# fields are returned, and lists are paginated with an opaque ?cursor=.
+#
+# Every response has a strong ETag built from the versions of the rows in it (see
+# versions.py). The versions are read first, so a request with a matching If-None-Match
+# gets a 304 before the full rows are loaded or anything is serialized.
+
+MAX_PAGE_SIZE = 100
+
+
+# Fields that can be requested for each resource: name -> function returning its value
+RECIPE_FIELDS = {
+    'id': lambda recipe: recipe.id,
+    'name': lambda recipe: recipe.name,
+    'user': lambda recipe: recipe.user.username,
+    'difficulty': lambda recipe: recipe.difficulty,
+    'time_needed': lambda recipe: duration_string(recipe.time_needed),
+    'public': lambda recipe: recipe.public,
+    'image_url': lambda recipe: recipe.image_url,
+    'instructions': lambda recipe: recipe.instructions,
+    'instructions_html': lambda recipe: recipe.instructions_html,
+    'ingredients': lambda recipe: [
+        {'name': line.ingredient.name, 'unit': line.ingredient.measurement_unit, 'amount': line.measurement_amount}
+        for line in recipe.recipe_ingredients.all()
+    ],
+    'tags': lambda recipe: [recipe_tag.tag.name for recipe_tag in recipe.tags.all()],
+    'nutrition': lambda recipe: get_nutrition(recipe),
+    'version': lambda recipe: recipe.version,
+}
+RECIPE_LIST_FIELDS = ['id', 'name', 'difficulty', 'time_needed', 'public', 'image_url', 'tags']
+
+MEAL_PLAN_FIELDS = {
+    'id': lambda meal_plan: meal_plan.id,
+    'name': lambda meal_plan: meal_plan.name,
+    'items': lambda meal_plan: [
+        {'id': item.id, 'weekday': item.weekday, 'recipe_id': item.recipe_id, 'recipe': item.recipe.name}
+        for item in meal_plan.meal_plan_items.all()
+    ],
+    'nutrition': lambda meal_plan: [
+        {'weekday': day.weekday, **{name: getattr(day, name) for name in NUTRIENTS}}
+        for day in get_days(meal_plan)
+    ],
+    'shopping_list': lambda meal_plan: [
+        {'ingredient': total.ingredient.name, 'unit': total.ingredient.measurement_unit, 'amount': total.total_amount}
+        for total in meal_plan.ingredient_totals.all()
+    ],
+    'version': lambda meal_plan: meal_plan.version,
+}
+MEAL_PLAN_LIST_FIELDS = ['id', 'name']
+
+
+# Helper to get a recipe's nutrition as a dict, or None if it has none
+def get_nutrition(recipe):
+    try:
+        nutrition = recipe.recipenutrition
+    except RecipeNutrition.DoesNotExist:
+        return None
+    return {name: getattr(nutrition, name) for name in NUTRIENTS}
+
+# Helper to get a meal plan's day summaries from the prefetched rows, building them if any are missing
+def get_days(meal_plan):
+    days = list(meal_plan.day_summaries.all())
+    if len(days) != len(WEEKDAY_CHOICES):
+        days = get_day_summaries(meal_plan)
+    return days
+
+# Load only the related rows the requested fields need
+def with_recipe_fields(recipes, fields):
+    if 'user' in fields:
+        recipes = recipes.select_related('user')
+    if 'nutrition' in fields:
+        recipes = recipes.select_related('recipenutrition')
+    if 'ingredients' in fields:
+        recipes = recipes.prefetch_related(
+            Prefetch('recipe_ingredients', queryset=IngredientInRecipe.objects.select_related('ingredient').order_by('id'))
+        )
+    if 'tags' in fields:
+        recipes = recipes.prefetch_related(Prefetch('tags', queryset=RecipeTag.objects.select_related('tag').order_by('id')))
+    return recipes
+
+def with_meal_plan_fields(meal_plans, fields):
+    if 'items' in fields:
+        meal_plans = meal_plans.prefetch_related(
+            Prefetch('meal_plan_items', queryset=MealPlanItem.objects.select_related('recipe').order_by('weekday', 'id'))
+        )
+    if 'nutrition' in fields:
+        meal_plans = meal_plans.prefetch_related(
+            Prefetch('day_summaries', queryset=MealPlanDaySummary.objects.order_by('weekday'))
+        )
+    if 'shopping_list' in fields:
+        meal_plans = meal_plans.prefetch_related(Prefetch(
+            'ingredient_totals',
+            queryset=MealPlanIngredientTotal.objects.select_related('ingredient').order_by('ingredient__name'),
+        ))
+    return meal_plans
+
+# Helper to read the requested ?fields=, raising ValueError for unknown fields
+def get_fields(request, allowed, default):
+    if not request.GET.get('fields'):
+        return default
+    fields = list(dict.fromkeys(field.strip() for field in request.GET['fields'].split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}. Choose from: {", ".join(allowed)}.')
+    return fields
+
+# Helper to read the requested ?limit=
+def get_page_size(request):
+    try:
+        return max(1, min(int(request.GET.get('limit', settings.RECIPE_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return settings.RECIPE_PAGE_SIZE
+
+# Build a strong ETag from the parts of a response that identify it
+def make_etag(*parts):
+    return '"' + hashlib.sha256(repr(parts).encode()).hexdigest()[:32] + '"'
+
+def serialize(obj, serializers, fields):
+    return {field: serializers[field](obj) for field in fields}
+
+def error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+# Return a 304 if the client already has this version, otherwise build the response and tag it
+def conditional_json(request, etag, build):
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(build())
+    response['ETag'] = etag
+
+    # Responses depend on who is logged in, and clients should always revalidate
+    patch_vary_headers(response, ['Cookie'])
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+# Helper to build the URL of the next page, keeping the other parameters
+def get_next_url(request, cursor):
+    if not cursor:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return request.build_absolute_uri('?' + params.urlencode())
+
+# Serve one page of a queryset, given the fields needed to order it. The page's ids and
+# versions are fetched first for the ETag, and the full rows only if they are needed.
+def paginated_json(request, queryset, key_fields, serializers, fields, with_fields):
+    rows, next_cursor = keyset_page(queryset.only('id', 'version', *key_fields), request.GET.get('cursor'), get_page_size(request))
+    versions = [(row.id, row.version) for row in rows]
+
+    def build():
+        full_rows = with_fields(queryset.model.objects.all(), fields).in_bulk([row.id for row in rows])
+        return {
+            'results': [serialize(full_rows[row.id], serializers, fields) for row in rows if row.id in full_rows],
+            'next': get_next_url(request, next_cursor),
+        }
+
+    return conditional_json(request, make_etag(request.path, fields, versions, next_cursor), build)
+
+
+# List the recipes the user can see, with the recipe list's search, filters and sorting
+@require_GET
+def recipe_list(request):
+    try:
+        fields = get_fields(request, RECIPE_FIELDS, RECIPE_LIST_FIELDS)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    visible = Q(public=True)
+    if request.user.is_authenticated:
+        visible |= Q(user=request.user)
+
+    query = request.GET.get('q')
+    if query:
+        recipes = search_recipes(Recipe.objects.filter(visible), query)
+    else:
+        recipes = RecipeFilter(request.GET, queryset=Recipe.objects.filter(visible)).qs
+
+    return paginated_json(request, recipes, ['difficulty', 'time_needed'], RECIPE_FIELDS, fields, with_recipe_fields)
+
+# Get one recipe, if it is public or the user's own
+@require_GET
+def recipe_detail(request, recipe_id):
+    try:
+        fields = get_fields(request, RECIPE_FIELDS, list(RECIPE_FIELDS))
+    except ValueError as e:
+        return error(str(e), 400)
+
+    recipe = Recipe.objects.filter(id=recipe_id).values('user_id', 'public', 'version').first()
+    if recipe is None:
+        return error('Recipe not found.', 404)
+    if not recipe['public'] and recipe['user_id'] != request.user.id:
+        return error('You are not allowed to view this recipe.', 403)
+
+    def build():
+        return serialize(with_recipe_fields(Recipe.objects.all(), fields).get(id=recipe_id), RECIPE_FIELDS, fields)
+
+    return conditional_json(request, make_etag(request.path, fields, recipe['version']), build)
+
+# List the user's meal plans
+@require_GET
+def mealplan_list(request):
+    if not request.user.is_authenticated:
+        return error('Log in to see your meal plans.', 401)
+    try:
+        fields = get_fields(request, MEAL_PLAN_FIELDS, MEAL_PLAN_LIST_FIELDS)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    meal_plans = MealPlan.objects.filter(user=request.user).order_by('id')
+    return paginated_json(request, meal_plans, [], MEAL_PLAN_FIELDS, fields, with_meal_plan_fields)
+
+# Get one of the user's meal plans
+@require_GET
+def mealplan_detail(request, mealplan_id):
+    if not request.user.is_authenticated:
+        return error('Log in to see your meal plans.', 401)
+    try:
+        fields = get_fields(request, MEAL_PLAN_FIELDS, list(MEAL_PLAN_FIELDS))
+    except ValueError as e:
+        return error(str(e), 400)
+
+    meal_plan = MealPlan.objects.filter(id=mealplan_id).values('user_id', 'version').first()
+    if meal_plan is None:
+        return error('Meal plan not found.', 404)
+    if meal_plan['user_id'] != request.user.id:
+        return error('You are not allowed to view this meal plan.', 403)
+
+    def build():
+        return serialize(with_meal_plan_fields(MealPlan.objects.all(), fields).get(id=mealplan_id), MEAL_PLAN_FIELDS, fields)
+
+    return conditional_json(request, make_etag(request.path, fields, meal_plan['version']), build)
+
+# Rank the recipes the user can see by how many of their ingredients a pantry covers,
+# e.g. ?ingredient=rice&ingredient=onion (or ?ingredient=rice,onion)
+@require_GET
+def pantry_match(request):
+    names = [name for value in request.GET.getlist('ingredient') for name in parse_pantry(value)]
+    if not names:
+        return error('List the ingredients you have with ?ingredient=.', 400)
+
+    recipes, unknown = match_pantry(names, request.user, get_page_size(request))
+    response = JsonResponse({
+        'results': [
+            {'id': recipe.id, 'name': recipe.name, 'matched': recipe.matched, 'total': recipe.total, 'missing': recipe.missing}
+            for recipe in recipes
+        ],
+        'unknown': unknown,
+    })
+    patch_vary_headers(response, ['Cookie'])
+    return response
@@ -0,0 +1,235 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import statistics
+import threading
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.db import connection, reset_queries
+from django.db.models import Count
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .models import Recipe, MealPlan, Ingredient, IngredientInRecipe
+from . import nutritionix
+
+# View benchmarks, run against whatever data is in the database (see datagen.py).
+#
+# Each view is requested once to warm up, then timed over a number of runs. The SQL
+# query count and peak Python memory (from tracemalloc, which slows code down) are
+# taken from separate runs so they don't skew the timings.
+#
+# The concurrency benchmark compares serving the nutrition lookup, which waits on the
+# Nutritionix API, through the WSGI handler from a fixed pool of worker threads with
+# serving it through the ASGI handler on a single event loop. The API is replaced by a
+# local stand-in that answers after a fixed delay.
+
+
+# Pick the largest meal plan, its owner and their recipe with the most ingredients to benchmark with
+def get_targets():
+    plan = MealPlan.objects.annotate(item_count=Count('meal_plan_items')).order_by('-item_count', 'id').first()
+    user = plan.user if plan else User.objects.order_by('id').first()
+    recipe = (
+        Recipe.objects
+        .filter(user=user)
+        .annotate(line_count=Count('recipe_ingredients'))
+        .order_by('-line_count', 'id')
+        .first()
+    )
+    return user, recipe, plan
+
+# Get the (name, url) of each view to benchmark, skipping views there is no data for
+def get_requests(recipe, plan):
+    requests = [
+        ('recipe_list', reverse('recipe_list')),
+        ('recipe_list_search', reverse('recipe_list') + '?q=chicken'),
+    ]
+    if recipe:
+        requests.append(('recipe_detail', reverse('recipe_detail', args=[recipe.id])))
+        requests.append(('edit_recipe', reverse('edit_recipe', args=[recipe.id])))
+    if plan:
+        requests.append(('mealplan_detail', reverse('mealplan_detail', args=[plan.id])))
+    return requests
+
+# Request a url a number of times, returning its timings, query count and peak memory
+def measure(client, url, runs=5):
+    response = client.get(url)  # Warm up
+    if response.status_code != 200:
+        raise RuntimeError(f'{url} returned {response.status_code}')
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # The query log is capped, so a full log from generating the data would hide the new queries
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        client.get(url)
+    query_count = len(queries)  # Count now, the next request clears the log
+
+    tracemalloc.start()
+    try:
+        client.get(url)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall_ms': {
+            'median': round(statistics.median(timings), 3),
+            'min': round(min(timings), 3),
+            'max': round(max(timings), 3),
+        },
+        'queries': query_count,
+        'peak_memory_kb': round(peak / 1024, 1),
+        'response_bytes': len(response.content),
+    }
+
+# Benchmark every view against the current data, returning one result per view
+def run_benchmarks(runs=5):
+    user, recipe, plan = get_targets()
+    client = Client()
+    if user:
+        client.force_login(user)
+
+    return [{'view': name, 'url': url, **measure(client, url, runs)} for name, url in get_requests(recipe, plan)]
+
+# Compare two sets of results, returning (size, view, metric, old, new, change) for each metric that got worse
+# by more than the threshold (e.g. 0.2 for 20%)
+def find_regressions(old_results, new_results, threshold=0.2):
+    old = {(result['size'], result['view']): result for result in old_results}
+    regressions = []
+    for result in new_results:
+        previous = old.get((result['size'], result['view']))
+        if not previous:
+            continue
+        for metric, old_value, new_value in [
+            ('wall_ms', previous['wall_ms']['median'], result['wall_ms']['median']),
+            ('queries', previous['queries'], result['queries']),
+            ('peak_memory_kb', previous['peak_memory_kb'], result['peak_memory_kb']),
+        ]:
+            if new_value > old_value * (1 + threshold):
+                change = (new_value - old_value) / old_value if old_value else float('inf')
+                regressions.append((result['size'], result['view'], metric, old_value, new_value, change))
+    return regressions
+
+
+# Start a local stand-in for the Nutritionix API that answers every query after a delay
+def start_stub_api(delay):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep connections alive
+
+        def do_POST(self):
+            query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['query']
+            time.sleep(delay)
+            data = json.dumps({'foods': [{'food_name': query, 'nf_calories': 100, 'nf_total_fat': 1,
+                                          'nf_total_carbohydrate': 10, 'nf_protein': 5}]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Create a user with recipes whose ingredient lines are all different, so no lookups are shared
+def create_lookup_recipes(recipes, lines):
+    user = User.objects.create_user(username='concurrency', password='password')
+    ingredients = Ingredient.objects.bulk_create(
+        [Ingredient(name=f'Ingredient {i}', search_name=f'ingredient {i}', measurement_unit='g') for i in range(recipes * lines)]
+    )
+    recipe_rows = Recipe.objects.bulk_create([
+        Recipe(user=user, name=f'Recipe {i}', difficulty=1, time_needed=timedelta(minutes=10), instructions='Cook')
+        for i in range(recipes)
+    ])
+    IngredientInRecipe.objects.bulk_create([
+        IngredientInRecipe(recipe=recipe, ingredient=ingredients[i * lines + line], measurement_amount=100)
+        for i, recipe in enumerate(recipe_rows)
+        for line in range(lines)
+    ])
+    return user, [reverse('get_nutri_data', args=[recipe.id]) for recipe in recipe_rows]
+
+# Helper to summarise the latencies (in seconds) of a run that took elapsed seconds
+def summarise(latencies, elapsed, failures):
+    latencies = sorted(latency * 1000 for latency in latencies)
+    return {
+        'requests': len(latencies),
+        'failures': failures,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'median': round(statistics.median(latencies), 1),
+            'p95': round(latencies[int(len(latencies) * 0.95) - 1 if len(latencies) > 1 else 0], 1),
+            'max': round(latencies[-1], 1),
+        },
+    }
+
+# Request every url through the WSGI handler from a pool of worker threads, each serving one request at a time
+def run_wsgi(user, urls, workers):
+    local = threading.local()
+
+    def request(url):
+        if not hasattr(local, 'client'):
+            local.client = Client()
+            local.client.force_login(user)
+        start = time.perf_counter()
+        response = local.client.get(url)
+        return time.perf_counter() - start, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(request, urls))
+    elapsed = time.perf_counter() - started
+    return summarise([latency for latency, _ in results], elapsed, sum(status != 200 for _, status in results))
+
+# Request every url through the ASGI handler on one event loop, with up to concurrency requests in flight
+async def run_asgi(user, urls, concurrency):
+    client = AsyncClient()
+    await client.aforce_login(user)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(url):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(url)
+            return time.perf_counter() - start, response.status_code
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(request(url) for url in urls))
+    elapsed = time.perf_counter() - started
+    return summarise([latency for latency, _ in results], elapsed, sum(status != 200 for _, status in results))
+
+# Compare WSGI worker threads with an ASGI event loop serving nutrition lookups that wait on the API for delay seconds
+def run_concurrency_benchmark(requests=64, workers=4, concurrency=32, delay=0.2, lines=3):
+    server = start_stub_api(delay)
+    nutritionix.reset_clients()  # Clients made before the API url was changed
+    try:
+        with override_settings(
+            NUTRITIONIX_URL=f'http://127.0.0.1:{server.server_port}/',
+            NUTRITION_CACHE_TTL=0,  # Every lookup goes to the API
+        ):
+            user, urls = create_lookup_recipes(requests, lines)
+            run_wsgi(user, urls[:workers], workers)  # Warm up
+            wsgi = run_wsgi(user, urls, workers)
+            asgi = asyncio.run(run_asgi(user, urls, concurrency))
+    finally:
+        nutritionix.reset_clients()
+        server.shutdown()
+        server.server_close()
+
+    return [
+        {'server': 'wsgi', 'workers': workers, 'concurrency': workers, **wsgi},
+        {'server': 'asgi', 'workers': 1, 'concurrency': concurrency, **asgi},
+    ]
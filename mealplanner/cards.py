@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Prefetch, aprefetch_related_objects, prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import RecipeTag
+
+# Rendered recipe cards for the recipe list, cached per recipe version.
+#
+# A card looks the same to everyone, so its HTML is cached under the recipe's id and
+# version, which changes whenever the recipe or its tags change (see versions.py).
+# Assembling a page costs one get_many from the cache, and only the cards that missed
+# have their tags loaded and their templates rendered. Cards live in the cache named by
+# RECIPE_CARD_CACHE_ALIAS, so they can share a backend with the page cache or get their own.
+
+CARD_TEMPLATE = 'mealplanner/recipe_card.html'
+
+
+def get_cache():
+    return caches[settings.RECIPE_CARD_CACHE_ALIAS]
+
+def get_card_key(recipe):
+    return f'recipe_card:{recipe.id}:{recipe.version}'
+
+# Get the rendered cards for a list of recipes, in the same order
+def render_recipe_cards(recipes):
+    keys = {recipe.id: get_card_key(recipe) for recipe in recipes}
+    cache = get_cache()
+    cards = cache.get_many(keys.values())
+
+    missed = [recipe for recipe in recipes if keys[recipe.id] not in cards]
+    if missed:
+        prefetch_related_objects(missed, Prefetch('tags', queryset=RecipeTag.objects.select_related('tag')))
+        rendered = {keys[recipe.id]: render_to_string(CARD_TEMPLATE, {'recipe': recipe}) for recipe in missed}
+        cache.set_many(rendered, settings.RECIPE_CARD_CACHE_TIMEOUT)
+        cards.update(rendered)
+
+    return [mark_safe(cards[keys[recipe.id]]) for recipe in recipes]
+
+# Async version of render_recipe_cards()
+async def arender_recipe_cards(recipes):
+    keys = {recipe.id: get_card_key(recipe) for recipe in recipes}
+    cache = get_cache()
+    cards = await cache.aget_many(keys.values())
+
+    missed = [recipe for recipe in recipes if keys[recipe.id] not in cards]
+    if missed:
+        await aprefetch_related_objects(missed, Prefetch('tags', queryset=RecipeTag.objects.select_related('tag')))
+        rendered = {keys[recipe.id]: render_to_string(CARD_TEMPLATE, {'recipe': recipe}) for recipe in missed}
+        await cache.aset_many(rendered, settings.RECIPE_CARD_CACHE_TIMEOUT)
+        cards.update(rendered)
+
+    return [mark_safe(cards[keys[recipe.id]]) for recipe in recipes]
@@ -0,0 +1,67 @@
+import numpy as np
+from django.conf import settings
+
+from .models import RecipeNutrition
+from .pagecache import invalidate_pages
+from .summaries import NUTRIENTS
+from .versions import touch_recipes
+
+# Nutrition traffic-light colours, worked out from the numbers rather than chosen by hand.
+#
+# Each nutrient has a (low, high) pair of thresholds in NUTRITION_COLOUR_THRESHOLDS:
+# values up to low are green, up to high amber, and above high red. A missing value
+# (or a nutrient without thresholds) is white. Colours are computed for a whole array
+# of values at once, so the same function serves a single save (see signals.py) and
+# the recompute_nutrition_colours command, which goes through the table in chunks and
+# writes back only the rows whose colours changed.
+
+COLOUR_FIELDS = {'calories': 'calorie_colour', 'fat': 'fat_colour', 'carbs': 'carbs_colour', 'protein': 'protein_colour'}
+
+
+# Colours for a (rows x nutrients) array of values, as a matching array of NUTRI_COLOURS values
+def get_colours(values):
+    values = np.asarray(values, dtype=float).reshape(-1, len(NUTRIENTS))
+    thresholds = np.array([settings.NUTRITION_COLOUR_THRESHOLDS.get(name, (np.nan, np.nan)) for name in NUTRIENTS], dtype=float)
+    colours = 1 + (values > thresholds[:, 0]).astype(int) + (values > thresholds[:, 1]).astype(int)
+    return np.where(np.isnan(values) | np.isnan(thresholds[:, 0]), 0, colours)
+
+# Set the colours of a RecipeNutrition from its values
+def set_colours(nutrition):
+    values = [np.nan if getattr(nutrition, name) is None else getattr(nutrition, name) for name in NUTRIENTS]
+    for name, colour in zip(NUTRIENTS, get_colours(values)[0].tolist()):
+        setattr(nutrition, COLOUR_FIELDS[name], colour)
+    return nutrition
+
+# Recompute the colours of every RecipeNutrition, batch_size rows at a time. Returns the number of rows changed.
+def recompute_colours(batch_size=1000):
+    fields = [COLOUR_FIELDS[name] for name in NUTRIENTS]
+    changed_ids = []
+    last_id = 0
+    while True:
+        rows = list(
+            RecipeNutrition.objects.filter(recipe_id__gt=last_id).order_by('recipe_id')
+            .values_list('recipe_id', *NUTRIENTS, *fields)[:batch_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        table = np.array(rows, dtype=float)
+        values, old = table[:, 1:1 + len(NUTRIENTS)], table[:, 1 + len(NUTRIENTS):].astype(int)
+        colours = get_colours(values)
+        changed = (colours != old).any(axis=1)
+        if not changed.any():
+            continue
+
+        updates = [
+            RecipeNutrition(recipe_id=int(recipe_id), **dict(zip(fields, row_colours)))
+            for recipe_id, row_colours in zip(table[changed, 0], colours[changed].tolist())
+        ]
+        RecipeNutrition.objects.bulk_update(updates, fields)
+        changed_ids += [nutrition.recipe_id for nutrition in updates]
+
+    # bulk_update skips the signals that bump recipe versions and refresh cached pages
+    if changed_ids:
+        touch_recipes(changed_ids)
+        invalidate_pages()
+    return len(changed_ids)
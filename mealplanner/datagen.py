@@ -0,0 +1,158 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from .models import (
+    Recipe, RecipeNutrition, Ingredient, IngredientInRecipe, Tag, RecipeTag, MealPlan, MealPlanItem,
+    hash_instructions, normalize_name, render_instructions,
+)
+from . import pantry, search
+from .colours import set_colours
+from .pagecache import invalidate_pages
+from .similarity import rebuild_similar_recipes
+from .summaries import rebuild_summary
+
+# Seeded synthetic data for benchmarks and local testing.
+#
+# Everything is written with bulk_create, which skips model signals, so the search
+# and pantry indexes, meal plan summaries and similar recipes are rebuilt, and cached
+# pages refreshed, at the end.
+
+# Preset dataset sizes
+SIZES = {
+    'small': {'users': 5, 'ingredients': 300, 'tags': 30, 'recipes': 200, 'plans': 10},
+    'medium': {'users': 20, 'ingredients': 2000, 'tags': 100, 'recipes': 2000, 'plans': 50},
+    'large': {'users': 50, 'ingredients': 10000, 'tags': 300, 'recipes': 20000, 'plans': 200},
+}
+
+ADJECTIVES = [
+    'Smoked', 'Roasted', 'Fresh', 'Spicy', 'Creamy', 'Crispy', 'Grilled', 'Sweet', 'Sour', 'Pickled', 'Baked',
+    'Braised', 'Toasted', 'Wild', 'Golden', 'Herby', 'Zesty', 'Garlic', 'Lemon', 'Honey',
+]
+FOODS = [
+    'chicken', 'beef', 'pork', 'lamb', 'salmon', 'cod', 'prawns', 'tofu', 'egg', 'rice', 'pasta', 'noodles',
+    'potato', 'sweet potato', 'carrot', 'onion', 'garlic', 'tomato', 'pepper', 'mushroom', 'spinach', 'kale',
+    'broccoli', 'cauliflower', 'chickpeas', 'lentils', 'beans', 'cheese', 'milk', 'butter', 'cream', 'yoghurt',
+    'flour', 'sugar', 'oats', 'apple', 'banana', 'lemon', 'lime', 'coconut milk',
+]
+DISHES = ['curry', 'stew', 'salad', 'soup', 'pie', 'bake', 'stir fry', 'risotto', 'tacos', 'traybake', 'wraps']
+TAG_WORDS = [
+    'Vegetarian', 'Vegan', 'Gluten free', 'Dairy free', 'Quick', 'Budget', 'Family', 'Spicy', 'Comfort food',
+    'Healthy', 'High protein', 'Low carb', 'Breakfast', 'Lunch', 'Dinner', 'Dessert', 'Snack', 'Batch cook',
+    'One pot', 'Summer', 'Winter', 'Italian', 'Indian', 'Mexican', 'Chinese', 'Thai', 'French', 'BBQ', 'Baking',
+    'Kids',
+]
+STEPS = [
+    'Preheat the oven to {n}0C.', 'Chop the {food} into small pieces.', 'Fry the {food} for {n} minutes.',
+    'Season with salt and pepper.', 'Add the {food} and stir well.', 'Simmer for {n}0 minutes.',
+    'Serve with **{food}**.', 'Leave to rest for {n} minutes before serving.',
+]
+
+
+# Give each generated name a numbered suffix once the word lists run out
+def unique_names(names, count):
+    return [
+        names[i % len(names)] if i < len(names) else f'{names[i % len(names)]} {i // len(names) + 1}'
+        for i in range(count)
+    ]
+
+# Usernames user0, user1, ... skipping any already taken, so data can be generated again into the same database
+def unique_usernames(count):
+    taken = set(User.objects.filter(username__startswith='user').values_list('username', flat=True))
+    names, i = [], 0
+    while len(names) < count:
+        if f'user{i}' not in taken:
+            names.append(f'user{i}')
+        i += 1
+    return names
+
+# Write seeded synthetic data of the given size, returning the number of rows of each kind created
+def generate(users, ingredients, tags, recipes, plans, seed=0, batch_size=1000):
+    rng = random.Random(seed)
+    password = make_password('password')
+
+    user_rows = User.objects.bulk_create(
+        [User(username=username, password=password) for username in unique_usernames(users)], batch_size=batch_size,
+    )
+
+    ingredient_names = [f'{adjective} {food}' for food in FOODS for adjective in [''] + ADJECTIVES]
+    ingredient_rows = Ingredient.objects.bulk_create(
+        [
+            Ingredient(name=name, search_name=normalize_name(name), measurement_unit=rng.choice(['g', 'g', 'ml', 'unit']))
+            for name in (name.strip().capitalize() for name in unique_names(ingredient_names, ingredients))
+        ],
+        batch_size=batch_size,
+    )
+    tag_rows = Tag.objects.bulk_create([Tag(name=name) for name in unique_names(TAG_WORDS, tags)], batch_size=batch_size)
+
+    # Recipes, with their instructions rendered up front as the forms would
+    recipe_rows = []
+    for i in range(recipes):
+        food = rng.choice(FOODS)
+        steps = [rng.choice(STEPS).format(food=rng.choice(FOODS), n=rng.randint(1, 9)) for _ in range(rng.randint(3, 8))]
+        instructions = '\n'.join(f'{n}. {step}' for n, step in enumerate(steps, 1))
+        recipe_rows.append(Recipe(
+            user=rng.choice(user_rows),
+            name=f'{rng.choice(ADJECTIVES)} {food} {rng.choice(DISHES)}',
+            difficulty=rng.randint(1, 3),
+            time_needed=timedelta(minutes=5 * rng.randint(2, 24)),
+            public=rng.random() < 0.6,
+            instructions=instructions,
+            instructions_html=render_instructions(instructions),
+            instructions_hash=hash_instructions(instructions),
+        ))
+    recipe_rows = Recipe.objects.bulk_create(recipe_rows, batch_size=batch_size)
+
+    # Ingredients, tags and (for most recipes) nutrition for each recipe
+    lines, recipe_tags, nutrition = [], [], []
+    for recipe in recipe_rows:
+        for ingredient in rng.sample(ingredient_rows, min(len(ingredient_rows), rng.randint(3, 12))):
+            lines.append(IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                            measurement_amount=rng.choice([1, 2, 3, 50, 100, 150, 200, 250, 400])))
+        for tag in rng.sample(tag_rows, min(len(tag_rows), rng.randint(0, 4))):
+            recipe_tags.append(RecipeTag(recipe=recipe, tag=tag))
+        if rng.random() < 0.8:
+            # bulk_create skips the signal that works out the colours
+            nutrition.append(set_colours(RecipeNutrition(
+                recipe=recipe,
+                calories=round(rng.uniform(150, 1100), 1),
+                fat=round(rng.uniform(2, 60), 1),
+                carbs=round(rng.uniform(5, 120), 1),
+                protein=round(rng.uniform(2, 60), 1),
+            )))
+    IngredientInRecipe.objects.bulk_create(lines, batch_size=batch_size)
+    RecipeTag.objects.bulk_create(recipe_tags, batch_size=batch_size)
+    RecipeNutrition.objects.bulk_create(nutrition, batch_size=batch_size)
+
+    # Meal plans filled with recipes their owner can see
+    public_recipes = [recipe for recipe in recipe_rows if recipe.public]
+    plan_rows = MealPlan.objects.bulk_create(
+        [MealPlan(user=rng.choice(user_rows), name=f'Week {i + 1}') for i in range(plans)], batch_size=batch_size,
+    )
+    items = []
+    for plan in plan_rows:
+        visible = public_recipes + [recipe for recipe in recipe_rows if recipe.user_id == plan.user_id and not recipe.public]
+        for _ in range(rng.randint(7, 21) if visible else 0):
+            items.append(MealPlanItem(meal_plan=plan, recipe=rng.choice(visible), weekday=rng.randint(0, 6)))
+    MealPlanItem.objects.bulk_create(items, batch_size=batch_size)
+
+    # bulk_create skips the signals that maintain these
+    search.rebuild_index()
+    pantry.clear_index()
+    rebuild_similar_recipes()
+    for plan in plan_rows:
+        rebuild_summary(plan)
+    invalidate_pages()
+
+    return {
+        'users': len(user_rows),
+        'ingredients': len(ingredient_rows),
+        'tags': len(tag_rows),
+        'recipes': len(recipe_rows),
+        'recipe_ingredients': len(lines),
+        'recipe_tags': len(recipe_tags),
+        'plans': len(plan_rows),
+        'plan_items': len(items),
+    }
@@ -0,0 +1,114 @@
+import json
+
+from django.db.models import Prefetch
+from django.utils.duration import duration_string
+
+from .models import Recipe, IngredientInRecipe, RecipeTag, MealPlan, MealPlanItem, RecipeNutrition
+from .colours import COLOUR_FIELDS
+from .importing import NUTRIENTS
+
+# Streaming JSON Lines export of a user's recipes and meal plans.
+#
+# Recipes are written in the format import_recipes reads, with a "type" key so meal
+# plans can share the file. Rows are read with a chunked iterator, and each chunk's
+# ingredients, tags and items are prefetched together, so memory use depends on the
+# chunk size rather than on how many recipes and plans the user has. Under ASGI the
+# async versions are used, since Django reads a sync generator to the end there before
+# sending any of it.
+
+EXPORT_TYPES = ('recipe', 'meal_plan')
+
+
+# Convert a recipe, with its ingredients, tags and nutrition prefetched, to an export record
+def serialize_recipe(recipe):
+    record = {
+        'type': 'recipe',
+        'id': recipe.id,
+        'name': recipe.name,
+        'difficulty': recipe.difficulty,
+        'time_needed': duration_string(recipe.time_needed),
+        'public': recipe.public,
+        'image_url': recipe.image_url,
+        'instructions': recipe.instructions,
+        'ingredients': [
+            {'name': line.ingredient.name, 'unit': line.ingredient.measurement_unit, 'amount': line.measurement_amount}
+            for line in recipe.recipe_ingredients.all()
+        ],
+        'tags': [recipe_tag.tag.name for recipe_tag in recipe.tags.all()],
+        'nutrition': None,
+    }
+    try:
+        nutrition = recipe.recipenutrition
+    except RecipeNutrition.DoesNotExist:
+        return record
+
+    record['nutrition'] = {
+        **{nutrient: getattr(nutrition, nutrient) for nutrient in NUTRIENTS},
+        **{field: getattr(nutrition, field) for field in COLOUR_FIELDS.values()},
+    }
+    return record
+
+# Convert a meal plan, with its items prefetched, to an export record
+def serialize_meal_plan(meal_plan):
+    return {
+        'type': 'meal_plan',
+        'id': meal_plan.id,
+        'name': meal_plan.name,
+        'items': [
+            {'weekday': item.weekday, 'recipe_id': item.recipe_id, 'recipe': item.recipe.name}
+            for item in meal_plan.meal_plan_items.all()
+        ],
+    }
+
+# A user's recipes, with what the export records need
+def get_recipes(user):
+    return (
+        Recipe.objects
+        .filter(user=user)
+        .select_related('recipenutrition')
+        .prefetch_related(
+            Prefetch('recipe_ingredients', queryset=IngredientInRecipe.objects.select_related('ingredient').order_by('id')),
+            Prefetch('tags', queryset=RecipeTag.objects.select_related('tag').order_by('id')),
+        )
+        .order_by('id')
+    )
+
+# A user's meal plans, with what the export records need
+def get_meal_plans(user):
+    return (
+        MealPlan.objects
+        .filter(user=user)
+        .prefetch_related(Prefetch(
+            'meal_plan_items',
+            queryset=MealPlanItem.objects.select_related('recipe').only('meal_plan_id', 'weekday', 'recipe__name').order_by('weekday', 'id'),
+        ))
+        .order_by('id')
+    )
+
+# Iterate over a user's recipes as export records, reading them a chunk at a time
+def iter_recipes(user, chunk_size=500):
+    for recipe in get_recipes(user).iterator(chunk_size=chunk_size):
+        yield serialize_recipe(recipe)
+
+# Iterate over a user's meal plans as export records, reading them a chunk at a time
+def iter_meal_plans(user, chunk_size=500):
+    for meal_plan in get_meal_plans(user).iterator(chunk_size=chunk_size):
+        yield serialize_meal_plan(meal_plan)
+
+# Stream a user's recipes and/or meal plans as JSON Lines
+def stream_export(user, types=EXPORT_TYPES, chunk_size=500):
+    if 'recipe' in types:
+        for record in iter_recipes(user, chunk_size):
+            yield json.dumps(record) + '\n'
+    if 'meal_plan' in types:
+        for record in iter_meal_plans(user, chunk_size):
+            yield json.dumps(record) + '\n'
+
+# Async version of stream_export()
+async def astream_export(user, types=EXPORT_TYPES, chunk_size=500):
+    if 'recipe' in types:
+        async for recipe in get_recipes(user).aiterator(chunk_size=chunk_size):
+            yield json.dumps(serialize_recipe(recipe)) + '\n'
+    if 'meal_plan' in types:
+        async for meal_plan in get_meal_plans(user).aiterator(chunk_size=chunk_size):
+            yield json.dumps(serialize_meal_plan(meal_plan)) + '\n'
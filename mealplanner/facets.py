@@ -0,0 +1,82 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .models import Recipe, RecipeTag, Tag
+from .filters import TIME_CATEGORIES, RecipeFilter, time_category_q
+from .pagecache import get_cache, get_generation
+
+# Facet counts for the recipe list filters.
+#
+# Each option is labelled with how many of the visible recipes it would give, taking the
+# other filters into account but not the one the option belongs to, so choosing a
+# different difficulty (or adding a tag) shows what it would change to. That takes one
+# grouped query per facet whatever the catalogue size, and only the most used tags are
+# counted, along with any chosen tags that aren't among them. The counts are cached per filter state and visitor, and belong to the same
+# generation as the cached pages, so saving any recipe data refreshes them.
+
+FACETS = ('difficulty', 'time_category', 'tags')
+
+
+# Helper to get the filter values that affect the counts, in a stable order
+def get_filter_state(data):
+    return {name: sorted(value for value in data.getlist(name) if value) for name in FACETS}
+
+def get_facet_key(state, user_id, generation):
+    digest = hashlib.sha256(repr((sorted(state.items()), user_id)).encode()).hexdigest()
+    return f'facets:{generation}:{digest}'
+
+# Get the ids of the visible recipes matching every filter but one
+def filtered_without(data, facet, visible):
+    data = data.copy()
+    data.pop(facet, None)
+    data.pop('sort', None)
+    return RecipeFilter(data, queryset=Recipe.objects.filter(visible)).qs.order_by().values('id')
+
+# Count the recipes for each filter option
+def count_facets(data, visible):
+    difficulty = (
+        Recipe.objects
+        .filter(id__in=filtered_without(data, 'difficulty', visible))
+        .values_list('difficulty')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    time_category = Recipe.objects.filter(id__in=filtered_without(data, 'time_category', visible)).aggregate(
+        **{value: Count('id', filter=time_category_q(value)) for value in TIME_CATEGORIES}
+    )
+    tags = list(
+        RecipeTag.objects
+        .filter(recipe_id__in=filtered_without(data, 'tags', visible))
+        .values_list('tag_id', 'tag__name')
+        .annotate(count=Count('id'))
+        .order_by('-count', 'tag__name')[:settings.TAG_FACET_LIMIT]
+    )
+
+    # Chosen tags outside the most used still need an option, or resubmitting the form would drop them
+    chosen = {int(value) for value in data.getlist('tags') if value.isdigit()} - {tag_id for tag_id, _, _ in tags}
+    if chosen:
+        counts = dict(
+            RecipeTag.objects
+            .filter(recipe_id__in=filtered_without(data, 'tags', visible), tag_id__in=chosen)
+            .values_list('tag_id')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        tags += [(tag.id, tag.name, counts.get(tag.id, 0)) for tag in Tag.objects.filter(id__in=chosen).order_by('name')]
+    return {'difficulty': dict(difficulty), 'time_category': time_category, 'tags': tags}
+
+# Get the facet counts for the recipes a user can see, from the cache if possible
+def get_facets(data, user):
+    visible = Q(public=True)
+    if user.is_authenticated:
+        visible |= Q(user=user)
+
+    cache = get_cache()
+    key = get_facet_key(get_filter_state(data), user.id, get_generation(cache))
+    facets = cache.get(key)
+    if facets is None:
+        facets = count_facets(data, visible)
+        cache.set(key, facets, settings.FACET_CACHE_TIMEOUT)
+    return facets
@@ -1,15 +1,36 @@
 from .models import DIFFICULTY_CHOICES, Recipe, Tag, Ingredient
 from datetime import timedelta
+from django.db.models import Q
 import django_filters
 
+# Time needed buckets: value -> (label, from, up to)
+TIME_CATEGORIES = {
+    'under_30': ('Under 30 mins', None, timedelta(minutes=30)),
+    '30_to_45': ('30-45 mins', timedelta(minutes=30), timedelta(minutes=45)),
+    'over_45': ('Over 45 minutes', timedelta(minutes=45), None),
+}
+
+# Helper to get the condition for a time needed bucket
+def time_category_q(value):
+    _, start, end = TIME_CATEGORIES[value]
+    condition = Q()
+    if start is not None:
+        condition &= Q(time_needed__gte=start)
+    if end is not None:
+        condition &= Q(time_needed__lt=end)
+    return condition
+
 class RecipeFilter(django_filters.FilterSet):
 
+    # Recipes with any of the chosen tags
+    tags = django_filters.ModelMultipleChoiceFilter(
+        field_name='tags__tag',
+        queryset=Tag.objects.all(),
+        label='Tags',
+    )
+
     time_category = django_filters.ChoiceFilter(
-        choices=[
-            ('under_30', 'Under 30 mins'),
-            ('30_to_45', '30-45 mins'),
-            ('over_45', 'Over 45 minutes'),
-        ],
+        choices=[(value, label) for value, (label, _, _) in TIME_CATEGORIES.items()],
         method='filter_by_time_needed',
         label='Time Needed',
     )
@@ -35,10 +56,24 @@ class RecipeFilter(django_filters.FilterSet):
         fields = ['difficulty', 'tags']
 
     def filter_by_time_needed(self, queryset, name, value):
-        if value == 'under_30':
-            return queryset.filter(time_needed__lt=timedelta(minutes=30))
-        elif value == '30_to_45':
-            return queryset.filter(time_needed__gte=timedelta(minutes=30), time_needed__lt=timedelta(minutes=45))
-        elif value == 'over_45':
-            return queryset.filter(time_needed__gte=timedelta(minutes=45))
-        return queryset
\ No newline at end of file
+        if value in TIME_CATEGORIES:
+            return queryset.filter(time_category_q(value))
+        return queryset
+
+    # Label each option with how many recipes it would give (see facets.py), and only offer
+    # the tags those recipes have, most used first. Without show_counts the options are limited
+    # the same way but left unlabelled.
+    def apply_facets(self, facets, show_counts=True):
+        def label(text, count):
+            return f'{text} ({count})' if show_counts else text
+
+        fields = self.form.fields
+        fields['difficulty'].choices = [fields['difficulty'].choices[0]] + [
+            (value, label(text, facets['difficulty'].get(value, 0))) for value, text in DIFFICULTY_CHOICES
+        ]
+        fields['time_category'].choices = [fields['time_category'].choices[0]] + [
+            (value, label(text, facets['time_category'].get(value, 0))) for value, (text, _, _) in TIME_CATEGORIES.items()
+        ]
+
+        # Any tag is still accepted, only the options shown are limited (chosen tags are always among them)
+        fields['tags'].widget.choices = [(tag_id, label(name, count)) for tag_id, name, count in facets['tags']]
@@ -1,7 +1,7 @@
 from django import forms
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit
-from .models import Recipe, MealPlan, RecipeNutrition, IngredientInRecipe, Tag, MealPlanItem
+from .models import DIFFICULTY_CHOICES, Recipe, MealPlan, RecipeNutrition, IngredientInRecipe, Tag, MealPlanItem
 
 # New recipe
 class RecipeForm(forms.ModelForm):
@@ -15,6 +15,11 @@ class RecipeForm(forms.ModelForm):
         self.helper.form_method = 'POST'
         self.helper.add_input(Submit('submit', 'Save Changes', css_class='btn btn-primary'))
 
+    def save(self, commit=True):
+        # Keep the pre-rendered instructions up to date
+        self.instance.refresh_instructions_html()
+        return super().save(commit)
+
 # New mealplan
 class MealPlanForm(forms.ModelForm):
     class Meta:
@@ -27,11 +32,37 @@ class MealPlanForm(forms.ModelForm):
         self.helper.form_method = 'POST'
         self.helper.add_input(Submit('submit', 'Save Changes', css_class='btn btn-primary'))
 
+# Generate a mealplan automatically (see planning.py)
+class GenerateMealPlanForm(forms.Form):
+    name = forms.CharField(max_length=255)
+    calories = forms.FloatField(min_value=0, required=False, label="Calories per day (Kcal)")
+    fat = forms.FloatField(min_value=0, required=False, label="Fat per day (grams)")
+    carbs = forms.FloatField(min_value=0, required=False, label="Carbs per day (grams)")
+    protein = forms.FloatField(min_value=0, required=False, label="Protein per day (grams)")
+    meals_per_day = forms.TypedChoiceField(choices=[(1, '1'), (2, '2'), (3, '3')], coerce=int, initial=1)
+    tags = forms.ModelMultipleChoiceField(queryset=Tag.objects.all(), required=False,
+                                          help_text="Only use recipes with any of these tags")
+    max_difficulty = forms.TypedChoiceField(choices=[('', 'Any')] + DIFFICULTY_CHOICES, coerce=int,
+                                            empty_value=None, required=False, label="Hardest difficulty")
+    max_time = forms.DurationField(required=False, label="Longest time needed", help_text="e.g. 00:45:00")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper = FormHelper()
+        self.helper.form_method = 'POST'
+        self.helper.add_input(Submit('submit', 'Generate mealplan', css_class='btn btn-primary'))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if all(cleaned_data.get(name) is None for name in ('calories', 'fat', 'carbs', 'protein')):
+            raise forms.ValidationError("Set a target for at least one of calories, fat, carbs or protein.")
+        return cleaned_data
+
 # Edit recipe nutrition
 class RecipeNutritionForm(forms.ModelForm):
     class Meta:
         model = RecipeNutrition
-        fields = ['calories', 'calorie_colour', 'fat', 'fat_colour', 'carbs', 'carbs_colour', 'protein', 'protein_colour']
+        fields = ['calories', 'fat', 'carbs', 'protein']
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -57,6 +88,11 @@ class RecipeInstructionsForm(forms.ModelForm):
         self.helper.form_method = 'POST'
         self.helper.add_input(Submit('submit', 'Save Changes', css_class='btn btn-primary'))
 
+    def save(self, commit=True):
+        # Re-render the instructions to HTML once here, rather than on every page view
+        self.instance.refresh_instructions_html()
+        return super().save(commit)
+
 class IngredientForm(forms.ModelForm):
     class Meta:
         model = IngredientInRecipe
@@ -0,0 +1,220 @@
+import csv
+from datetime import timedelta
+import json
+
+from django.db import transaction
+from django.utils.dateparse import parse_duration
+
+from .models import (
+    DIFFICULTY_CHOICES, MEASUREMENT_UNITS, Recipe, RecipeNutrition, Ingredient, IngredientInRecipe, Tag,
+    RecipeTag, hash_instructions, normalize_name, render_instructions,
+)
+from . import pantry, search
+from .colours import COLOUR_FIELDS, set_colours
+from .jobs import SIMILAR_REBUILD_JOB, enqueue
+from .pagecache import invalidate_pages
+
+# Bulk recipe import from JSON Lines or CSV.
+#
+# Records are read one at a time and imported in batches, each batch in its own
+# transaction with one bulk insert per table. Ingredients and tags are matched by name
+# (and unit) against in-memory maps of the existing rows, and any that are missing are
+# created in bulk, so memory grows with the number of distinct ingredients and tags but
+# not with the size of the input.
+#
+# A JSON Lines record looks like:
+#   {"name": "Pancakes", "difficulty": 1, "time_needed": 20, "public": true, "image_url": null,
+#    "instructions": "1. Mix\n2. Fry", "ingredients": [{"name": "Flour", "unit": "g", "amount": 200}],
+#    "tags": ["Breakfast"], "nutrition": {"calories": 520, "fat": 12, "carbs": 80, "protein": 18}}
+# time_needed is in minutes, or a duration string such as "01:30:00". Records with a "type"
+# other than "recipe" (e.g. meal plans in an export) are skipped.
+#
+# CSV files have one recipe per row, with the same columns as the record keys plus
+# calories, fat, carbs, protein for the nutrition. Nutrition colours are always worked
+# out from the values (see colours.py), so *_colour keys and columns are ignored.
+# Ingredients are written "200 g Flour; 2 unit Eggs" and tags "Breakfast; Quick".
+
+NUTRIENTS = ('calories', 'fat', 'carbs', 'protein')
+
+
+# Helper to parse a time in minutes or a duration string
+def parse_time_needed(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return timedelta(minutes=value)
+    if isinstance(value, str) and value.strip().isdigit():
+        return timedelta(minutes=int(value))
+    duration = parse_duration(value) if isinstance(value, str) else None
+    if duration is None:
+        raise ValueError(f'invalid time_needed {value!r}')
+    return duration
+
+# Helper to parse a yes/no value from JSON or CSV
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+# Check a record and convert it into the values to import, raising ValueError if it is invalid
+def parse_record(record):
+    if not isinstance(record, dict):
+        raise ValueError('record is not an object')
+
+    name = (record.get('name') or '').strip()
+    if not name:
+        raise ValueError('missing name')
+    try:
+        difficulty = int(record.get('difficulty'))
+    except (TypeError, ValueError):
+        raise ValueError(f'invalid difficulty {record.get("difficulty")!r}')
+    if difficulty not in dict(DIFFICULTY_CHOICES):
+        raise ValueError(f'invalid difficulty {difficulty}')
+
+    if not isinstance(record.get('ingredients') or [], list):
+        raise ValueError('ingredients is not a list')
+    if not isinstance(record.get('tags') or [], list):
+        raise ValueError('tags is not a list')
+
+    ingredients = []
+    for ingredient in record.get('ingredients') or []:
+        if not isinstance(ingredient, dict):
+            raise ValueError('ingredient is not an object')
+        unit = ingredient.get('unit')
+        if unit not in dict(MEASUREMENT_UNITS):
+            raise ValueError(f'invalid unit {unit!r}')
+        ingredient_name = (ingredient.get('name') or '').strip()
+        if not ingredient_name:
+            raise ValueError('ingredient without a name')
+        ingredients.append((ingredient_name, unit, float(ingredient.get('amount'))))
+
+    nutrition = record.get('nutrition')
+    if nutrition:
+        nutrition = {nutrient: float(nutrition[nutrient]) for nutrient in NUTRIENTS}
+
+    return {
+        'recipe': {
+            'name': name,
+            'difficulty': difficulty,
+            'time_needed': parse_time_needed(record.get('time_needed')),
+            'public': parse_bool(record.get('public', False)),
+            'image_url': record.get('image_url') or None,
+            'instructions': record.get('instructions') or '',
+        },
+        'ingredients': ingredients,
+        'tags': list(dict.fromkeys(str(tag).strip() for tag in record.get('tags') or [] if tag and str(tag).strip())),
+        'nutrition': nutrition or None,
+    }
+
+
+# Read JSON Lines records, yielding (line number, record) and (line number, ValueError) for bad lines
+def read_jsonl(file):
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f'invalid JSON: {e}')
+            continue
+        if isinstance(record, dict) and record.get('type', 'recipe') != 'recipe':
+            continue
+        yield line_number, record
+
+# Read CSV rows as records in the same shape as JSON Lines records, yielding (line number, record)
+def read_csv(file):
+    reader = csv.DictReader(file)
+    for row in reader:
+        record = {key: value for key, value in row.items() if key not in NUTRIENTS and key not in COLOUR_FIELDS.values()}
+        record['ingredients'] = [
+            dict(zip(('amount', 'unit', 'name'), item.strip().split(' ', 2)))
+            for item in (row.get('ingredients') or '').split(';') if item.strip()
+        ]
+        record['tags'] = (row.get('tags') or '').split(';')
+        if (row.get('calories') or '').strip():
+            record['nutrition'] = {field: row.get(field) for field in NUTRIENTS}
+        yield reader.line_num, record
+
+
+class RecipeImporter:
+    def __init__(self, user, batch_size=1000):
+        self.user = user
+        self.batch_size = batch_size
+
+        # Existing rows by name (and unit), the oldest wins if there are duplicates
+        self.ingredients = {
+            (name, unit): ingredient_id
+            for ingredient_id, name, unit in Ingredient.objects.order_by('-id').values_list('id', 'name', 'measurement_unit').iterator()
+        }
+        self.tags = {name: tag_id for tag_id, name in Tag.objects.order_by('-id').values_list('id', 'name').iterator()}
+        self.created_ingredients = 0
+        self.created_tags = 0
+
+    # Create any ingredients and tags used by the records that don't exist yet
+    def create_missing(self, records):
+        ingredients = {}
+        tags = {}
+        for record in records:
+            for name, unit, _ in record['ingredients']:
+                if (name, unit) not in self.ingredients:
+                    ingredients[(name, unit)] = Ingredient(name=name, measurement_unit=unit, search_name=normalize_name(name))
+            for name in record['tags']:
+                if name not in self.tags:
+                    tags[name] = Tag(name=name)
+
+        for ingredient in Ingredient.objects.bulk_create(ingredients.values(), batch_size=self.batch_size):
+            self.ingredients[(ingredient.name, ingredient.measurement_unit)] = ingredient.id
+        for tag in Tag.objects.bulk_create(tags.values(), batch_size=self.batch_size):
+            self.tags[tag.name] = tag.id
+        self.created_ingredients += len(ingredients)
+        self.created_tags += len(tags)
+        return list(ingredients), list(tags)
+
+    # Import one batch of parsed records in a single transaction, returning the new recipe ids
+    def import_batch(self, records):
+        new_ingredients, new_tags = [], []
+        try:
+            with transaction.atomic():
+                new_ingredients, new_tags = self.create_missing(records)
+                recipe_ids = self.create_recipes(records)
+        except Exception:
+            # Forget the rows that were rolled back
+            for key in new_ingredients:
+                self.ingredients.pop(key, None)
+            for name in new_tags:
+                self.tags.pop(name, None)
+            raise
+        return recipe_ids
+
+    # Insert the recipes and their ingredients, tags and nutrition, returning the new recipe ids
+    def create_recipes(self, records):
+        recipes = Recipe.objects.bulk_create([
+            Recipe(
+                user=self.user,
+                instructions_html=render_instructions(record['recipe']['instructions']),
+                instructions_hash=hash_instructions(record['recipe']['instructions']),
+                **record['recipe'],
+            )
+            for record in records
+        ], batch_size=self.batch_size)
+
+        lines, recipe_tags, nutrition = [], [], []
+        for recipe, record in zip(recipes, records):
+            for name, unit, amount in record['ingredients']:
+                lines.append(IngredientInRecipe(
+                    recipe_id=recipe.id, ingredient_id=self.ingredients[(name, unit)], measurement_amount=amount,
+                ))
+            recipe_tags += [RecipeTag(recipe_id=recipe.id, tag_id=self.tags[name]) for name in record['tags']]
+            if record['nutrition']:
+                nutrition.append(set_colours(RecipeNutrition(recipe_id=recipe.id, **record['nutrition'])))
+
+        IngredientInRecipe.objects.bulk_create(lines, batch_size=self.batch_size)
+        RecipeTag.objects.bulk_create(recipe_tags, batch_size=self.batch_size)
+        RecipeNutrition.objects.bulk_create(nutrition, batch_size=self.batch_size)
+
+        # bulk_create skips the signals that index recipes for search and the pantry, queue similar recipe
+        # refreshes and refresh cached pages. New recipes aren't in any meal plan yet, so there are no plan summaries to update.
+        recipe_ids = [recipe.id for recipe in recipes]
+        search.index_recipes(recipe_ids)
+        pantry.clear_index()
+        enqueue(SIMILAR_REBUILD_JOB, 'all')
+        invalidate_pages()
+        return recipe_ids
@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from .models import Job, Recipe, RecipeNutrition, IngredientInRecipe
+from .nutrition import normalize_line, lookup_lines, total_nutrition
+from .nutritionix import get_client, reset_clients
+from .similarity import refresh_similar_recipes, rebuild_similar_recipes
+
+# Background jobs, stored in the database and run by the run_jobs worker command.
+#
+# A job is a kind (the name of a handler below) and a key saying what it is for, e.g.
+# a recipe id. Only one job per kind and key can be waiting at a time, so queuing the
+# same work twice is a no-op, while work queued during a run gets a job of its own.
+# Workers claim a job by moving it from queued to running in a single conditional
+# update, so any number of worker processes can share the queue. A job that raises is
+# retried later with jittered exponential backoff until it runs out of attempts, and a
+# job left running by a worker that died is picked up again once it times out. Finished
+# jobs are kept for JOB_RETENTION seconds, for the status endpoint and the admin, then
+# idle workers delete them so the table doesn't grow forever.
+#
+# Each worker keeps one event loop for the async Nutritionix lookups, so the client's
+# keep-alive connections (which belong to a loop) are reused from job to job.
+
+logger = logging.getLogger('mealplanner.jobs')
+
+# Load environment variables from env file, for the Nutritionix credentials
+load_dotenv()
+
+NUTRITION_JOB = 'estimate_nutrition'
+SIMILAR_JOB = 'refresh_similar'  # Key is the recipe id
+SIMILAR_REBUILD_JOB = 'rebuild_similar'  # Key is always "all"
+
+# How often an idle worker deletes finished jobs past JOB_RETENTION, in seconds
+PURGE_INTERVAL = 60 * 60
+
+# This worker's event loop, see run_async()
+_runner = None
+
+
+# Run a coroutine to completion on this worker's event loop
+def run_async(coroutine):
+    global _runner
+    if _runner is None:
+        _runner = asyncio.Runner()
+    return _runner.run(coroutine)
+
+# Close the Nutritionix clients (and their connections on this worker's loop), then the loop itself
+def close_event_loop():
+    global _runner
+    reset_clients()
+    if _runner is not None:
+        _runner.close()
+        _runner = None
+
+# Estimate a recipe's nutrition from its ingredients and save it
+def estimate_nutrition(recipe_id):
+    recipe = Recipe.objects.filter(id=recipe_id).first()
+    if recipe is None:
+        return None  # Deleted since the job was queued
+
+    lines = [
+        normalize_line(ingredient.measurement_amount, ingredient.ingredient.measurement_unit, ingredient.ingredient.name)
+        for ingredient in IngredientInRecipe.objects.filter(recipe=recipe).select_related('ingredient')
+    ]
+    client = get_client(os.getenv('APP_ID'), os.getenv('APP_KEY'))
+    line_nutrition = lookup_lines(lines, lambda lines: run_async(client.nutrients_many(lines)))
+    if None in line_nutrition.values():
+        raise RuntimeError('Nutrition data is unavailable')
+
+    totals = total_nutrition(lines, line_nutrition)
+    nutrition = RecipeNutrition.objects.filter(recipe=recipe).first()
+    if nutrition is None:
+        nutrition = RecipeNutrition(recipe=recipe)
+    for name, value in totals.items():
+        setattr(nutrition, name, value)
+    nutrition.save()
+    return totals
+
+# Map of job kind -> handler(key), returning a JSON-serializable result
+JOB_HANDLERS = {
+    NUTRITION_JOB: estimate_nutrition,
+    SIMILAR_JOB: refresh_similar_recipes,
+    SIMILAR_REBUILD_JOB: lambda key: rebuild_similar_recipes(),
+}
+
+
+# Queue a job, or get the one already waiting for the same work (which is made due now)
+def enqueue(kind, key):
+    now = timezone.now()
+    job, created = Job.objects.get_or_create(
+        kind=kind, key=str(key), status='queued',
+        defaults={'run_after': now, 'max_attempts': settings.JOB_MAX_ATTEMPTS},
+    )
+    if not created and job.run_after > now:
+        Job.objects.filter(id=job.id, status='queued').update(run_after=now, updated_at=now)
+        job.run_after = now
+    return job
+
+# Queue jobs for many keys at once. Keys that already have a job waiting keep it (made due now, as
+# enqueue() does). Returns the number of jobs queued.
+def enqueue_many(kind, keys, batch_size=1000):
+    keys = list(dict.fromkeys(str(key) for key in keys))
+    created = 0
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        now = timezone.now()
+        with transaction.atomic():
+            waiting = Job.objects.filter(kind=kind, key__in=batch, status='queued')
+            waiting.filter(run_after__gt=now).update(run_after=now, updated_at=now)
+            existing = set(waiting.values_list('key', flat=True))
+
+            # A job queued elsewhere since the check above is skipped by ignore_conflicts, so count the
+            # queued jobs before and after rather than the jobs passed in
+            new_keys = [key for key in batch if key not in existing]
+            queued = Job.objects.filter(kind=kind, key__in=new_keys, status='queued')
+            before = queued.count()
+            Job.objects.bulk_create(
+                [Job(kind=kind, key=key, run_after=now, max_attempts=settings.JOB_MAX_ATTEMPTS) for key in new_keys],
+                ignore_conflicts=True,
+            )
+            created += queued.count() - before
+    return created
+
+# Queue the work of failed jobs again, as new jobs with a fresh set of attempts. Returns the number of jobs queued.
+def retry_failed_jobs(jobs):
+    work = set(jobs.filter(status='failed').values_list('kind', 'key'))
+    return sum(
+        enqueue_many(kind, [key for job_kind, key in work if job_kind == kind])
+        for kind in {kind for kind, _ in work}
+    )
+
+# Get the latest job for some work, or None if there has never been one
+def get_latest_job(kind, key):
+    return Job.objects.filter(kind=kind, key=str(key)).order_by('-id').first()
+
+# Describe a job for the status endpoint, with its result once it is done
+def get_job_status(job):
+    if job is None:
+        return {'status': None}
+    return {
+        'id': job.id,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.last_error,
+        'result': job.result if job.status == 'done' else None,
+    }
+
+# Name for a worker process in the job table
+def get_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+# Claim the next due job for a worker, or None if there isn't one. The conditional update
+# means that when two workers race for the same job only one of them gets it.
+def claim_job(worker):
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_after__lte=now).order_by('run_after', 'id')
+    for job_id in due.values_list('id', flat=True)[:settings.JOB_CLAIM_BATCH]:
+        claimed = Job.objects.filter(id=job_id, status='queued').update(
+            status='running', locked_by=worker, locked_at=now, attempts=F('attempts') + 1, updated_at=now,
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+# Delay before retrying a job that has failed the given number of times
+def get_backoff(attempts):
+    return random.uniform(0, settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1))
+
+# Record a failed attempt, queuing the job again unless it has run out of attempts. Like claim_job(), this
+# only changes the job if it is still the same run (another worker may have requeued and claimed it since),
+# returning whether it did.
+def retry_job(job, error):
+    now = timezone.now()
+    if job.attempts >= job.max_attempts:
+        changes = {'status': 'failed'}
+    else:
+        changes = {'status': 'queued', 'run_after': now + timedelta(seconds=get_backoff(job.attempts))}
+    changes.update(last_error=error, locked_by='', locked_at=None, updated_at=now)
+
+    this_run = Job.objects.filter(id=job.id, status='running', locked_at=job.locked_at)
+    try:
+        with transaction.atomic():
+            updated = this_run.update(**changes)
+    except IntegrityError:
+        # The same work was queued again while this job was running, leave it to that job
+        changes['status'] = 'failed'
+        changes.pop('run_after')
+        updated = this_run.update(**changes)
+
+    if updated:
+        for name, value in changes.items():
+            setattr(job, name, value)
+    return bool(updated)
+
+# Run a claimed job, storing its result or scheduling a retry
+def run_job(job):
+    started = time.monotonic()
+    try:
+        result = JOB_HANDLERS[job.kind](job.key)
+    except Exception as e:
+        logger.warning('Job %s (%s %s) failed on attempt %s: %s', job.id, job.kind, job.key, job.attempts, e)
+        retry_job(job, f'{type(e).__name__}: {e}')
+        return False
+
+    changes = {'status': 'done', 'result': result, 'last_error': '', 'locked_at': None, 'updated_at': timezone.now()}
+    if not Job.objects.filter(id=job.id, status='running', locked_at=job.locked_at).update(**changes):
+        logger.warning('Job %s (%s %s) finished after timing out, its result is dropped', job.id, job.kind, job.key)
+        return False
+    for name, value in changes.items():
+        setattr(job, name, value)
+    logger.info('Job %s (%s %s) done in %.2fs', job.id, job.kind, job.key, time.monotonic() - started)
+    return True
+
+# Give jobs left running by a worker that died (or hung) past JOB_TIMEOUT another go. When workers race
+# to do this, retry_job() lets only one of them requeue each job.
+def requeue_stale_jobs():
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT)
+    for job in Job.objects.filter(status='running', locked_at__lt=cutoff):
+        retry_job(job, f'Timed out on {job.locked_by}')
+
+# Delete finished (done or failed) jobs last updated more than JOB_RETENTION seconds ago. Returns the number deleted.
+def purge_finished_jobs():
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_RETENTION)
+    deleted, _ = Job.objects.filter(status__in=['done', 'failed'], updated_at__lt=cutoff).delete()
+    if deleted:
+        logger.info('Deleted %s finished jobs', deleted)
+    return deleted
+
+# Worker loop: run due jobs as they come, sleeping (and now and then purging old jobs) while the queue is empty. With burst, stop once
+# there are no due jobs left. Returns the number of jobs run.
+def work(worker=None, burst=False, poll_interval=None, max_jobs=None):
+    worker = worker or get_worker_name()
+    poll_interval = settings.JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+
+    ran = 0
+    purged_at = None
+    try:
+        while max_jobs is None or ran < max_jobs:
+            requeue_stale_jobs()
+            job = claim_job(worker)
+            if job is None:
+                if purged_at is None or time.monotonic() - purged_at >= PURGE_INTERVAL:
+                    purge_finished_jobs()
+                    purged_at = time.monotonic()
+                if burst:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            run_job(job)
+            ran += 1
+    finally:
+        close_event_loop()
+    return ran
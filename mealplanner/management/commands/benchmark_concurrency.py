@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from mealplanner.benchmarks import run_concurrency_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Compare WSGI worker threads with an ASGI event loop serving nutrition lookups against a slow stand-in API, '
+            'in a throwaway test database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=64, help='Number of lookups to serve')
+        parser.add_argument('--workers', type=int, default=4, help='Number of WSGI worker threads')
+        parser.add_argument('--concurrency', type=int, default=32, help='Number of requests in flight on the ASGI event loop')
+        parser.add_argument('--delay', type=float, default=0.2, help='Seconds the stand-in API takes to answer')
+        parser.add_argument('--lines', type=int, default=3, help='Ingredient lines per recipe, each one an API request')
+        parser.add_argument('--output', help='Write the results to this JSON file instead of stdout')
+
+    def handle(self, *args, **options):
+        if min(options['requests'], options['workers'], options['concurrency'], options['lines']) < 1:
+            raise CommandError('--requests, --workers, --concurrency and --lines must be at least 1.')
+        if connection.vendor != 'sqlite':
+            raise CommandError('The concurrency benchmark only supports SQLite.')
+
+        # Worker threads each have their own connection, so the test database has to be a file rather than in memory.
+        # Transactions take the write lock up front so concurrent cache writes wait for each other, and WAL mode
+        # keeps the commits cheap enough not to hide the time spent waiting on the API.
+        setup_test_environment()
+        with tempfile.TemporaryDirectory() as directory:
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            connection.settings_dict['OPTIONS'].update({
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 30,
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+            })
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                results = run_concurrency_benchmark(
+                    options['requests'], options['workers'], options['concurrency'], options['delay'], options['lines'],
+                )
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        wsgi, asgi = results
+        self.stderr.write(
+            f'WSGI ({wsgi["workers"]} threads): {wsgi["requests_per_second"]} requests/s, '
+            f'median {wsgi["latency_ms"]["median"]} ms\n'
+            f'ASGI (1 event loop, {asgi["concurrency"]} in flight): {asgi["requests_per_second"]} requests/s, '
+            f'median {asgi["latency_ms"]["median"]} ms'
+        )
+
+        report = json.dumps({**{name: options[name] for name in ('requests', 'delay', 'lines')}, 'results': results}, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report)
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from mealplanner.benchmarks import find_regressions, run_benchmarks
+from mealplanner.datagen import SIZES, generate
+
+
+# Get the current git commit, if there is one
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the main views against generated data of each size, in a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='small,medium', help=f'Comma separated dataset sizes ({", ".join(SIZES)})')
+        parser.add_argument('--runs', type=int, default=5, help='Number of timed requests per view')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data')
+        parser.add_argument('--output', help='Write the results to this JSON file instead of stdout')
+        parser.add_argument('--compare', help='JSON results from an earlier run to report regressions against')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Fractional increase counted as a regression')
+
+    def handle(self, *args, **options):
+        sizes = [size.strip() for size in options['sizes'].split(',') if size.strip()]
+        unknown = [size for size in sizes if size not in SIZES]
+        if unknown:
+            raise CommandError(f'Unknown sizes: {", ".join(unknown)}')
+
+        # Never touch the real database, the data is generated in a test database that is thrown away afterwards
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = []
+            for size in sizes:
+                call_command('flush', interactive=False, verbosity=0)
+                counts = generate(seed=options['seed'], **SIZES[size])
+                self.stderr.write(f'Benchmarking {size} dataset ({counts["recipes"]} recipes)')
+                results += [{'size': size, 'counts': counts, **result} for result in run_benchmarks(options['runs'])]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'commit': get_commit(),
+            'created': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'runs': options['runs'],
+            'seed': options['seed'],
+            'results': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stderr.write(f'Wrote {len(results)} results to {options["output"]}')
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)
+            regressions = find_regressions(previous['results'], results, options['threshold'])
+            for size, view, metric, old, new, change in regressions:
+                self.stderr.write(self.style.WARNING(f'{size} {view} {metric}: {old} -> {new} (+{change:.0%})'))
+            if not regressions:
+                self.stderr.write(self.style.SUCCESS(f'No regressions against {previous.get("commit") or options["compare"]}'))
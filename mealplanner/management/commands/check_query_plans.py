@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from mealplanner.queryplans import check_query_plans
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN QUERY PLAN on the hot lookups and fail if any of them reads a whole table'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Query plan checks only understand SQLite query plans.')
+
+        failed = []
+        for name, plan, full_scans in check_query_plans():
+            if full_scans:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f'FULL SCAN  {name}'))
+            else:
+                self.stdout.write(f'ok         {name}')
+
+            # Show the whole plan when it fails, or always with -v 2
+            if full_scans or options['verbosity'] > 1:
+                for step in plan:
+                    self.stdout.write(f'           {step}')
+
+        if failed:
+            raise CommandError(f'{len(failed)} queries fall back to a full scan: {", ".join(failed)}')
+        self.stdout.write(self.style.SUCCESS('All query plans use an index.'))
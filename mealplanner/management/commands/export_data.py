@@ -0,0 +1,34 @@
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from mealplanner.exporting import EXPORT_TYPES, stream_export
+
+
+class Command(BaseCommand):
+    help = "Export a user's recipes and meal plans as JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Username of the user to export')
+        parser.add_argument('--type', choices=EXPORT_TYPES, action='append', help='Only export this type (repeatable)')
+        parser.add_argument('--output', help='File to write to (default: standard output)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of rows read from the database at a time')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'User {options["user"]} does not exist.')
+
+        lines = stream_export(user, options['type'] or EXPORT_TYPES, options['chunk_size'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        count = 0
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line)
+                count += 1
+        self.stderr.write(self.style.SUCCESS(f'Exported {count} records to {options["output"]}.'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from mealplanner.datagen import SIZES, generate
+
+
+class Command(BaseCommand):
+    help = 'Generate seeded synthetic users, recipes, ingredients, tags and meal plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=SIZES, default='small', help='Preset dataset size')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data')
+        for name in SIZES['small']:
+            parser.add_argument(f'--{name}', type=int, default=None, help=f'Number of {name} (overrides --size)')
+
+    def handle(self, *args, **options):
+        counts = {name: options[name] if options[name] is not None else default for name, default in SIZES[options['size']].items()}
+        if (counts['recipes'] or counts['plans']) and not counts['users']:
+            raise CommandError('Recipes and meal plans need at least one user.')
+
+        with transaction.atomic():
+            created = generate(seed=options['seed'], **counts)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Generated ' + ', '.join(f'{count} {name.replace("_", " ")}' for name, count in created.items()) + '.'
+        ))
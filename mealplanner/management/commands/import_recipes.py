@@ -0,0 +1,65 @@
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from mealplanner.importing import RecipeImporter, parse_record, read_csv, read_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Import recipes with their ingredients, tags and nutrition from a JSON Lines or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for standard input')
+        parser.add_argument('--user', required=True, help='Username of the user who will own the recipes')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='File format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of recipes inserted per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'User {options["user"]} does not exist.')
+
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        reader = read_csv if file_format == 'csv' else read_jsonl
+
+        importer = RecipeImporter(user, options['batch_size'])
+        self.imported = self.skipped = 0
+        self.start = time.monotonic()
+
+        file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            batch = []
+            for line_number, record in reader(file):
+                try:
+                    if isinstance(record, Exception):
+                        raise record
+                    batch.append(parse_record(record))
+                except (ValueError, TypeError, KeyError, AttributeError) as e:
+                    self.skipped += 1
+                    self.stderr.write(f'Skipped line {line_number}: {e}')
+                    continue
+
+                if len(batch) >= options['batch_size']:
+                    self.import_batch(importer, batch)
+                    batch = []
+
+            if batch:
+                self.import_batch(importer, batch)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.imported} recipes ({self.skipped} skipped), creating {importer.created_ingredients} '
+            f'ingredients and {importer.created_tags} tags.'
+        ))
+
+    # Import a batch and report progress
+    def import_batch(self, importer, batch):
+        self.imported += len(importer.import_batch(batch))
+        elapsed = time.monotonic() - self.start
+        self.stdout.write(f'Imported {self.imported} recipes ({self.imported / elapsed:.0f}/s)')
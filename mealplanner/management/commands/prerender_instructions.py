@@ -0,0 +1,55 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from django.core.management.base import BaseCommand
+
+from mealplanner.models import Recipe, hash_instructions, render_instructions
+
+
+# Render one recipe's instructions in a worker process
+def render_one(item):
+    recipe_id, instructions, instructions_hash = item
+    return recipe_id, render_instructions(instructions), instructions_hash
+
+
+class Command(BaseCommand):
+    help = 'Pre-render recipe instructions from Markdown to HTML, spreading the work over a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of recipes rendered and saved per batch')
+        parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: one per CPU)')
+        parser.add_argument('--force', action='store_true', help='Re-render every recipe, even if it is up to date')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.workers = options['workers'] or os.cpu_count() or 1
+        recipes = Recipe.objects.only('id', 'instructions', 'instructions_hash').order_by('id')
+
+        rendered = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            batch = []
+            for recipe in recipes.iterator(chunk_size=batch_size):
+                # Only send recipes whose instructions have changed since they were last rendered
+                instructions_hash = hash_instructions(recipe.instructions)
+                if options['force'] or instructions_hash != recipe.instructions_hash:
+                    batch.append((recipe.id, recipe.instructions, instructions_hash))
+
+                if len(batch) >= batch_size:
+                    rendered += self.render_batch(pool, batch)
+                    batch = []
+
+            if batch:
+                rendered += self.render_batch(pool, batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered instructions for {rendered} recipes.'))
+
+    # Render a batch in the pool and write the results back in one bulk update
+    def render_batch(self, pool, batch):
+        chunksize = max(1, len(batch) // (self.workers * 4))
+        updated = [
+            Recipe(id=recipe_id, instructions_html=html, instructions_hash=instructions_hash)
+            for recipe_id, html, instructions_hash in pool.map(render_one, batch, chunksize=chunksize)
+        ]
+        Recipe.objects.bulk_update(updated, ['instructions_html', 'instructions_hash'])
+        self.stdout.write(f'Rendered {len(updated)} recipes')
+        return len(updated)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from mealplanner.models import MealPlan
+from mealplanner.summaries import rebuild_summary
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored nutrition and shopping list summaries of every meal plan'
+
+    def handle(self, *args, **options):
+        count = 0
+        for meal_plan in MealPlan.objects.iterator():
+            rebuild_summary(meal_plan)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the summaries of {count} meal plans.'))
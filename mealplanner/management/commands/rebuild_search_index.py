@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mealplanner import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text recipe search index from the recipe, tag and ingredient tables'
+
+    def handle(self, *args, **options):
+        if not search.search_index_available():
+            raise CommandError('The full-text search index is only available on SQLite.')
+
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} recipes.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from mealplanner.similarity import rebuild_similar_recipes
+
+
+class Command(BaseCommand):
+    help = 'Recompute the similar recipe suggestions for every recipe from their ingredients and tags'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Number of recipes compared with the rest at a time')
+
+    def handle(self, *args, **options):
+        count = rebuild_similar_recipes(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Found similar recipes for {count} recipes.'))
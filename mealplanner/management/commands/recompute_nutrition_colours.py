@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from mealplanner.colours import recompute_colours
+
+
+class Command(BaseCommand):
+    help = 'Recompute the nutrition traffic-light colours of every recipe from its values and the configured thresholds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of nutrition rows read and updated at a time')
+
+    def handle(self, *args, **options):
+        count = recompute_colours(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Updated the colours of {count} recipes.'))
@@ -0,0 +1,41 @@
+from multiprocessing import Process
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from mealplanner import jobs
+
+
+# Run one worker loop, returning the number of jobs it ran
+def run_worker(burst, poll_interval, max_jobs):
+    return jobs.work(burst=burst, poll_interval=poll_interval, max_jobs=max_jobs)
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the job queue, such as nutrition estimates, in one or more worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Number of worker processes to run')
+        parser.add_argument('--burst', action='store_true', help='Exit once there are no due jobs left, instead of waiting for more')
+        parser.add_argument('--poll-interval', type=float, default=None, help='Seconds to wait between checks of an empty queue')
+        parser.add_argument('--max-jobs', type=int, default=None, help='Exit after running this many jobs (per process)')
+
+    def handle(self, *args, **options):
+        worker_args = (options['burst'], options['poll_interval'], options['max_jobs'])
+        if options['processes'] <= 1:
+            ran = run_worker(*worker_args)
+            self.stdout.write(self.style.SUCCESS(f'Ran {ran} jobs.'))
+            return
+
+        # Each worker opens its own database connection rather than sharing this one
+        connections.close_all()
+        workers = [Process(target=run_worker, args=worker_args) for _ in range(options['processes'])]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+        self.stdout.write(self.style.SUCCESS(f'{len(workers)} workers stopped.'))
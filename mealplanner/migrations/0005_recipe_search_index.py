@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+# The full-text index is an SQLite FTS5 virtual table, other databases fall back to substring search
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS mealplanner_recipesearch "
+        "USING fts5(name, instructions, tags, ingredients, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+
+    # Index any recipes that already exist
+    schema_editor.execute('''
+        INSERT INTO mealplanner_recipesearch (rowid, name, instructions, tags, ingredients)
+        SELECT r.id, r.name, r.instructions,
+            COALESCE((SELECT group_concat(t.name, ' ') FROM mealplanner_recipetag rt
+                      JOIN mealplanner_tag t ON t.id = rt.tag_id WHERE rt.recipe_id = r.id), ''),
+            COALESCE((SELECT group_concat(i.name, ' ') FROM mealplanner_ingredientinrecipe ir
+                      JOIN mealplanner_ingredient i ON i.id = ir.ingredient_id WHERE ir.recipe_id = r.id), '')
+        FROM mealplanner_recipe r
+    ''')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    schema_editor.execute('DROP TABLE IF EXISTS mealplanner_recipesearch')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mealplanner', '0004_remove_recipenutrition_salt_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
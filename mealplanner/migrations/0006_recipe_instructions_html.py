@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mealplanner', '0005_recipe_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='instructions_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='instructions_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='recipenutrition',
+            name='calorie_colour',
+            field=models.IntegerField(choices=[(0, 'White'), (1, 'Green'), (2, 'Amber'), (3, 'Red')]),
+        ),
+        migrations.AlterField(
+            model_name='recipenutrition',
+            name='carbs_colour',
+            field=models.IntegerField(choices=[(0, 'White'), (1, 'Green'), (2, 'Amber'), (3, 'Red')]),
+        ),
+        migrations.AlterField(
+            model_name='recipenutrition',
+            name='fat_colour',
+            field=models.IntegerField(choices=[(0, 'White'), (1, 'Green'), (2, 'Amber'), (3, 'Red')]),
+        ),
+        migrations.AlterField(
+            model_name='recipenutrition',
+            name='protein_colour',
+            field=models.IntegerField(choices=[(0, 'White'), (1, 'Green'), (2, 'Amber'), (3, 'Red')]),
+        ),
+    ]
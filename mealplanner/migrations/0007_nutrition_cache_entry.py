@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mealplanner', '0006_recipe_instructions_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NutritionCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line', models.CharField(max_length=300, unique=True)),
+                ('calories', models.FloatField()),
+                ('fat', models.FloatField()),
+                ('carbs', models.FloatField()),
+                ('protein', models.FloatField()),
+                ('fetched_at', models.DateTimeField()),
+                ('last_used', models.DateTimeField(db_index=True)),
+                ('hits', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+# Build the summaries of existing meal plans
+def build_summaries(apps, schema_editor):
+    MealPlan = apps.get_model('mealplanner', 'MealPlan')
+    MealPlanItem = apps.get_model('mealplanner', 'MealPlanItem')
+    IngredientInRecipe = apps.get_model('mealplanner', 'IngredientInRecipe')
+    MealPlanDaySummary = apps.get_model('mealplanner', 'MealPlanDaySummary')
+    MealPlanIngredientTotal = apps.get_model('mealplanner', 'MealPlanIngredientTotal')
+    nutrients = ('calories', 'fat', 'carbs', 'protein')
+
+    for meal_plan in MealPlan.objects.all():
+        days = {weekday: MealPlanDaySummary(meal_plan=meal_plan, weekday=weekday) for weekday in range(7)}
+        daily_totals = (
+            MealPlanItem.objects
+            .filter(meal_plan=meal_plan)
+            .values('weekday')
+            .annotate(**{name: Sum(f'recipe__recipenutrition__{name}') for name in nutrients})
+        )
+        for totals in daily_totals:
+            for name in nutrients:
+                setattr(days[totals['weekday']], name, totals[name] or 0)
+        MealPlanDaySummary.objects.bulk_create(days.values())
+
+        ingredient_totals = (
+            IngredientInRecipe.objects
+            .filter(recipe__meal_plan_items__meal_plan=meal_plan)
+            .values('ingredient_id')
+            .annotate(total_amount=Sum('measurement_amount'), line_count=Count('id'))
+        )
+        MealPlanIngredientTotal.objects.bulk_create(
+            MealPlanIngredientTotal(meal_plan=meal_plan, **totals) for totals in ingredient_totals
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mealplanner', '0007_nutrition_cache_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MealPlanDaySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.IntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('calories', models.FloatField(default=0)),
+                ('fat', models.FloatField(default=0)),
+                ('carbs', models.FloatField(default=0)),
+                ('protein', models.FloatField(default=0)),
+                ('meal_plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_summaries', to='mealplanner.mealplan')),
+            ],
+            options={
+                'unique_together': {('meal_plan', 'weekday')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MealPlanIngredientTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.FloatField(default=0)),
+                ('line_count', models.IntegerField(default=0)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='meal_plan_totals', to='mealplanner.ingredient')),
+                ('meal_plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingredient_totals', to='mealplanner.mealplan')),
+            ],
+            options={
+                'unique_together': {('meal_plan', 'ingredient')},
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
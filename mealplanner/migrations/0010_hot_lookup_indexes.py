@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mealplanner', '0009_more_measurement_units'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mealplanitem',
+            index=models.Index(fields=['meal_plan', 'weekday', 'recipe'], name='mealplanitem_plan_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'difficulty'], name='recipe_user_difficulty_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'time_needed'], name='recipe_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('public', True)), fields=['id'], name='recipe_public_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('public', True)), fields=['difficulty'], name='recipe_public_difficulty_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('public', True)), fields=['time_needed'], name='recipe_public_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['name'], name='tag_name_idx'),
+        ),
+    ]
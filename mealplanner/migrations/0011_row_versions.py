@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:10
+
+import mealplanner.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mealplanner', '0010_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mealplan',
+            name='version',
+            field=models.CharField(default=mealplanner.models.new_version, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='version',
+            field=models.CharField(default=mealplanner.models.new_version, editable=False, max_length=32),
+        ),
+    ]
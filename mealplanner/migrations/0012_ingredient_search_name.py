@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:23
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+# Copy of mealplanner.models.normalize_name as it was when this migration was written
+def normalize_name(name):
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    return ' '.join(name.casefold().split())
+
+# Fill in the normalized names of existing ingredients
+def fill_search_names(apps, schema_editor):
+    Ingredient = apps.get_model('mealplanner', 'Ingredient')
+    ingredients = list(Ingredient.objects.only('id', 'name'))
+    for ingredient in ingredients:
+        ingredient.search_name = normalize_name(ingredient.name)
+    Ingredient.objects.bulk_update(ingredients, ['search_name'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mealplanner', '0011_row_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='search_name',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_search_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['search_name'], name='ingredient_search_name_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:09
+
+import numpy as np
+from django.db import migrations, models
+
+
+# The colour rule and thresholds as they were when this migration was written (see mealplanner/colours.py),
+# so later changes to either don't change what it does
+NUTRIENTS = ('calories', 'fat', 'carbs', 'protein')
+COLOUR_FIELDS = ('calorie_colour', 'fat_colour', 'carbs_colour', 'protein_colour')
+THRESHOLDS = np.array([(400, 700), (10, 21), (45, 90), (15, 30)], dtype=float)
+
+
+# Replace the hand-picked colours of existing nutrition with ones worked out from the values, a chunk at a time
+def fill_colours(apps, schema_editor):
+    RecipeNutrition = apps.get_model('mealplanner', 'RecipeNutrition')
+    last_id = 0
+    while True:
+        rows = list(RecipeNutrition.objects.filter(recipe_id__gt=last_id).order_by('recipe_id').only('recipe_id', *NUTRIENTS)[:1000])
+        if not rows:
+            break
+        last_id = rows[-1].recipe_id
+
+        values = np.array([[getattr(row, name) for name in NUTRIENTS] for row in rows], dtype=float)
+        colours = 1 + (values > THRESHOLDS[:, 0]).astype(int) + (values > THRESHOLDS[:, 1]).astype(int)
+        colours = np.where(np.isnan(values), 0, colours)
+        for row, row_colours in zip(rows, colours.tolist()):
+            for field, colour in zip(COLOUR_FIELDS, row_colours):
+                setattr(row, field, colour)
+        RecipeNutrition.objects.bulk_update(rows, COLOUR_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mealplanner', '0014_similar_recipes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipenutrition',
+            name='calorie_colour',
+            field=models.IntegerField(choices=[(0, 'White'), (1, 'Green'), (2, 'Amber'), (3, 'Red')], default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='recipenutrition',
+            name='carbs_colour',
+            field=models.IntegerField(choices=[(0, 'White'), (1, 'Green'), (2, 'Amber'), (3, 'Red')], default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='recipenutrition',
+            name='fat_colour',
+            field=models.IntegerField(choices=[(0, 'White'), (1, 'Green'), (2, 'Amber'), (3, 'Red')], default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='recipenutrition',
+            name='protein_colour',
+            field=models.IntegerField(choices=[(0, 'White'), (1, 'Green'), (2, 'Amber'), (3, 'Red')], default=0, editable=False),
+        ),
+        migrations.RunPython(fill_colours, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,11 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+import hashlib
+import markdown
+import unicodedata
+import uuid
+
 # Constants for choices
 DIFFICULTY_CHOICES = [
     (1, 'Easy'),
@@ -21,7 +26,11 @@ WEEKDAY_CHOICES = [
 
 MEASUREMENT_UNITS = [
     ('g', 'grams'),
+    ('kg', 'kilograms'),
     ('ml', 'milliliters'),
+    ('l', 'liters'),
+    ('tsp', 'teaspoons'),
+    ('tbsp', 'tablespoons'),
     ('unit', 'units'),
 ]
 
@@ -32,6 +41,24 @@ NUTRI_COLOURS = [
     (3, 'Red'),
 ]
 
+# Content hash used to tell whether the rendered instructions are up to date
+def hash_instructions(instructions):
+    return hashlib.sha256(instructions.encode()).hexdigest()
+
+# Convert recipe instructions from Markdown to HTML
+def render_instructions(instructions):
+    return markdown.markdown(instructions)
+
+# Normalize an ingredient name for prefix matching: accents removed, case folded and spaces collapsed
+def normalize_name(name):
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    return ' '.join(name.casefold().split())
+
+# A new row version, used in ETags and cache keys (see versions.py)
+def new_version():
+    return uuid.uuid4().hex
+
 class Recipe(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recipes')
     name = models.CharField(max_length=255)
@@ -40,20 +67,44 @@ class Recipe(models.Model):
     public = models.BooleanField(default=False)
     image_url = models.URLField(max_length=500, blank=True, null=True)
     instructions = models.TextField()
+    instructions_html = models.TextField(blank=True, editable=False)  # Instructions pre-rendered from Markdown
+    instructions_hash = models.CharField(max_length=64, blank=True, editable=False)  # Hash of the rendered instructions
+    version = models.CharField(max_length=32, default=new_version, editable=False)  # Changes with the recipe, its ingredients, tags or nutrition
+
+    class Meta:
+        # Recipe list sections filter by owner or visibility and sort by difficulty or time (then id).
+        # Public recipes are filtered with a plain boolean test, which only a partial index can serve.
+        indexes = [
+            models.Index(fields=['user', 'difficulty'], name='recipe_user_difficulty_idx'),
+            models.Index(fields=['user', 'time_needed'], name='recipe_user_time_idx'),
+            models.Index(fields=['id'], condition=models.Q(public=True), name='recipe_public_idx'),
+            models.Index(fields=['difficulty'], condition=models.Q(public=True), name='recipe_public_difficulty_idx'),
+            models.Index(fields=['time_needed'], condition=models.Q(public=True), name='recipe_public_time_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    # Re-render the instructions if they have changed since they were last rendered, returns True if they were
+    def refresh_instructions_html(self):
+        instructions_hash = hash_instructions(self.instructions)
+        if instructions_hash == self.instructions_hash:
+            return False
+
+        self.instructions_html = render_instructions(self.instructions)
+        self.instructions_hash = instructions_hash
+        return True
+
 class RecipeNutrition(models.Model):
     recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, primary_key=True)
     calories = models.FloatField()
-    calorie_colour = models.IntegerField(choices=NUTRI_COLOURS)
+    calorie_colour = models.IntegerField(choices=NUTRI_COLOURS, default=0, editable=False)  # Computed from the values, see colours.py
     fat = models.FloatField()
-    fat_colour = models.IntegerField(choices=NUTRI_COLOURS)
+    fat_colour = models.IntegerField(choices=NUTRI_COLOURS, default=0, editable=False)
     carbs = models.FloatField()
-    carbs_colour = models.IntegerField(choices=NUTRI_COLOURS)
+    carbs_colour = models.IntegerField(choices=NUTRI_COLOURS, default=0, editable=False)
     protein = models.FloatField()
-    protein_colour = models.IntegerField(choices=NUTRI_COLOURS)
+    protein_colour = models.IntegerField(choices=NUTRI_COLOURS, default=0, editable=False)
 
     def __str__(self):
         return self.recipe.name + ' Nutrition'
@@ -61,6 +112,10 @@ class RecipeNutrition(models.Model):
 class Ingredient(models.Model):
     name = models.CharField(max_length=255)
     measurement_unit = models.CharField(max_length=10, choices=MEASUREMENT_UNITS)
+    search_name = models.CharField(max_length=255, blank=True, editable=False)  # Normalized name, for autocomplete
+
+    class Meta:
+        indexes = [models.Index(fields=['search_name'], name='ingredient_search_name_idx')]  # Autocomplete prefix ranges
 
     def __str__(self):
         return self.name
@@ -76,6 +131,9 @@ class IngredientInRecipe(models.Model):
 class Tag(models.Model):
     name = models.CharField(max_length=100)
 
+    class Meta:
+        indexes = [models.Index(fields=['name'], name='tag_name_idx')]  # Tags are looked up by name when added
+
     def __str__(self):
         return self.name
 
@@ -92,6 +150,7 @@ class RecipeTag(models.Model):
 class MealPlan(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='meal_plans')
     name = models.CharField(max_length=255)
+    version = models.CharField(max_length=32, default=new_version, editable=False)  # Changes with the plan, its items or their recipes
 
     def __str__(self):
         return self.name
@@ -101,5 +160,103 @@ class MealPlanItem(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='meal_plan_items')
     weekday = models.IntegerField(choices=WEEKDAY_CHOICES)
 
+    class Meta:
+        # Covers a plan's items by day without reading the table
+        indexes = [models.Index(fields=['meal_plan', 'weekday', 'recipe'], name='mealplanitem_plan_day_idx')]
+
     def __str__(self):
         return f"{self.meal_plan.name} - {self.recipe.name} on {self.get_weekday_display()}"
+
+
+class NutritionCacheEntry(models.Model):
+    line = models.CharField(max_length=300, unique=True)  # Normalized "amount unit of ingredient" line
+    calories = models.FloatField()
+    fat = models.FloatField()
+    carbs = models.FloatField()
+    protein = models.FloatField()
+    fetched_at = models.DateTimeField()  # When the line was looked up, used for expiry
+    last_used = models.DateTimeField(db_index=True)  # Used to evict the least recently used lines
+    hits = models.PositiveIntegerField(default=0)  # How many upstream lookups this entry has saved
+
+    def __str__(self):
+        return self.line
+
+
+# Precomputed "similar recipes" suggestions for a recipe, best first (see similarity.py)
+class SimilarRecipe(models.Model):
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='similar_recipes')
+    similar = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()  # Cosine similarity of the two recipes' ingredient and tag vectors
+
+    class Meta:
+        unique_together = ('recipe', 'rank')  # Also the index the recipe page reads its suggestions with
+
+    def __str__(self):
+        return f"{self.recipe.name} - {self.similar.name}"
+
+
+# Background job states, see jobs.py
+JOB_STATUSES = [
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+]
+
+# A unit of background work, run by the run_jobs worker command (see jobs.py)
+class Job(models.Model):
+    kind = models.CharField(max_length=50)  # Name of the handler in jobs.JOB_HANDLERS
+    key = models.CharField(max_length=100)  # What the job is for, e.g. the recipe id, only one queued job per kind and key
+    status = models.CharField(max_length=10, choices=JOB_STATUSES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField()  # Not claimed before this time, used to back off retries
+    locked_by = models.CharField(max_length=100, blank=True)  # Worker running the job
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # Queuing the same work again while it is still waiting is a no-op
+            models.UniqueConstraint(fields=['kind', 'key'], condition=models.Q(status='queued'), name='job_one_queued_per_key'),
+        ]
+        indexes = [
+            # Workers look for the next queued job that is due
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+            models.Index(fields=['kind', 'key'], name='job_kind_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.key} ({self.status})"
+
+
+# Stored running totals for a meal plan, kept up to date by the signal handlers in signals.py
+class MealPlanDaySummary(models.Model):
+    meal_plan = models.ForeignKey(MealPlan, on_delete=models.CASCADE, related_name='day_summaries')
+    weekday = models.IntegerField(choices=WEEKDAY_CHOICES)
+    calories = models.FloatField(default=0)
+    fat = models.FloatField(default=0)
+    carbs = models.FloatField(default=0)
+    protein = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('meal_plan', 'weekday')
+
+    def __str__(self):
+        return f"{self.meal_plan.name} - {self.get_weekday_display()}"
+
+class MealPlanIngredientTotal(models.Model):
+    meal_plan = models.ForeignKey(MealPlan, on_delete=models.CASCADE, related_name='ingredient_totals')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='meal_plan_totals')
+    total_amount = models.FloatField(default=0)
+    line_count = models.IntegerField(default=0)  # Number of recipe ingredient lines adding to the total
+
+    class Meta:
+        unique_together = ('meal_plan', 'ingredient')
+
+    def __str__(self):
+        return f"{self.meal_plan.name} - {self.total_amount} {self.ingredient.measurement_unit} of {self.ingredient.name}"
@@ -0,0 +1,234 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import NutritionCacheEntry
+
+# Cache of Nutritionix lookups, one entry per normalized ingredient line.
+#
+# The same lines ("100 g of chicken breast") turn up in many recipes, so each line
+# is looked up upstream once and then served from the database until it expires.
+# Lookups of the same line that happen at the same time in this process share a
+# single upstream request.
+#
+# The a-prefixed functions are async versions for async views, using the async ORM and
+# an async fetch_many. They share the in-flight lookups with the blocking versions.
+
+# Map of our nutrient names to the Nutritionix response fields
+NUTRIENT_FIELDS = {
+    'calories': 'nf_calories',
+    'fat': 'nf_total_fat',
+    'carbs': 'nf_total_carbohydrate',
+    'protein': 'nf_protein',
+}
+
+# Counters for this process, see get_cache_stats()
+_stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0, 'upstream_requests': 0, 'upstream_seconds': 0.0}
+_stats_lock = threading.Lock()
+
+# Upstream lookups currently running in this process, keyed by line
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+# Build the cache key for an ingredient line, e.g. "100 g of chicken breast"
+def normalize_line(amount, unit, name):
+    name = ' '.join(str(name).lower().split())
+    return f'{float(amount):g} {unit} of {name}'
+
+# Add up the nutrients of every food in a Nutritionix response
+def sum_nutrients(response):
+    totals = dict.fromkeys(NUTRIENT_FIELDS, 0.0)
+    for food in response.get('foods', []):
+        for name, field in NUTRIENT_FIELDS.items():
+            totals[name] += food.get(field) or 0
+    return totals
+
+# Add up the nutrients of a recipe's lines (a line may appear more than once), given the nutrients of each line
+def total_nutrition(lines, line_nutrition):
+    totals = dict.fromkeys(NUTRIENT_FIELDS, 0.0)
+    for line in lines:
+        for name in NUTRIENT_FIELDS:
+            totals[name] += line_nutrition[line][name]
+    return {name: round(total, 1) for name, total in totals.items()}
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+# Fetch lines with fetch_many(lines) -> {line: response}, except lines that are already being fetched,
+# which wait for that result instead. Returns the responses and the set of lines this call fetched itself.
+def fetch_coalesced(lines, fetch_many):
+    futures = {}
+    leading = []
+    with _in_flight_lock:
+        for line in lines:
+            if line not in _in_flight:
+                _in_flight[line] = Future()
+                leading.append(line)
+            futures[line] = _in_flight[line]
+
+    if leading:
+        try:
+            started = time.monotonic()
+            responses = fetch_many(leading)
+            _count('upstream_seconds', time.monotonic() - started)
+            _count('upstream_requests', len(leading))
+            for line in leading:
+                futures[line].set_result(responses.get(line))
+        except Exception as e:
+            for line in leading:
+                futures[line].set_exception(e)
+            raise
+        finally:
+            with _in_flight_lock:
+                for line in leading:
+                    del _in_flight[line]
+
+    _count('coalesced', len(lines) - len(leading))
+    return {line: future.result() for line, future in futures.items()}, set(leading)
+
+# Async version of fetch_coalesced(), fetch_many is a coroutine function
+async def afetch_coalesced(lines, fetch_many):
+    futures = {}
+    leading = []
+    with _in_flight_lock:
+        for line in lines:
+            if line not in _in_flight:
+                _in_flight[line] = Future()
+                leading.append(line)
+            futures[line] = _in_flight[line]
+
+    if leading:
+        try:
+            started = time.monotonic()
+            responses = await fetch_many(leading)
+            _count('upstream_seconds', time.monotonic() - started)
+            _count('upstream_requests', len(leading))
+            for line in leading:
+                futures[line].set_result(responses.get(line))
+        except BaseException as e:
+            for line in leading:
+                futures[line].set_exception(e)
+            raise
+        finally:
+            with _in_flight_lock:
+                for line in leading:
+                    del _in_flight[line]
+
+    _count('coalesced', len(lines) - len(leading))
+    return {line: await asyncio.wrap_future(future) for line, future in futures.items()}, set(leading)
+
+# Store a freshly fetched line, evicting the least recently used lines if the cache is full
+def store_line(line, nutrients):
+    now = timezone.now()
+    NutritionCacheEntry.objects.update_or_create(
+        line=line,
+        defaults={**nutrients, 'fetched_at': now, 'last_used': now},
+    )
+
+    excess = NutritionCacheEntry.objects.count() - settings.NUTRITION_CACHE_MAX_ENTRIES
+    if excess > 0:
+        oldest = NutritionCacheEntry.objects.order_by('last_used').values_list('id', flat=True)[:excess]
+        NutritionCacheEntry.objects.filter(id__in=list(oldest)).delete()
+
+# Look up the nutrients for a list of normalized lines, calling fetch_many(lines) -> {line: Nutritionix response}
+# for cache misses. Returns a dict of line -> nutrients, with None for lines that could not be looked up.
+def lookup_lines(lines, fetch_many):
+    lines = list(dict.fromkeys(lines))
+    now = timezone.now()
+
+    # Fetch every cached line that hasn't expired in one query
+    fresh_after = now - timedelta(seconds=settings.NUTRITION_CACHE_TTL)
+    cached = NutritionCacheEntry.objects.filter(line__in=lines, fetched_at__gte=fresh_after)
+    results = {
+        entry.line: {name: getattr(entry, name) for name in NUTRIENT_FIELDS}
+        for entry in cached
+    }
+
+    if results:
+        _count('hits', len(results))
+        NutritionCacheEntry.objects.filter(line__in=results).update(last_used=now, hits=F('hits') + 1)
+
+    # Only the misses go upstream, all together
+    misses = [line for line in lines if line not in results]
+    if misses:
+        _count('misses', len(misses))
+        responses, fetched = fetch_coalesced(misses, fetch_many)
+
+        for line in misses:
+            if responses[line] is None:
+                _count('errors')
+                results[line] = None
+                continue
+
+            results[line] = sum_nutrients(responses[line])
+            if line in fetched:
+                store_line(line, results[line])
+
+    return results
+
+# Async version of store_line()
+async def astore_line(line, nutrients):
+    now = timezone.now()
+    await NutritionCacheEntry.objects.aupdate_or_create(
+        line=line,
+        defaults={**nutrients, 'fetched_at': now, 'last_used': now},
+    )
+
+    excess = await NutritionCacheEntry.objects.acount() - settings.NUTRITION_CACHE_MAX_ENTRIES
+    if excess > 0:
+        oldest = [entry_id async for entry_id in NutritionCacheEntry.objects.order_by('last_used').values_list('id', flat=True)[:excess]]
+        await NutritionCacheEntry.objects.filter(id__in=oldest).adelete()
+
+# Async version of lookup_lines(), awaiting fetch_many(lines) for the cache misses
+async def alookup_lines(lines, fetch_many):
+    lines = list(dict.fromkeys(lines))
+    now = timezone.now()
+
+    fresh_after = now - timedelta(seconds=settings.NUTRITION_CACHE_TTL)
+    cached = NutritionCacheEntry.objects.filter(line__in=lines, fetched_at__gte=fresh_after)
+    results = {
+        entry.line: {name: getattr(entry, name) for name in NUTRIENT_FIELDS}
+        async for entry in cached
+    }
+
+    if results:
+        _count('hits', len(results))
+        await NutritionCacheEntry.objects.filter(line__in=results).aupdate(last_used=now, hits=F('hits') + 1)
+
+    misses = [line for line in lines if line not in results]
+    if misses:
+        _count('misses', len(misses))
+        responses, fetched = await afetch_coalesced(misses, fetch_many)
+
+        for line in misses:
+            if responses[line] is None:
+                _count('errors')
+                results[line] = None
+                continue
+
+            results[line] = sum_nutrients(responses[line])
+            if line in fetched:
+                await astore_line(line, results[line])
+
+    return results
+
+# Statistics for this process along with totals for the whole cache
+def get_cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+
+    # Estimate the upstream time saved from the average time of the lookups we did make
+    upstream_requests = stats['upstream_requests']
+    average_seconds = stats['upstream_seconds'] / upstream_requests if upstream_requests else 0
+    stats['estimated_seconds_saved'] = round((stats['hits'] + stats['coalesced']) * average_seconds, 3)
+    stats['entries'] = NutritionCacheEntry.objects.count()
+    stats['total_hits'] = NutritionCacheEntry.objects.aggregate(total=Sum('hits'))['total'] or 0
+    return stats
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import random
+import ssl
+import threading
+import time
+import weakref
+
+import certifi
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+# Client for the Nutritionix natural language nutrients API.
+#
+# One client per set of credentials is shared by the whole process, so requests reuse
+# pooled keep-alive connections. Every request has connect and read timeouts, and
+# connection errors, timeouts, rate limiting and server errors are retried a bounded
+# number of times with jittered exponential backoff.
+#
+# Blocking requests go through the shared requests session. Async requests go through
+# a long-lived httpx client per event loop (its connections belong to the loop they were
+# opened on), so async views don't hold a thread while they wait for the API and still
+# reuse keep-alive connections from one lookup to the next.
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying, anything else is returned straight away
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class NutritionixClient:
+    def __init__(self, app_id, app_key, url=None, connect_timeout=None, read_timeout=None,
+                 retries=None, backoff=None, max_concurrency=None):
+        self.url = url or settings.NUTRITIONIX_URL
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else settings.NUTRITIONIX_CONNECT_TIMEOUT,
+            read_timeout if read_timeout is not None else settings.NUTRITIONIX_READ_TIMEOUT,
+        )
+        self.retries = retries if retries is not None else settings.NUTRITIONIX_RETRIES
+        self.backoff = backoff if backoff is not None else settings.NUTRITIONIX_BACKOFF
+        self.max_concurrency = max_concurrency or settings.NUTRITIONIX_MAX_CONCURRENCY
+
+        # Keep enough pooled connections open for a full fan-out
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.headers = {
+            'Content-Type': 'application/json',
+            'x-app-id': app_id or '',
+            'x-app-key': app_key or '',
+        }
+        self.session.headers.update(self.headers)
+
+        # Loading the certificates is slow, so the async clients share one SSL context
+        self.ssl_context = ssl.create_default_context(cafile=certifi.where())
+        self.async_clients = weakref.WeakKeyDictionary()  # Event loop -> httpx client
+        self.async_clients_lock = threading.Lock()
+
+    # Look up the nutrients for a natural language query, returning the response JSON or None on failure
+    def nutrients(self, query):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(self.url, data=json.dumps({'query': query}), timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()  # Raise an HTTPError for other bad responses (4xx)
+                    return response.json()
+                error = f'{response.status_code} response'
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error('Nutritionix request failed: %s', e)
+                return None
+
+            if attempt < self.retries:
+                logger.warning('Nutritionix request failed on attempt %s, retrying: %s', attempt + 1, error)
+                # Full jitter, so retrying workers don't all come back at the same moment
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+        logger.error('Nutritionix request failed: %s (gave up after %s attempts)', error, self.retries + 1)
+        return None
+
+    # Make an httpx client for async requests, to be used on one event loop
+    def make_async_client(self):
+        return httpx.AsyncClient(
+            headers=self.headers,
+            verify=self.ssl_context,
+            timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+            limits=httpx.Limits(max_connections=self.max_concurrency),
+        )
+
+    # Get the httpx client for the running event loop, making it on first use
+    def get_async_client(self):
+        loop = asyncio.get_running_loop()
+        with self.async_clients_lock:
+            client = self.async_clients.get(loop)
+            if client is None or client.is_closed:
+                client = self.async_clients[loop] = self.make_async_client()
+            return client
+
+    # Async version of nutrients(), with the same timeouts and retries
+    async def nutrients_async(self, query, client=None):
+        client = client or self.get_async_client()
+        for attempt in range(self.retries + 1):
+            try:
+                response = await client.post(self.url, content=json.dumps({'query': query}))
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()  # Raise an HTTPStatusError for other bad responses (4xx)
+                    return response.json()
+                error = f'{response.status_code} response'
+            except httpx.TransportError as e:
+                error = e
+            except (httpx.HTTPError, ValueError) as e:
+                logger.error('Nutritionix request failed: %s', e)
+                return None
+
+            if attempt < self.retries:
+                logger.warning('Nutritionix request failed on attempt %s, retrying: %s', attempt + 1, error)
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+        logger.error('Nutritionix request failed: %s (gave up after %s attempts)', error, self.retries + 1)
+        return None
+
+    # Look up many queries at once, at most max_concurrency in flight, returning a dict of query -> response
+    async def nutrients_many(self, queries):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        client = self.get_async_client()
+
+        async def bounded(query):
+            async with semaphore:
+                return await self.nutrients_async(query, client)
+
+        queries = list(dict.fromkeys(queries))
+        responses = await asyncio.gather(*(bounded(query) for query in queries))
+        return dict(zip(queries, responses))
+
+    # Close the httpx client of the running event loop, e.g. when the loop is shutting down
+    async def aclose(self):
+        with self.async_clients_lock:
+            client = self.async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    # Close the session, and the httpx clients of event loops that aren't running (a running loop's
+    # client can only be closed from that loop, with aclose())
+    def close(self):
+        self.session.close()
+        with self.async_clients_lock:
+            clients = list(self.async_clients.items())
+            self.async_clients.clear()
+        for loop, client in clients:
+            if not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(client.aclose())
+
+
+# Shared clients for this process, keyed by credentials
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Get the shared client for a set of credentials
+def get_client(app_id, app_key):
+    with _clients_lock:
+        client = _clients.get((app_id, app_key))
+        if client is None:
+            client = _clients[(app_id, app_key)] = NutritionixClient(app_id, app_key)
+        return client
+
+# Close and forget the shared clients, so the next ones are made with the current settings
+def reset_clients():
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
@@ -0,0 +1,176 @@
+import asyncio
+from functools import wraps
+import hashlib
+import inspect
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .models import new_version
+
+# Shared full-page cache for anonymous visitors.
+#
+# Anonymous visitors all see the same public recipe pages, so the rendered pages are
+# cached per path and query string. Every cached page belongs to a generation, and
+# saving any recipe data starts a new generation, so every page is refreshed.
+#
+# Each entry is kept for a grace period after it goes stale. When it does, one worker
+# takes a lock and renders the page again while the others carry on serving the stale
+# copy. When there is no copy at all (e.g. after an invalidation) the others wait briefly
+# for the lock holder instead of all rendering the page at once.
+#
+# Async views are wrapped with an async version of the same steps, using the cache's
+# async methods.
+
+GENERATION_KEY = 'pages:generation'
+
+
+def get_cache():
+    return caches[settings.PAGE_CACHE_ALIAS]
+
+# Get the current generation of cached pages, starting one if there is none
+def get_generation(cache):
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, new_version(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+async def aget_generation(cache):
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(GENERATION_KEY, new_version(), None)
+        generation = await cache.aget(GENERATION_KEY)
+    return generation
+
+# Start a new generation, so every cached page is rendered again. This happens straight away
+# and again once the current transaction commits, so a page rendered from the data as it was
+# before the commit can't stay cached.
+def invalidate_pages():
+    def start_generation():
+        get_cache().set(GENERATION_KEY, new_version(), None)
+
+    start_generation()
+    transaction.on_commit(start_generation)
+
+# Build the cache key for a request: its path and query string, in a stable order
+def get_page_key(request, generation):
+    query = sorted((key, value) for key in request.GET for value in request.GET.getlist(key))
+    digest = hashlib.sha256(repr((request.path, query)).encode()).hexdigest()
+    return f'pages:{generation}:{digest}'
+
+def build_response(entry, status):
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response['X-Page-Cache'] = status
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+# Build the cache entry for a rendered page, or None if it can't be shared
+def make_entry(response):
+    # Only cache complete, successful pages that don't set anything for this visitor
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return None
+
+    response['X-Page-Cache'] = 'miss'
+    patch_vary_headers(response, ['Cookie'])
+    return {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'fresh_until': time.time() + settings.PAGE_CACHE_TIMEOUT,
+    }
+
+# Render the page and cache it, if it can be shared
+def render_and_store(cache, key, view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    entry = make_entry(response)
+    if entry is not None:
+        cache.set(key, entry, settings.PAGE_CACHE_TIMEOUT + settings.PAGE_CACHE_GRACE)
+    return response
+
+async def arender_and_store(cache, key, view, request, *args, **kwargs):
+    response = await view(request, *args, **kwargs)
+    entry = make_entry(response)
+    if entry is not None:
+        await cache.aset(key, entry, settings.PAGE_CACHE_TIMEOUT + settings.PAGE_CACHE_GRACE)
+    return response
+
+# Decorator caching a view's pages for anonymous visitors
+def cache_anonymous_page(view):
+    if inspect.iscoroutinefunction(view):
+        return acache_anonymous_page(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated or not settings.PAGE_CACHE_TIMEOUT:
+            return view(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = get_page_key(request, get_generation(cache))
+        lock_key = key + ':lock'
+        entry = cache.get(key)
+        if entry is not None and entry['fresh_until'] > time.time():
+            return build_response(entry, 'hit')
+
+        # Only one worker renders the page at a time
+        if cache.add(lock_key, 1, settings.PAGE_CACHE_LOCK_TIMEOUT):
+            try:
+                return render_and_store(cache, key, view, request, *args, **kwargs)
+            finally:
+                cache.delete(lock_key)
+
+        # Someone else is rendering it: serve the stale copy, or wait for theirs
+        if entry is not None:
+            return build_response(entry, 'stale')
+        deadline = time.monotonic() + settings.PAGE_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return build_response(entry, 'hit')
+            if cache.get(lock_key) is None:
+                break
+
+        # The other worker failed or gave up, render it here
+        return render_and_store(cache, key, view, request, *args, **kwargs)
+
+    return wrapper
+
+# Async version of cache_anonymous_page(), waiting without blocking the event loop
+def acache_anonymous_page(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if request.method not in ('GET', 'HEAD') or user.is_authenticated or not settings.PAGE_CACHE_TIMEOUT:
+            return await view(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = get_page_key(request, await aget_generation(cache))
+        lock_key = key + ':lock'
+        entry = await cache.aget(key)
+        if entry is not None and entry['fresh_until'] > time.time():
+            return build_response(entry, 'hit')
+
+        if await cache.aadd(lock_key, 1, settings.PAGE_CACHE_LOCK_TIMEOUT):
+            try:
+                return await arender_and_store(cache, key, view, request, *args, **kwargs)
+            finally:
+                await cache.adelete(lock_key)
+
+        if entry is not None:
+            return build_response(entry, 'stale')
+        deadline = time.monotonic() + settings.PAGE_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            entry = await cache.aget(key)
+            if entry is not None:
+                return build_response(entry, 'hit')
+            if await cache.aget(lock_key) is None:
+                break
+
+        return await arender_and_store(cache, key, view, request, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,116 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+# Keyset (cursor) pagination for recipe listings.
+#
+# Instead of OFFSET, each page remembers the sort values of its last row and the
+# next page asks the database for rows that sort after them. The cost of a page
+# therefore stays the same however deep into the catalogue the user browses.
+
+
+# Helper to find the model field for a key, or None for an annotation
+def get_key_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+# Helper to turn a queryset's ordering into (field, descending) pairs, ending with the primary key as a tie-breaker
+def get_keyset_ordering(queryset):
+    model = queryset.model
+    pk_name = model._meta.pk.name
+    ordering = []
+
+    for name in queryset.query.order_by:
+        # Only plain field names can be used as keys (OrderingFilter only produces these)
+        if not isinstance(name, str):
+            continue
+
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if name == 'pk':
+            name = pk_name
+
+        # Annotations such as a search rank can be keys as well as model fields
+        if name not in queryset.query.annotations and get_key_field(model, name) is None:
+            continue
+
+        ordering.append((name, descending))
+
+        # Anything after the primary key can never change the order
+        if name == pk_name:
+            return ordering
+
+    ordering.append((pk_name, False))
+    return ordering
+
+# Encode the sort values of a row into an opaque, URL safe cursor
+def encode_cursor(obj, ordering):
+    values = []
+    for name, _ in ordering:
+        field = get_key_field(type(obj), name)
+        values.append(field.value_to_string(obj) if field else getattr(obj, name))
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+# Decode a cursor back into python values, returning None if it is missing or invalid
+def decode_cursor(cursor, model, ordering):
+    if not cursor:
+        return None
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(ordering):
+            return None
+        decoded = []
+        for (name, _), value in zip(ordering, values):
+            field = get_key_field(model, name)
+            decoded.append(field.to_python(value) if field else value)
+        return decoded
+    except (binascii.Error, ValueError, TypeError, ValidationError):
+        return None
+
+# Build the condition "sorts after these values" for a multi-column ordering
+def keyset_filter(ordering, values):
+    condition = Q()
+    equal_so_far = Q()
+
+    for (name, descending), value in zip(ordering, values):
+        lookup = 'lt' if descending else 'gt'
+        condition |= equal_so_far & Q(**{f'{name}__{lookup}': value})
+        equal_so_far &= Q(**{name: value})
+
+    return condition
+
+# Helper to order a queryset by its keys and skip to the cursor, returning the queryset and the keys
+def get_page_queryset(queryset, cursor):
+    ordering = get_keyset_ordering(queryset)
+    queryset = queryset.order_by(*[('-' if descending else '') + name for name, descending in ordering])
+
+    values = decode_cursor(cursor, queryset.model, ordering)
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(ordering, values))
+    return queryset, ordering
+
+# Helper to split off the extra row fetched to find out whether there is another page
+def split_page(rows, ordering, page_size):
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1], ordering)
+    return rows, next_cursor
+
+# Fetch one page of a queryset after the given cursor, returning the rows and the cursor for the next page
+def keyset_page(queryset, cursor, page_size):
+    queryset, ordering = get_page_queryset(queryset, cursor)
+
+    # Fetch one extra row to find out whether there is another page
+    return split_page(list(queryset[:page_size + 1]), ordering, page_size)
+
+# Async version of keyset_page()
+async def akeyset_page(queryset, cursor, page_size):
+    queryset, ordering = get_page_queryset(queryset, cursor)
+    return split_page([row async for row in queryset[:page_size + 1]], ordering, page_size)
@@ -0,0 +1,153 @@
+import heapq
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from .models import Recipe, Ingredient, IngredientInRecipe, normalize_name
+
+# "What can I cook" matching of a user's pantry against the recipes they can see.
+#
+# Each process keeps an in-memory inverted index from ingredient to the recipes that use
+# it, so a pantry is matched by counting, for each recipe, how many of its ingredients
+# turn up in the pantry's posting sets, without touching the database. Recipes are
+# ranked by the share of their ingredients the pantry covers, then by how few are
+# missing. Pantry items are matched by normalized ingredient name, so "rice" finds rice
+# in grams and in units.
+#
+# The index is built on first use. The signal handlers in signals.py keep this process's
+# index up to date as changes to recipes and their ingredients commit, and code that bulk edits
+# those rows must call clear_index() itself. Changes made by other processes are picked
+# up when the index is rebuilt, every PANTRY_INDEX_MAX_AGE seconds.
+
+
+class PantryIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built_at = time.monotonic()
+        self.recipes_by_ingredient = {}  # ingredient id -> {recipe id: number of lines}
+        self.ingredient_counts = Counter()  # recipe id -> number of different ingredients
+        self.ingredients_by_name = {}  # normalized name -> set of ingredient ids
+        self.ingredient_names = {}  # ingredient id -> normalized name
+        self.owners = {}  # recipe id -> (user id, public)
+
+    # Load every recipe, ingredient and recipe ingredient line
+    def build(self):
+        for recipe_id, user_id, public in Recipe.objects.values_list('id', 'user_id', 'public').iterator():
+            self.owners[recipe_id] = (user_id, public)
+        for ingredient_id, name in Ingredient.objects.values_list('id', 'search_name').iterator():
+            self.set_ingredient_name(ingredient_id, name)
+        for recipe_id, ingredient_id in IngredientInRecipe.objects.values_list('recipe_id', 'ingredient_id').iterator():
+            self.add_line(recipe_id, ingredient_id)
+        return self
+
+    def set_recipe(self, recipe_id, user_id, public):
+        with self.lock:
+            self.owners[recipe_id] = (user_id, public)
+
+    def remove_recipe(self, recipe_id):
+        with self.lock:
+            self.owners.pop(recipe_id, None)
+
+    def set_ingredient_name(self, ingredient_id, name):
+        with self.lock:
+            old = self.ingredient_names.get(ingredient_id)
+            if old is not None:
+                self.ingredients_by_name[old].discard(ingredient_id)
+            self.ingredient_names[ingredient_id] = name
+            self.ingredients_by_name.setdefault(name, set()).add(ingredient_id)
+
+    def add_line(self, recipe_id, ingredient_id):
+        with self.lock:
+            recipes = self.recipes_by_ingredient.setdefault(ingredient_id, {})
+            if recipe_id not in recipes:
+                self.ingredient_counts[recipe_id] += 1
+            recipes[recipe_id] = recipes.get(recipe_id, 0) + 1
+
+    def remove_line(self, recipe_id, ingredient_id):
+        with self.lock:
+            recipes = self.recipes_by_ingredient.get(ingredient_id, {})
+            if recipe_id not in recipes:
+                return
+            recipes[recipe_id] -= 1
+            if not recipes[recipe_id]:
+                del recipes[recipe_id]
+                self.ingredient_counts[recipe_id] -= 1
+                if not self.ingredient_counts[recipe_id]:
+                    del self.ingredient_counts[recipe_id]
+
+    # Rank the recipes a user can see by how much of them a pantry (a list of ingredient names) covers.
+    # Returns the (recipe id, matched, total) of the best matches, and the names that aren't ingredients.
+    def match(self, names, user_id, limit):
+        with self.lock:
+            ingredient_ids = set()
+            unknown = []
+            for name in names:
+                found = self.ingredients_by_name.get(normalize_name(name))
+                if found:
+                    ingredient_ids |= found
+                else:
+                    unknown.append(name)
+
+            matched = Counter()
+            for ingredient_id in ingredient_ids:
+                matched.update(self.recipes_by_ingredient.get(ingredient_id, {}).keys())
+
+            candidates = []
+            for recipe_id, count in matched.items():
+                owner, public = self.owners.get(recipe_id, (None, False))
+                if public or (user_id is not None and owner == user_id):
+                    candidates.append((recipe_id, count, self.ingredient_counts[recipe_id]))
+
+        # Most covered first, then fewest missing, then most matched
+        best = heapq.nsmallest(limit, candidates, key=lambda item: (-item[1] / item[2], item[2] - item[1], -item[1], item[0]))
+        return best, unknown
+
+
+# The index for this process, see get_index()
+_index = None
+_index_lock = threading.Lock()
+
+
+# Get this process's index, building it if there isn't one or it is older than PANTRY_INDEX_MAX_AGE
+def get_index():
+    global _index
+    index = _index
+    if index is None or time.monotonic() - index.built_at > settings.PANTRY_INDEX_MAX_AGE:
+        with _index_lock:
+            if _index is index:
+                _index = PantryIndex().build()
+            index = _index
+    return index
+
+# Get the index only if it has been built, for the signal handlers to update
+def get_built_index():
+    return _index
+
+# Forget the index, so it is built again from the database next time it is used
+def clear_index():
+    global _index
+    with _index_lock:
+        _index = None
+
+# Match a pantry for a user, returning the matching recipes (with matched, total and missing counts set)
+# best first, and the names that aren't ingredients
+def match_pantry(names, user, limit=None):
+    user_id = user.id if user.is_authenticated else None
+    best, unknown = get_index().match(names, user_id, limit or settings.RECIPE_PAGE_SIZE)
+
+    recipes = Recipe.objects.in_bulk([recipe_id for recipe_id, _, _ in best])
+    results = []
+    for recipe_id, matched, total in best:
+        recipe = recipes.get(recipe_id)
+        if recipe is not None:
+            recipe.matched, recipe.total, recipe.missing = matched, total, total - matched
+            results.append(recipe)
+    return results, unknown
+
+# Split a pantry typed as one ingredient per line or separated by commas into names
+def parse_pantry(text):
+    return list(dict.fromkeys(
+        name.strip() for line in text.splitlines() for name in line.split(',') if name.strip()
+    ))
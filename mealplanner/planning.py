@@ -0,0 +1,109 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+
+from .models import WEEKDAY_CHOICES, MealPlan, MealPlanItem, Recipe
+from .summaries import NUTRIENTS, rebuild_summary
+from .versions import touch_meal_plans
+
+# Automatic weekly meal plans that come close to daily nutrition targets.
+#
+# The nutrition of every recipe the user could plan is loaded into one NumPy matrix
+# (a row per recipe, a column per nutrient), so scoring every recipe for a slot is a
+# single vectorized sum. A day's score is its squared distance from the targets, with
+# each nutrient measured relative to its target so grams and calories count alike.
+# Days are first filled greedily, each meal aiming at its share of the day's targets,
+# then improved by repeatedly swapping each meal for the best recipe for that slot
+# until nothing gets closer. Recipes aren't repeated until every candidate is used (and
+# then are spread evenly, as a count of meals per recipe is kept), and picking at random among the few best options gives a different plan each time.
+
+
+# Load the recipes a user can plan, with nutrition, matching the constraints. Returns an array of
+# recipe ids and a matching (recipes x nutrients) matrix.
+def load_candidates(user, tags=(), max_difficulty=None, max_time=None):
+    recipes = Recipe.objects.filter(Q(public=True) | Q(user=user), recipenutrition__isnull=False)
+    if tags:
+        recipes = recipes.filter(id__in=Recipe.objects.filter(tags__tag__in=tags).values('id'))
+    if max_difficulty:
+        recipes = recipes.filter(difficulty__lte=max_difficulty)
+    if max_time:
+        recipes = recipes.filter(time_needed__lte=max_time)
+
+    rows = recipes.order_by('id').values_list('id', *(f'recipenutrition__{name}' for name in NUTRIENTS))
+    table = np.array(list(rows), dtype=float).reshape(-1, len(NUTRIENTS) + 1)
+    return table[:, 0].astype(int), table[:, 1:]
+
+# Squared relative distance of day totals (... x nutrients) from the targets, ignoring nutrients without one
+def score_days(totals, targets):
+    targets = np.asarray(targets, dtype=float)
+    weights = np.where(np.isnan(targets) | (targets <= 0), 0, 1 / np.where(targets > 0, targets, 1))
+    return (((totals - np.nan_to_num(targets)) * weights) ** 2).sum(axis=-1)
+
+# Pick recipes for every meal of the week. Returns a (days x meals_per_day) array of rows of the nutrition matrix.
+def plan_week(nutrition, targets, days=7, meals_per_day=1, choices=3, passes=5, rng=None):
+    rng = rng if rng is not None else np.random.default_rng()
+    count = len(nutrition)
+    picks = np.zeros((days, meals_per_day), dtype=int)
+    uses = np.zeros(count, dtype=int)  # How many meals each row is planned for
+
+    # Available rows for a slot: the least used ones, counting the slot's current recipe as already taken out
+    def available(uses, current=None):
+        if current is not None:
+            uses = uses.copy()
+            uses[current] -= 1
+        return uses == uses.min()
+
+    # Greedy fill: each meal brings the day closer to its share of the targets so far
+    for day in range(days):
+        total = np.zeros(nutrition.shape[1])
+        for meal in range(meals_per_day):
+            scores = score_days(total + nutrition, np.asarray(targets, dtype=float) * (meal + 1) / meals_per_day)
+            scores[~available(uses)] = np.inf
+            best = np.argsort(scores)[:min(choices, count)]
+            best = best[np.isfinite(scores[best])]
+            pick = rng.choice(best)
+            picks[day, meal] = pick
+            uses[pick] += 1
+            total += nutrition[pick]
+
+    # Improve: swap each meal for the recipe that brings its day closest to the targets
+    for _ in range(passes):
+        improved = False
+        for day in range(days):
+            for meal in range(meals_per_day):
+                current = picks[day, meal]
+                others = nutrition[picks[day]].sum(axis=0) - nutrition[current]
+                scores = score_days(others + nutrition, targets)
+                scores[~available(uses, current)] = np.inf
+                best = int(np.argmin(scores))
+                if scores[best] < scores[current]:
+                    uses[current] -= 1
+                    uses[best] += 1
+                    picks[day, meal] = best
+                    improved = True
+        if not improved:
+            break
+
+    return picks
+
+# Generate a meal plan for a user, aiming at per-day targets ({nutrient: amount}, missing nutrients are
+# ignored), and save it. Returns the new plan, or None if no recipe matches the constraints.
+def generate_meal_plan(user, name, targets, meals_per_day=1, tags=(), max_difficulty=None, max_time=None, seed=None):
+    recipe_ids, nutrition = load_candidates(user, tags, max_difficulty, max_time)
+    if not len(recipe_ids):
+        return None
+
+    target_vector = [np.nan if targets.get(name) is None else targets[name] for name in NUTRIENTS]
+    picks = plan_week(nutrition, target_vector, len(WEEKDAY_CHOICES), meals_per_day, rng=np.random.default_rng(seed))
+
+    with transaction.atomic():
+        plan = MealPlan.objects.create(user=user, name=name)
+        MealPlanItem.objects.bulk_create([
+            MealPlanItem(meal_plan=plan, recipe_id=int(recipe_ids[pick]), weekday=weekday)
+            for (weekday, _), day_picks in zip(WEEKDAY_CHOICES, picks)
+            for pick in day_picks
+        ])
+        # bulk_create skips the signals that maintain these
+        rebuild_summary(plan)
+        touch_meal_plans([plan.id])
+    return plan
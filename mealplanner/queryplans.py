@@ -0,0 +1,72 @@
+import re
+
+from django.db import connection
+
+from .models import (
+    Recipe, IngredientInRecipe, Tag, MealPlanItem, MealPlanDaySummary, MealPlanIngredientTotal, NutritionCacheEntry,
+)
+from .search import autocomplete_ingredients
+
+# Query plan checks for the hot lookups.
+#
+# Runs EXPLAIN QUERY PLAN on the ORM queries behind the busiest views and reports any
+# that read a whole table (or a whole index) instead of searching an index, so a
+# dropped index or a changed query shows up before it reaches production data sizes.
+# Only SQLite query plans are understood.
+
+
+# The hot lookups to check, as (name, queryset) pairs. The ids don't need to exist.
+def get_key_queries():
+    recipes = Recipe.objects.all()
+    public_recipes = recipes.filter(public=True).exclude(user_id=1)
+
+    return [
+        ('my recipes', recipes.filter(user_id=1).order_by('id')),
+        ('my recipes by difficulty', recipes.filter(user_id=1).order_by('difficulty', 'id')),
+        ('my recipes by time needed', recipes.filter(user_id=1).order_by('-time_needed', 'id')),
+        ('public recipes', public_recipes.order_by('id')),
+        ('public recipes by difficulty', public_recipes.order_by('difficulty', 'id')),
+        ('public recipes by time needed', public_recipes.order_by('time_needed', 'id')),
+        ('recipe ingredients', IngredientInRecipe.objects.filter(recipe_id=1).select_related('ingredient')),
+        ('tag by name', Tag.objects.filter(name='Vegan')),
+        ('ingredient autocomplete', autocomplete_ingredients('chick')),
+        ('meal plan items', MealPlanItem.objects.filter(meal_plan_id=1).select_related('recipe')),
+        ('meal plan items on a day', MealPlanItem.objects.filter(meal_plan_id=1, weekday=0)),
+        ('meal plan day summaries', MealPlanDaySummary.objects.filter(meal_plan_id=1).order_by('weekday')),
+        ('meal plan ingredient totals', MealPlanIngredientTotal.objects.filter(meal_plan_id=1).select_related('ingredient')),
+        ('nutrition cache lines', NutritionCacheEntry.objects.filter(line__in=['100 g of rice'])),
+    ]
+
+# Get the detail lines of a queryset's SQLite query plan
+def explain_query(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[3] for row in cursor.fetchall()]
+
+# Get the names of the partial indexes, which only hold the rows matching their condition
+def get_partial_indexes():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'")
+        return {row[0] for row in cursor.fetchall()}
+
+# Find the steps of a query plan that read a whole table or index. Reading a whole partial index
+# only reads the rows that match its condition, so it doesn't count.
+def find_full_scans(plan, partial_indexes=()):
+    full_scans = []
+    for step in plan:
+        if not step.startswith('SCAN ') or 'VIRTUAL TABLE' in step or 'CONSTANT ROW' in step:
+            continue
+        match = re.search(r'USING (?:COVERING )?INDEX (\w+)', step)
+        if not match or match.group(1) not in partial_indexes:
+            full_scans.append(step)
+    return full_scans
+
+# Check every hot lookup, returning (name, plan, full scans) for each
+def check_query_plans():
+    partial_indexes = get_partial_indexes()
+    results = []
+    for name, queryset in get_key_queries():
+        plan = explain_query(queryset)
+        results.append((name, plan, find_full_scans(plan, partial_indexes)))
+    return results
@@ -0,0 +1,115 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.functions import Length
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe, RecipeTag, Tag, IngredientInRecipe, Ingredient, normalize_name
+
+# Full-text search over recipes, backed by an SQLite FTS5 index.
+#
+# The index is a virtual table with one row per recipe (rowid = recipe id) holding
+# the recipe name, instructions, tag names and ingredient names. It is created by a
+# migration and kept in sync by the signal handlers in signals.py.
+#
+# Ingredients are looked up as the user types by prefix matching their normalized names,
+# which is a range scan of the index on Ingredient.search_name.
+
+SEARCH_TABLE = 'mealplanner_recipesearch'
+
+# Column weights for BM25 ranking: name, instructions, tags, ingredients
+SEARCH_WEIGHTS = (10.0, 1.0, 5.0, 3.0)
+
+# Select the indexed text for recipes, used to fill the search table
+INDEX_SELECT_SQL = f'''
+    SELECT r.id, r.name, r.instructions,
+        COALESCE((SELECT group_concat(t.name, ' ') FROM {RecipeTag._meta.db_table} rt
+                  JOIN {Tag._meta.db_table} t ON t.id = rt.tag_id WHERE rt.recipe_id = r.id), ''),
+        COALESCE((SELECT group_concat(i.name, ' ') FROM {IngredientInRecipe._meta.db_table} ir
+                  JOIN {Ingredient._meta.db_table} i ON i.id = ir.ingredient_id WHERE ir.recipe_id = r.id), '')
+    FROM {Recipe._meta.db_table} r
+'''
+
+# The index is only available on SQLite, other databases fall back to a slower substring search
+def search_index_available():
+    return connection.vendor == 'sqlite'
+
+# Turn a user's search text into an FTS5 query that prefix matches every word
+def build_match_query(text):
+    words = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+# Re-index the given recipes, removing any that no longer exist
+def index_recipes(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids or not search_index_available():
+        return
+
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', recipe_ids)
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, name, instructions, tags, ingredients) '
+            f'{INDEX_SELECT_SQL} WHERE r.id IN ({placeholders})',
+            recipe_ids,
+        )
+
+# Remove recipes from the index
+def unindex_recipes(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids or not search_index_available():
+        return
+
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', recipe_ids)
+
+# Rebuild the whole index from scratch, returning the number of recipes indexed
+def rebuild_index():
+    if not search_index_available():
+        return 0
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(f'INSERT INTO {SEARCH_TABLE} (rowid, name, instructions, tags, ingredients) {INDEX_SELECT_SQL}')
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE}')
+        return cursor.fetchone()[0]
+
+# Filter a recipe queryset down to the search results, annotated with a search_rank and ordered best match first
+def search_recipes(queryset, text):
+    match = build_match_query(text)
+    if not match:
+        return queryset.none()
+
+    if not search_index_available():
+        return queryset.filter(
+            Q(name__icontains=text) | Q(instructions__icontains=text)
+        ).distinct().order_by('id')
+
+    # BM25 scores are negative, lower is a better match
+    weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+    rank = RawSQL(
+        f'SELECT bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH %s AND rowid = {Recipe._meta.db_table}.id',
+        (match,),
+        output_field=FloatField(),
+    )
+    matches = RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', (match,))
+
+    return queryset.filter(id__in=matches).annotate(search_rank=rank).order_by('search_rank', 'id')
+
+# Find the ingredients whose names start with the user's text, shortest first so an exact match comes top
+def autocomplete_ingredients(text, limit=20):
+    prefix = normalize_name(text)
+    if not prefix:
+        return Ingredient.objects.none()
+
+    # A range rather than startswith: SQLite's LIKE ignores case, so it can't use the index
+    return (
+        Ingredient.objects
+        .filter(search_name__gte=prefix, search_name__lt=prefix + '\U0010ffff')
+        .annotate(name_length=Length('search_name'))
+        .order_by('name_length', 'search_name', 'id')[:limit]
+    )
@@ -0,0 +1,112 @@
+import csv
+import json
+
+from django.db.models import Case, CharField, F, FloatField, Sum, Value, When
+
+from .models import IngredientInRecipe
+
+# Shopping lists combined across any number of meal plans.
+#
+# Amounts in compatible units are added together by converting them to a base unit
+# for their dimension (grams for weight, millilitres for volume) inside the grouped
+# query, then shown in the largest unit that reads naturally (e.g. 1.5 kg).
+#
+# The rows are read and written out a chunk at a time, with sync generators for WSGI
+# and async ones for ASGI (where Django reads a sync generator to the end before it
+# sends anything).
+
+# Conversion factors from each measurement unit to its base unit
+UNIT_CONVERSIONS = {
+    'g': ('g', 1.0),
+    'kg': ('g', 1000.0),
+    'ml': ('ml', 1.0),
+    'l': ('ml', 1000.0),
+    'tsp': ('ml', 5.0),
+    'tbsp': ('ml', 15.0),
+    'unit': ('unit', 1.0),
+}
+
+# Larger units to show base unit totals in, largest first
+DISPLAY_UNITS = {
+    'g': [('kg', 1000.0)],
+    'ml': [('l', 1000.0)],
+}
+
+
+# Total every ingredient used by the given meal plans in one grouped query, in base units
+def get_shopping_list(meal_plans):
+    unit = F('ingredient__measurement_unit')
+    base_unit = Case(
+        *[When(ingredient__measurement_unit=name, then=Value(base)) for name, (base, _) in UNIT_CONVERSIONS.items()],
+        default=unit,
+        output_field=CharField(),
+    )
+    factor = Case(
+        *[When(ingredient__measurement_unit=name, then=Value(factor)) for name, (_, factor) in UNIT_CONVERSIONS.items()],
+        default=Value(1.0),
+        output_field=FloatField(),
+    )
+
+    return (
+        IngredientInRecipe.objects
+        .filter(recipe__meal_plan_items__meal_plan__in=meal_plans)
+        .annotate(base_unit=base_unit)
+        .values('ingredient__name', 'base_unit')
+        .annotate(total_amount=Sum(F('measurement_amount') * factor))
+        .order_by('ingredient__name', 'base_unit')
+    )
+
+# Convert a total in a base unit to the largest unit it is at least one of
+def display_amount(amount, base_unit):
+    for unit, factor in DISPLAY_UNITS.get(base_unit, []):
+        if abs(amount) >= factor:
+            return round(amount / factor, 3), unit
+    return round(amount, 3), base_unit
+
+# Iterate over the shopping list rows of the given meal plans, without holding them all in memory
+def iter_shopping_list(meal_plans, chunk_size=2000):
+    for row in get_shopping_list(meal_plans).iterator(chunk_size=chunk_size):
+        amount, unit = display_amount(row['total_amount'], row['base_unit'])
+        yield {'ingredient': row['ingredient__name'], 'amount': amount, 'unit': unit}
+
+# Async version of iter_shopping_list()
+async def aiter_shopping_list(meal_plans, chunk_size=2000):
+    async for row in get_shopping_list(meal_plans).aiterator(chunk_size=chunk_size):
+        amount, unit = display_amount(row['total_amount'], row['base_unit'])
+        yield {'ingredient': row['ingredient__name'], 'amount': amount, 'unit': unit}
+
+
+# Pseudo-buffer for csv.writer, which hands back each line instead of storing it
+class Echo:
+    def write(self, value):
+        return value
+
+# Stream shopping list rows as CSV lines
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(['ingredient', 'amount', 'unit'])
+    for row in rows:
+        yield writer.writerow([row['ingredient'], row['amount'], row['unit']])
+
+# Stream shopping list rows as a JSON array, one row at a time
+def stream_json(rows):
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',' if i else '') + json.dumps(row)
+    yield ']'
+
+# Async version of stream_csv(), for rows from aiter_shopping_list()
+async def astream_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(['ingredient', 'amount', 'unit'])
+    async for row in rows:
+        yield writer.writerow([row['ingredient'], row['amount'], row['unit']])
+
+# Async version of stream_json(), for rows from aiter_shopping_list()
+async def astream_json(rows):
+    yield '['
+    i = 0
+    async for row in rows:
+        yield (',' if i else '') + json.dumps(row)
+        i += 1
+    yield ']'
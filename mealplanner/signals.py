@@ -0,0 +1,272 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import (
+    WEEKDAY_CHOICES, Recipe, RecipeTag, Tag, IngredientInRecipe, Ingredient, RecipeNutrition, MealPlan, MealPlanItem,
+    MealPlanDaySummary, new_version, normalize_name,
+)
+from . import pantry, search, summaries
+from .versions import touch_meal_plans, touch_recipes
+from .pagecache import invalidate_pages
+from .jobs import SIMILAR_JOB, enqueue
+from .colours import set_colours
+
+# Signal handlers that keep derived data in sync with the recipe tables
+
+
+# Keep the search index in sync when a recipe is saved or deleted
+@receiver(post_save, sender=Recipe)
+def index_saved_recipe(sender, instance, **kwargs):
+    search.index_recipes([instance.id])
+
+@receiver(post_delete, sender=Recipe)
+def unindex_deleted_recipe(sender, instance, **kwargs):
+    search.unindex_recipes([instance.id])
+
+# Re-index a recipe when its tags or ingredients change
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_delete, sender=RecipeTag)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def index_recipe_for_child(sender, instance, **kwargs):
+    search.index_recipes([instance.recipe_id])
+
+# Re-index every recipe using a tag or ingredient when it is renamed
+@receiver(post_save, sender=Tag)
+def index_recipes_for_tag(sender, instance, created, **kwargs):
+    if not created:
+        search.index_recipes(RecipeTag.objects.filter(tag=instance).values_list('recipe_id', flat=True))
+
+@receiver(post_save, sender=Ingredient)
+def index_recipes_for_ingredient(sender, instance, created, **kwargs):
+    if not created:
+        search.index_recipes(
+            IngredientInRecipe.objects.filter(ingredient=instance).values_list('recipe_id', flat=True).distinct()
+        )
+
+
+# Start every new meal plan with an empty summary for each day
+@receiver(post_save, sender=MealPlan)
+def create_mealplan_summary(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        MealPlanDaySummary.objects.bulk_create(
+            MealPlanDaySummary(meal_plan=instance, weekday=weekday) for weekday, _ in WEEKDAY_CHOICES
+        )
+
+# Remember the saved state of a row before it changes, so the summaries can be adjusted by the difference
+@receiver(pre_save, sender=MealPlanItem)
+def remember_mealplan_item(sender, instance, raw=False, **kwargs):
+    instance._summary_old = None
+    if instance.pk and not raw:
+        instance._summary_old = sender.objects.filter(pk=instance.pk).values('meal_plan_id', 'recipe_id', 'weekday').first()
+
+@receiver(pre_save, sender=IngredientInRecipe)
+def remember_ingredient_in_recipe(sender, instance, raw=False, **kwargs):
+    instance._summary_old = None
+    if instance.pk and not raw:
+        instance._summary_old = sender.objects.filter(pk=instance.pk).values('recipe_id', 'ingredient_id', 'measurement_amount').first()
+
+@receiver(pre_save, sender=RecipeNutrition)
+def remember_recipe_nutrition(sender, instance, raw=False, **kwargs):
+    instance._summary_old = None
+    if not raw:
+        instance._summary_old = sender.objects.filter(pk=instance.pk).values(*summaries.NUTRIENTS).first()
+
+# Work out the traffic-light colours from the values whenever nutrition is saved
+@receiver(pre_save, sender=RecipeNutrition)
+def colour_recipe_nutrition(sender, instance, raw=False, **kwargs):
+    if not raw:
+        set_colours(instance)
+
+# Update the meal plan summaries when a recipe is planned, moved or removed
+@receiver(post_save, sender=MealPlanItem)
+def update_summary_for_item(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    old = getattr(instance, '_summary_old', None)
+    if old and old['meal_plan_id'] == instance.meal_plan_id and old['recipe_id'] == instance.recipe_id:
+        if old['weekday'] != instance.weekday:
+            summaries.move_planned_recipe(instance.meal_plan_id, instance.recipe_id, old['weekday'], instance.weekday)
+        return
+
+    if old:
+        summaries.apply_planned_recipe(old['meal_plan_id'], old['weekday'], old['recipe_id'], -1)
+    summaries.apply_planned_recipe(instance.meal_plan_id, instance.weekday, instance.recipe_id, 1)
+
+@receiver(post_delete, sender=MealPlanItem)
+def update_summary_for_deleted_item(sender, instance, **kwargs):
+    summaries.apply_planned_recipe(instance.meal_plan_id, instance.weekday, instance.recipe_id, -1)
+
+# Update the summaries of every plan using a recipe when its ingredients change
+@receiver(post_save, sender=IngredientInRecipe)
+def update_summary_for_ingredient(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    new = (instance.ingredient_id, float(instance.measurement_amount))
+    old = getattr(instance, '_summary_old', None)
+    if old and old['recipe_id'] != instance.recipe_id:
+        summaries.apply_ingredient_change(old['recipe_id'], (old['ingredient_id'], old['measurement_amount']), None)
+        summaries.apply_ingredient_change(instance.recipe_id, None, new)
+    elif old:
+        summaries.apply_ingredient_change(instance.recipe_id, (old['ingredient_id'], old['measurement_amount']), new)
+    else:
+        summaries.apply_ingredient_change(instance.recipe_id, None, new)
+
+@receiver(post_delete, sender=IngredientInRecipe)
+def update_summary_for_deleted_ingredient(sender, instance, **kwargs):
+    summaries.apply_ingredient_change(instance.recipe_id, (instance.ingredient_id, float(instance.measurement_amount)), None)
+
+# Update the summaries of every plan using a recipe when its nutrition changes
+@receiver(post_save, sender=RecipeNutrition)
+def update_summary_for_nutrition(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    new = {name: float(getattr(instance, name)) for name in summaries.NUTRIENTS}
+    summaries.apply_nutrition_change(instance.recipe_id, getattr(instance, '_summary_old', None), new)
+
+@receiver(post_delete, sender=RecipeNutrition)
+def update_summary_for_deleted_nutrition(sender, instance, **kwargs):
+    old = {name: float(getattr(instance, name)) for name in summaries.NUTRIENTS}
+    summaries.apply_nutrition_change(instance.recipe_id, old, None)
+
+
+# Give recipes and meal plans a new version whenever they are saved
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=MealPlan)
+def bump_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.version = new_version()
+
+# A recipe is shown in the meal plans it is in, so they change with it
+@receiver(post_save, sender=Recipe)
+def touch_plans_for_recipe(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        touch_meal_plans(MealPlanItem.objects.filter(recipe=instance).values_list('meal_plan_id', flat=True).distinct())
+
+# Give a recipe a new version when its ingredients, tags or nutrition change
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_delete, sender=RecipeTag)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+@receiver(post_save, sender=RecipeNutrition)
+@receiver(post_delete, sender=RecipeNutrition)
+def touch_recipe_for_child(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_summary_old', None)
+    recipe_ids = {instance.recipe_id}
+    if old and 'recipe_id' in old:
+        recipe_ids.add(old['recipe_id'])
+    touch_recipes(recipe_ids)
+
+# Keep an ingredient's normalized name, used by the autocomplete, in step with its name
+@receiver(pre_save, sender=Ingredient)
+def normalize_ingredient_name(sender, instance, raw=False, **kwargs):
+    instance.search_name = normalize_name(instance.name)
+
+# Give every recipe using a tag or ingredient a new version when it is renamed
+@receiver(post_save, sender=Tag)
+def touch_recipes_for_tag(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        touch_recipes(RecipeTag.objects.filter(tag=instance).values_list('recipe_id', flat=True))
+
+@receiver(post_save, sender=Ingredient)
+def touch_recipes_for_ingredient(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        touch_recipes(IngredientInRecipe.objects.filter(ingredient=instance).values_list('recipe_id', flat=True).distinct())
+
+# Give a meal plan a new version when a recipe is planned, moved or removed
+@receiver(post_save, sender=MealPlanItem)
+@receiver(post_delete, sender=MealPlanItem)
+def touch_plan_for_item(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_summary_old', None)
+    touch_meal_plans({instance.meal_plan_id, old['meal_plan_id']} if old else {instance.meal_plan_id})
+
+
+# Queue a refresh of a recipe's similar recipe suggestions (see similarity.py) when its ingredients, tags
+# or visibility change. Queued refreshes of the same recipe are merged, so a burst of edits runs once.
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_public(sender, instance, raw=False, **kwargs):
+    instance._public_old = None
+    if instance.pk and not raw:
+        instance._public_old = sender.objects.filter(pk=instance.pk).values_list('public', flat=True).first()
+
+@receiver(post_save, sender=Recipe)
+def queue_similar_refresh_for_recipe(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw and instance._public_old is not None and instance._public_old != instance.public:
+        enqueue(SIMILAR_JOB, instance.id)
+
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_delete, sender=RecipeTag)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def queue_similar_refresh_for_child(sender, instance, raw=False, **kwargs):
+    if not raw:
+        enqueue(SIMILAR_JOB, instance.recipe_id)
+
+
+# Keep this process's pantry index (see pantry.py) in step with recipes and their ingredients. Changes
+# are applied when the transaction commits, so a rollback doesn't leave the index out of step.
+def update_pantry_on_commit(change):
+    def apply():
+        index = pantry.get_built_index()
+        if index:
+            change(index)
+    transaction.on_commit(apply)
+
+@receiver(post_save, sender=Recipe)
+def update_pantry_for_recipe(sender, instance, raw=False, **kwargs):
+    if not raw:
+        recipe_id, user_id, public = instance.id, instance.user_id, instance.public
+        update_pantry_on_commit(lambda index: index.set_recipe(recipe_id, user_id, public))
+
+@receiver(post_delete, sender=Recipe)
+def update_pantry_for_deleted_recipe(sender, instance, **kwargs):
+    recipe_id = instance.id
+    update_pantry_on_commit(lambda index: index.remove_recipe(recipe_id))
+
+@receiver(post_save, sender=IngredientInRecipe)
+def update_pantry_for_ingredient(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_summary_old', None)
+    recipe_id, ingredient_id = instance.recipe_id, instance.ingredient_id
+
+    def change(index):
+        if old:
+            index.remove_line(old['recipe_id'], old['ingredient_id'])
+        index.add_line(recipe_id, ingredient_id)
+    update_pantry_on_commit(change)
+
+@receiver(post_delete, sender=IngredientInRecipe)
+def update_pantry_for_deleted_ingredient(sender, instance, **kwargs):
+    recipe_id, ingredient_id = instance.recipe_id, instance.ingredient_id
+    update_pantry_on_commit(lambda index: index.remove_line(recipe_id, ingredient_id))
+
+@receiver(post_save, sender=Ingredient)
+def update_pantry_for_ingredient_name(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ingredient_id, name = instance.id, instance.search_name
+        update_pantry_on_commit(lambda index: index.set_ingredient_name(ingredient_id, name))
+
+
+# Refresh the cached anonymous pages whenever recipe data changes
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_delete, sender=RecipeTag)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+@receiver(post_save, sender=RecipeNutrition)
+@receiver(post_delete, sender=RecipeNutrition)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def invalidate_recipe_pages(sender, raw=False, **kwargs):
+    if not raw:
+        invalidate_pages()
@@ -0,0 +1,224 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
+
+from .models import Recipe, IngredientInRecipe, RecipeTag, SimilarRecipe
+from .pagecache import invalidate_pages
+
+# Precomputed "similar recipes" suggestions.
+#
+# Every recipe is a sparse vector with an entry for each of its ingredients and tags,
+# weighted by how rare the ingredient or tag is (so sharing saffron counts for more than
+# sharing salt), with tags counting for SIMILAR_TAG_WEIGHT of an ingredient. Vectors are
+# scaled to unit length, so the dot product of two recipes is their cosine similarity.
+#
+# The vectors are kept as NumPy arrays sorted both by recipe and by feature. The
+# similarities of a batch of recipes to every recipe come from pairing each entry in the
+# batch with the entries of the other recipes sharing its feature, then summing the
+# products per pair of recipes with bincount, so only recipes with something in common
+# are ever compared. The best public matches are stored in SimilarRecipe, and the recipe
+# page reads them with one indexed query.
+#
+# When a recipe's ingredients or tags change, a background job (see jobs.py) recomputes
+# its suggestions and slots it into, or out of, the suggestions of the recipes it is now
+# more or less similar to. Only the recipes sharing an ingredient or tag with it (the
+# posting lists of its features) are loaded for that, with the feature weights taken
+# from grouped counts over the whole table. Other lists aren't topped up when a recipe
+# leaves them, so the rebuild_similar_recipes command rebuilds everything from scratch
+# now and then.
+
+
+# Positions ptr[i]:ptr[i+1] for each i in rows, as one array, with the index into rows each one came from
+def expand_ranges(ptr, rows):
+    starts = ptr[rows]
+    lengths = ptr[rows + 1] - starts
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owners, np.repeat(starts, lengths) + offsets
+
+# Load the vectors of every recipe, or only of the recipes in a queryset (weighted as in the full set)
+def load_vectors(recipe_query=None):
+    ingredient_query = IngredientInRecipe.objects.all()
+    tag_query = RecipeTag.objects.all()
+    if recipe_query is not None:
+        ingredient_query = ingredient_query.filter(recipe_id__in=recipe_query.values('id'))
+        tag_query = tag_query.filter(recipe_id__in=recipe_query.values('id'))
+    recipes = (Recipe.objects.all() if recipe_query is None else recipe_query).order_by('id').values_list('id', 'public')
+    recipes = np.array(list(recipes), dtype=np.int64).reshape(-1, 2)
+    recipe_ids = recipes[:, 0]
+    ingredients = np.array(list(ingredient_query.values_list('recipe_id', 'ingredient_id')), dtype=np.int64).reshape(-1, 2)
+    tags = np.array(list(tag_query.values_list('recipe_id', 'tag_id')), dtype=np.int64).reshape(-1, 2)
+
+    # Tags are numbered after the ingredients, then features are renumbered from 0
+    tag_offset = ingredients[:, 1].max() + 1 if len(ingredients) else 0
+    features = np.concatenate([ingredients[:, 1], tags[:, 1] + tag_offset])
+    scale = np.concatenate([np.ones(len(ingredients)), np.full(len(tags), settings.SIMILAR_TAG_WEIGHT)])
+    rows = np.searchsorted(recipe_ids, np.concatenate([ingredients[:, 0], tags[:, 0]]))
+    feature_ids, features = np.unique(features, return_inverse=True)
+    feature_count = len(feature_ids)
+
+    # One entry per recipe and feature (a recipe can list an ingredient twice), sorted by recipe
+    keys, first = np.unique(rows * feature_count + features, return_index=True)
+    rows, features, scale = keys // max(feature_count, 1), keys % max(feature_count, 1), scale[first]
+
+    # Rarer features weigh more, counting every recipe rather than just the ones loaded
+    if recipe_query is None:
+        frequency = np.bincount(features, minlength=feature_count)
+        recipe_count = len(recipe_ids)
+    else:
+        frequency = count_feature_recipes(ingredient_query, tag_query, feature_ids, tag_offset)
+        recipe_count = Recipe.objects.count()
+    weights = (np.log((1 + recipe_count) / (1 + frequency)) + 1)[features] * scale
+
+    # Then every vector is scaled to unit length
+    norms = np.sqrt(np.bincount(rows, weights ** 2, minlength=len(recipe_ids)))
+    weights = weights / norms[rows]
+
+    by_feature = np.argsort(features, kind='stable')
+    return {
+        'recipe_ids': recipe_ids,
+        'public': recipes[:, 1].astype(bool),
+        'row_ptr': np.searchsorted(rows, np.arange(len(recipe_ids) + 1)),
+        'row_features': features,
+        'row_weights': weights,
+        'feature_ptr': np.searchsorted(features[by_feature], np.arange(feature_count + 1)),
+        'feature_rows': rows[by_feature],
+        'feature_weights': weights[by_feature],
+    }
+
+# Number of recipes in the whole table using each feature (given as sorted ids, see load_vectors()) of the
+# loaded ingredient and tag rows, with one grouped count per table
+def count_feature_recipes(ingredient_query, tag_query, feature_ids, tag_offset):
+    counts = dict(
+        IngredientInRecipe.objects.filter(ingredient_id__in=ingredient_query.values('ingredient_id'))
+        .values_list('ingredient_id').annotate(Count('recipe_id', distinct=True)).order_by()
+    )
+    counts.update(
+        (tag_id + tag_offset, count) for tag_id, count in
+        RecipeTag.objects.filter(tag_id__in=tag_query.values('tag_id')).values_list('tag_id').annotate(Count('id')).order_by()
+    )
+    return np.array([counts.get(feature_id, 0) for feature_id in feature_ids.tolist()], dtype=np.int64)
+
+# Cosine similarity of each of a batch of recipes (rows of the vectors) to every recipe, as a (batch x recipes) matrix
+def get_similarities(vectors, rows):
+    count = len(vectors['recipe_ids'])
+    owners, positions = expand_ranges(vectors['row_ptr'], rows)
+    pair_owners, pair_positions = expand_ranges(vectors['feature_ptr'], vectors['row_features'][positions])
+    products = vectors['row_weights'][positions][pair_owners] * vectors['feature_weights'][pair_positions]
+    pairs = owners[pair_owners] * count + vectors['feature_rows'][pair_positions]
+    return np.bincount(pairs, products, minlength=len(rows) * count).reshape(len(rows), count)
+
+# The best public matches for each of a batch of recipes, as lists of (row, score) best first. Only the
+# recipes with something in common are sorted, rather than every row of the matrix.
+def get_best_matches(vectors, rows, similarities, limit):
+    batch, matches = np.nonzero(similarities > 0)
+    keep = vectors['public'][matches] & (matches != rows[batch])
+    batch, matches = batch[keep], matches[keep]
+    scores = similarities[batch, matches]
+
+    order = np.lexsort((-scores, batch))
+    batch, matches, scores = batch[order], matches[order], scores[order]
+    starts = np.searchsorted(batch, np.arange(len(rows)))
+    ends = np.minimum(np.searchsorted(batch, np.arange(len(rows)), side='right'), starts + limit)
+    return [
+        list(zip(matches[start:end].tolist(), scores[start:end].tolist()))
+        for start, end in zip(starts, ends)
+    ]
+
+# SimilarRecipe rows for a recipe's matches, given as (recipe id, score) best first
+def make_rows(recipe_id, matches):
+    return [
+        SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id, rank=rank, score=score)
+        for rank, (similar_id, score) in enumerate(matches)
+    ]
+
+# Recompute the suggestions for every recipe, returning the number of recipes
+def rebuild_similar_recipes(batch_size=None):
+    batch_size = batch_size or settings.SIMILAR_BATCH_SIZE
+    vectors = load_vectors()
+    recipe_ids = vectors['recipe_ids']
+
+    similar_rows = []
+    for start in range(0, len(recipe_ids), batch_size):
+        rows = np.arange(start, min(start + batch_size, len(recipe_ids)))
+        matches = get_best_matches(vectors, rows, get_similarities(vectors, rows), settings.SIMILAR_RECIPES_STORED)
+        for row, row_matches in zip(rows, matches):
+            similar_rows += make_rows(int(recipe_ids[row]), [(int(recipe_ids[match]), score) for match, score in row_matches])
+
+    with transaction.atomic():
+        SimilarRecipe.objects.all().delete()
+        SimilarRecipe.objects.bulk_create(similar_rows, batch_size=1000)
+    invalidate_pages()  # bulk_create skips the signals that refresh cached pages
+    return len(recipe_ids)
+
+# The recipe and every recipe sharing an ingredient or tag with it, the only ones it can be similar to
+def get_neighbours(recipe_id):
+    ingredients = IngredientInRecipe.objects.filter(recipe_id=recipe_id).values('ingredient_id')
+    tags = RecipeTag.objects.filter(recipe_id=recipe_id).values('tag_id')
+    return Recipe.objects.filter(
+        Q(id=recipe_id)
+        | Q(id__in=IngredientInRecipe.objects.filter(ingredient_id__in=ingredients).values('recipe_id'))
+        | Q(id__in=RecipeTag.objects.filter(tag_id__in=tags).values('recipe_id'))
+    )
+
+# Recompute one recipe's suggestions, and update the suggestions of other recipes it should now be in
+# (or is no longer as similar to). Returns the number of recipes whose suggestions changed.
+def refresh_similar_recipes(recipe_id):
+    recipe_id = int(recipe_id)
+    vectors = load_vectors(get_neighbours(recipe_id))
+    recipe_ids = vectors['recipe_ids']
+    row = np.searchsorted(recipe_ids, recipe_id)
+    if row == len(recipe_ids) or recipe_ids[row] != recipe_id:
+        return 0  # Deleted, its suggestions went with it
+    limit = settings.SIMILAR_RECIPES_STORED
+
+    # Similarity works both ways, so one row gives this recipe's matches and its score in every other list
+    similarities = get_similarities(vectors, np.array([row]))
+    scores = similarities[0]
+    matches = get_best_matches(vectors, np.array([row]), similarities, limit)[0]
+    lists = {recipe_id: [(int(recipe_ids[match]), score) for match, score in matches]}
+
+    # Lists that could gain this recipe: it beats their worst suggestion, or they have room
+    floor = np.zeros(len(recipe_ids))
+    stored = np.array(list(
+        SimilarRecipe.objects.filter(recipe_id__in=get_neighbours(recipe_id).values('id'))
+        .values_list('recipe_id').annotate(Min('score'), Count('id')).order_by()
+    ), dtype=float).reshape(-1, 3)
+    full = stored[:, 2] >= limit
+    floor[np.searchsorted(recipe_ids, stored[full, 0].astype(np.int64))] = stored[full, 1]
+    gaining = (scores > floor) if vectors['public'][row] else np.zeros(len(recipe_ids), dtype=bool)
+    gaining[row] = False
+
+    # Merge this recipe into those lists, and into (or out of) the lists it is already in
+    affected = set(recipe_ids[gaining].tolist())
+    affected |= set(SimilarRecipe.objects.filter(similar_id=recipe_id).values_list('recipe_id', flat=True))
+    current = {owner: {} for owner in affected}
+    for owner, similar_id, score in SimilarRecipe.objects.filter(recipe_id__in=affected).values_list('recipe_id', 'similar_id', 'score'):
+        current[owner][similar_id] = score
+    for owner, neighbours in current.items():
+        before = sorted(neighbours.items(), key=lambda item: -item[1])
+        neighbours.pop(recipe_id, None)
+        owner_row = np.searchsorted(recipe_ids, owner)
+        # Lists of recipes that no longer share anything with this one weren't loaded, it just leaves them
+        score = scores[owner_row] if owner_row < len(recipe_ids) and recipe_ids[owner_row] == owner else 0
+        if vectors['public'][row] and score > 0:
+            neighbours[recipe_id] = float(score)
+        after = sorted(neighbours.items(), key=lambda item: -item[1])[:limit]
+        if after != before:
+            lists[owner] = after
+
+    with transaction.atomic():
+        SimilarRecipe.objects.filter(recipe_id__in=lists).delete()
+        SimilarRecipe.objects.bulk_create([similar for owner, matches in lists.items() for similar in make_rows(owner, matches)])
+    invalidate_pages()
+    return len(lists)
+
+# Get the stored suggestions for a recipe that are still public, best first
+def similar_recipes_query(recipe):
+    return (
+        SimilarRecipe.objects
+        .filter(recipe=recipe, similar__public=True)
+        .select_related('similar')
+        .order_by('rank')[:settings.SIMILAR_RECIPES_SHOWN]
+    )
@@ -0,0 +1,208 @@
+from asgiref.sync import sync_to_async
+from django.db.models import Count, F, Sum
+
+from .models import (
+    WEEKDAY_CHOICES, IngredientInRecipe, MealPlanDaySummary, MealPlanIngredientTotal, MealPlanItem, RecipeNutrition,
+)
+
+# Stored meal plan summaries: per-weekday nutrition totals and per-ingredient shopping totals.
+#
+# Rather than recomputing a plan's totals on every page view, the totals are stored
+# and adjusted by the difference whenever a planned recipe, a recipe's ingredients or
+# a recipe's nutrition change. Bulk operations skip model signals, so code that bulk
+# edits meal plan items must call these functions itself.
+
+NUTRIENTS = ('calories', 'fat', 'carbs', 'protein')
+
+
+# Get a recipe's nutrition as a dict, or None if it has none
+def get_recipe_nutrition(recipe_id):
+    return RecipeNutrition.objects.filter(recipe_id=recipe_id).values(*NUTRIENTS).first()
+
+# Add (or with a negative amount, remove) nutrition from a day's totals
+def adjust_day(meal_plan_id, weekday, nutrition, times=1):
+    if not nutrition or not times:
+        return
+    MealPlanDaySummary.objects.filter(meal_plan_id=meal_plan_id, weekday=weekday).update(
+        **{name: F(name) + nutrition[name] * times for name in NUTRIENTS}
+    )
+
+# Add (or remove) an amount of an ingredient from a plan's shopping totals
+def adjust_ingredient(meal_plan_id, ingredient_id, amount, lines):
+    totals = MealPlanIngredientTotal.objects.filter(meal_plan_id=meal_plan_id, ingredient_id=ingredient_id)
+    updated = totals.update(total_amount=F('total_amount') + amount, line_count=F('line_count') + lines)
+
+    if not updated and lines > 0:
+        MealPlanIngredientTotal.objects.create(
+            meal_plan_id=meal_plan_id, ingredient_id=ingredient_id, total_amount=amount, line_count=lines,
+        )
+    elif lines < 0:
+        # Drop ingredients no recipe in the plan uses any more
+        totals.filter(line_count__lte=0).delete()
+
+# Add (times=1) or remove (times=-1) one planned recipe from a plan's summaries
+def apply_planned_recipe(meal_plan_id, weekday, recipe_id, times):
+    adjust_day(meal_plan_id, weekday, get_recipe_nutrition(recipe_id), times)
+
+    ingredients = (
+        IngredientInRecipe.objects
+        .filter(recipe_id=recipe_id)
+        .values('ingredient_id')
+        .annotate(amount=Sum('measurement_amount'), lines=Count('id'))
+    )
+    for ingredient in ingredients:
+        adjust_ingredient(meal_plan_id, ingredient['ingredient_id'], ingredient['amount'] * times, ingredient['lines'] * times)
+
+# Move a planned recipe's nutrition from one day to another
+def move_planned_recipe(meal_plan_id, recipe_id, from_weekday, to_weekday):
+    nutrition = get_recipe_nutrition(recipe_id)
+    adjust_day(meal_plan_id, from_weekday, nutrition, -1)
+    adjust_day(meal_plan_id, to_weekday, nutrition, 1)
+
+# Move many planned recipes between days at once, given (recipe_id, from_weekday, to_weekday) moves.
+# Costs one query for the nutrition and at most one update per weekday, however many recipes move.
+def move_planned_recipes(meal_plan_id, moves):
+    if not moves:
+        return
+
+    nutrition = {
+        row['recipe_id']: row
+        for row in RecipeNutrition.objects.filter(recipe_id__in={move[0] for move in moves}).values('recipe_id', *NUTRIENTS)
+    }
+
+    changes = {weekday: dict.fromkeys(NUTRIENTS, 0) for weekday, _ in WEEKDAY_CHOICES}
+    for recipe_id, from_weekday, to_weekday in moves:
+        if recipe_id not in nutrition:
+            continue
+        for name in NUTRIENTS:
+            changes[from_weekday][name] -= nutrition[recipe_id][name]
+            changes[to_weekday][name] += nutrition[recipe_id][name]
+
+    for weekday, change in changes.items():
+        if any(change.values()):
+            adjust_day(meal_plan_id, weekday, change)
+
+# Apply a change to a recipe's nutrition (old and new may be None) to every plan it is in
+def apply_nutrition_change(recipe_id, old, new):
+    old = old or dict.fromkeys(NUTRIENTS, 0)
+    new = new or dict.fromkeys(NUTRIENTS, 0)
+    difference = {name: new[name] - old[name] for name in NUTRIENTS}
+
+    planned = (
+        MealPlanItem.objects
+        .filter(recipe_id=recipe_id)
+        .values('meal_plan_id', 'weekday')
+        .annotate(times=Count('id'))
+    )
+    for item in planned:
+        adjust_day(item['meal_plan_id'], item['weekday'], difference, item['times'])
+
+# Apply a change to one ingredient line of a recipe to every plan the recipe is in.
+# old and new are (ingredient_id, amount) pairs, or None when the line was created or deleted.
+def apply_ingredient_change(recipe_id, old, new):
+    planned = (
+        MealPlanItem.objects
+        .filter(recipe_id=recipe_id)
+        .values('meal_plan_id')
+        .annotate(times=Count('id'))
+    )
+    for item in planned:
+        if old:
+            adjust_ingredient(item['meal_plan_id'], old[0], -old[1] * item['times'], -item['times'])
+        if new:
+            adjust_ingredient(item['meal_plan_id'], new[0], new[1] * item['times'], item['times'])
+
+# Recompute a plan's summaries from scratch
+def rebuild_summary(meal_plan):
+    MealPlanDaySummary.objects.filter(meal_plan=meal_plan).delete()
+    MealPlanIngredientTotal.objects.filter(meal_plan=meal_plan).delete()
+
+    days = {weekday: MealPlanDaySummary(meal_plan=meal_plan, weekday=weekday) for weekday, _ in WEEKDAY_CHOICES}
+    daily_totals = (
+        MealPlanItem.objects
+        .filter(meal_plan=meal_plan)
+        .values('weekday')
+        .annotate(**{name: Sum(f'recipe__recipenutrition__{name}') for name in NUTRIENTS})
+    )
+    for totals in daily_totals:
+        for name in NUTRIENTS:
+            setattr(days[totals['weekday']], name, totals[name] or 0)
+    MealPlanDaySummary.objects.bulk_create(days.values())
+
+    ingredient_totals = (
+        IngredientInRecipe.objects
+        .filter(recipe__meal_plan_items__meal_plan=meal_plan)
+        .values('ingredient_id')
+        .annotate(total_amount=Sum('measurement_amount'), line_count=Count('id'))
+    )
+    MealPlanIngredientTotal.objects.bulk_create(
+        MealPlanIngredientTotal(meal_plan=meal_plan, **totals) for totals in ingredient_totals
+    )
+
+# Get a plan's day summaries in weekday order, rebuilding the summaries if they are missing
+# (e.g. for a plan that was created with a bulk insert)
+def get_day_summaries(meal_plan):
+    days = list(MealPlanDaySummary.objects.filter(meal_plan=meal_plan).order_by('weekday'))
+    if len(days) != len(WEEKDAY_CHOICES):
+        rebuild_summary(meal_plan)
+        days = list(MealPlanDaySummary.objects.filter(meal_plan=meal_plan).order_by('weekday'))
+    return days
+
+async def aget_day_summaries(meal_plan):
+    days = [day async for day in MealPlanDaySummary.objects.filter(meal_plan=meal_plan).order_by('weekday')]
+    if len(days) != len(WEEKDAY_CHOICES):
+        await sync_to_async(rebuild_summary)(meal_plan)
+        days = [day async for day in MealPlanDaySummary.objects.filter(meal_plan=meal_plan).order_by('weekday')]
+    return days
+
+# Work out how the plan's summaries would change if a recipe on a weekday was swapped for another,
+# without changing anything. Either recipe may be None to only remove or only add a recipe.
+def swap_delta(meal_plan, weekday, remove_recipe_id, add_recipe_id):
+    recipe_ids = [recipe_id for recipe_id in (remove_recipe_id, add_recipe_id) if recipe_id]
+    signs = {remove_recipe_id: -1, add_recipe_id: 1}
+    if remove_recipe_id == add_recipe_id:
+        signs = {}
+
+    # Nutrition difference for the day
+    day = MealPlanDaySummary.objects.get(meal_plan=meal_plan, weekday=weekday)
+    before = {name: getattr(day, name) for name in NUTRIENTS}
+    after = dict(before)
+    for nutrition in RecipeNutrition.objects.filter(recipe_id__in=recipe_ids).values('recipe_id', *NUTRIENTS):
+        for name in NUTRIENTS:
+            after[name] += nutrition[name] * signs.get(nutrition['recipe_id'], 0)
+
+    # Ingredient differences, compared against the stored shopping totals
+    changes = {}
+    lines = IngredientInRecipe.objects.filter(recipe_id__in=recipe_ids).values(
+        'recipe_id', 'ingredient_id', 'ingredient__name', 'ingredient__measurement_unit', 'measurement_amount',
+    )
+    for line in lines:
+        change = changes.setdefault(line['ingredient_id'], {
+            'ingredient': line['ingredient__name'],
+            'unit': line['ingredient__measurement_unit'],
+            'delta': 0,
+        })
+        change['delta'] += line['measurement_amount'] * signs.get(line['recipe_id'], 0)
+
+    stored = dict(
+        MealPlanIngredientTotal.objects
+        .filter(meal_plan=meal_plan, ingredient_id__in=changes)
+        .values_list('ingredient_id', 'total_amount')
+    )
+    ingredients = []
+    for ingredient_id, change in sorted(changes.items(), key=lambda item: item[1]['ingredient']):
+        if not change['delta']:
+            continue
+        change['before'] = stored.get(ingredient_id, 0)
+        change['after'] = change['before'] + change['delta']
+        ingredients.append(change)
+
+    return {
+        'weekday': weekday,
+        'nutrition': {
+            'before': before,
+            'after': after,
+            'delta': {name: after[name] - before[name] for name in NUTRIENTS},
+        },
+        'ingredients': ingredients,
+    }
@@ -1,11 +1,55 @@
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
 from django.contrib.auth.models import User
 from django.db.models import Sum
 from datetime import timedelta
 from .models import Recipe, RecipeNutrition, Ingredient, IngredientInRecipe, Tag, RecipeTag, MealPlan, MealPlanItem
 from .views import get_nutrition_data
+from .search import search_recipes, rebuild_index, autocomplete_ingredients
+from .forms import RecipeInstructionsForm
+from .models import NutritionCacheEntry
+from . import nutrition
+import threading
+import asyncio
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .nutritionix import NutritionixClient
+from .models import MealPlanDaySummary, MealPlanIngredientTotal
+from .summaries import rebuild_summary
+from .datagen import generate
+from .benchmarks import run_benchmarks, find_regressions
+from .queryplans import find_full_scans
+import tempfile
+from .exporting import stream_export, astream_export
+from .shopping import iter_shopping_list, aiter_shopping_list, stream_csv, astream_csv, stream_json, astream_json
+from .pagecache import get_cache, get_generation, get_page_key
+from django.test import RequestFactory
+from django.core.cache import cache, caches
+from django.conf import settings
+from .cards import get_card_key, render_recipe_cards, get_cache as get_card_cache
+from .facets import get_facets
+from .filters import RecipeFilter
+from django.http import QueryDict
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import CommandError
+from django.core.management import call_command
+from unittest import mock
+from io import StringIO
 import os
-from dotenv import load_dotenv
+from .models import Job
+from . import jobs
+from django.utils import timezone
+from .planning import plan_week, score_days
+from .models import SimilarRecipe
+from . import similarity
+from . import pantry
+from . import colours as colours_module
+import numpy as np
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.http import HttpResponse
+from .middleware import ServerTimingMiddleware
 
 # Run tests using command: python manage.py test
 
@@ -54,22 +98,18 @@ class RecipeNutritionModelTest(TestCase):
         self.recipe_nutrition = RecipeNutrition.objects.create(
             recipe=self.recipe,
             calories=200.0,
-            calorie_colour=1,
-            fat=10.0,
-            fat_colour=2,
-            carbs=30.0,
-            carbs_colour=3,
+            fat=15.0,
+            carbs=100.0,
             protein=15.0,
-            protein_colour=1
         )
 
     def test_recipe_nutrition_creation(self):
-        # Test that the recipe nutrition is created with the correct attributes
+        # Test that the recipe nutrition is created with the correct attributes, and colours worked out from them
         self.assertEqual(self.recipe_nutrition.calories, 200.0)
         self.assertEqual(self.recipe_nutrition.calorie_colour, 1)
-        self.assertEqual(self.recipe_nutrition.fat, 10.0)
+        self.assertEqual(self.recipe_nutrition.fat, 15.0)
         self.assertEqual(self.recipe_nutrition.fat_colour, 2)
-        self.assertEqual(self.recipe_nutrition.carbs, 30.0)
+        self.assertEqual(self.recipe_nutrition.carbs, 100.0)
         self.assertEqual(self.recipe_nutrition.carbs_colour, 3)
         self.assertEqual(self.recipe_nutrition.protein, 15.0)
         self.assertEqual(self.recipe_nutrition.protein_colour, 1)
@@ -283,16 +323,14 @@ class MealPlannerTests(TestCase):
 
 class APITestCase(TestCase):
     def test_get_nutrition_data_live(self):
-        # Load environment variables from env file
-        load_dotenv()
-
-        # Call the actual API with a sample query
-        app_id = 'd360df73'  # Replace with your actual app ID
-        app_key = '58f5b744482f26ff48588149cb1508bb'  # Replace with your actual app key
-        query = '1 apple'
-
-        result = get_nutrition_data(query, os.getenv('APP_ID'), os.getenv('APP_KEY'))
+        # The lookup goes through the shared client with the given credentials, without calling the real API
+        response = {'foods': [{'food_name': 'apple', 'nf_calories': 95}]}
+        with mock.patch('mealplanner.views.get_client') as get_client:
+            get_client.return_value.nutrients.return_value = response
+            result = get_nutrition_data('1 apple', 'app-id', 'app-key')
 
+        get_client.assert_called_once_with('app-id', 'app-key')
+        get_client.return_value.nutrients.assert_called_once_with('1 apple')
         # Assert the response is valid
         self.assertIsNotNone(result)
         self.assertIn('foods', result)
@@ -346,4 +384,1724 @@ class ShoppingListTest(TestCase):
         ]
 
         # Assert the aggregated shopping list matches the expected results
-        self.assertEqual(list(shopping_list), expected_shopping_list)
\ No newline at end of file
+        self.assertEqual(list(shopping_list), expected_shopping_list)
+
+@override_settings(RECIPE_PAGE_SIZE=2)
+class RecipeListPaginationTest(TestCase):
+    def setUp(self):
+        # Create a user with their own recipes, and another user with public recipes
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        self.tag = Tag.objects.create(name='Dinner')
+
+        for i, minutes in enumerate([10, 40, 40]):
+            Recipe.objects.create(user=self.user, name=f'Own {i}', difficulty=1,
+                                  time_needed=timedelta(minutes=minutes), instructions='Cook')
+        for i, minutes in enumerate([20, 20, 50]):
+            recipe = Recipe.objects.create(user=self.other_user, name=f'Public {i}', difficulty=2,
+                                           time_needed=timedelta(minutes=minutes), public=True, instructions='Cook')
+            RecipeTag.objects.create(recipe=recipe, tag=self.tag)
+
+    def collect_pages(self, section, params):
+        # Follow the next page links of a section, returning the recipe names in order
+        names = []
+        url = reverse('recipe_list')
+        while url:
+            response = self.client.get(url, params)
+            params = None
+            names += [recipe.name for recipe in response.context[f'{section}_recipes']]
+            self.assertLessEqual(len(response.context[f'{section}_recipes']), 2)
+            next_url = response.context[f'{section}_next_url']
+            url = reverse('recipe_list') + next_url if next_url else None
+        return names
+
+    def test_sections_are_separate_and_bounded(self):
+        # Own recipes and other users' public recipes are paginated separately
+        self.client.login(username='testuser', password='testpassword')
+        self.assertEqual(self.collect_pages('my', {}), ['Own 0', 'Own 1', 'Own 2'])
+        self.assertEqual(self.collect_pages('public', {}), ['Public 0', 'Public 1', 'Public 2'])
+
+    def test_pagination_follows_filter_ordering(self):
+        # Ties on the sort field are broken by id so no recipe is skipped or repeated
+        self.assertEqual(self.collect_pages('public', {'sort': '-time_needed'}), ['Public 2', 'Public 0', 'Public 1'])
+
+    def test_anonymous_users_only_see_public_recipes(self):
+        response = self.client.get(reverse('recipe_list'))
+        self.assertEqual(response.context['my_recipes'], [])
+        self.assertContains(response, 'Public 0')
+        self.assertNotContains(response, 'Own 0')
+
+    def test_query_count_is_constant(self):
+        # Count the queries for a page, then grow the catalogue and count again (with no cached recipe cards)
+        self.client.login(username='testuser', password='testpassword')
+        cache.clear()
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(reverse('recipe_list'))
+
+        for i in range(10):
+            recipe = Recipe.objects.create(user=self.other_user, name=f'Extra {i}', difficulty=3,
+                                           time_needed=timedelta(minutes=5), public=True, instructions='Cook')
+            RecipeTag.objects.create(recipe=recipe, tag=Tag.objects.create(name=f'Tag {i}'))
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(reverse('recipe_list'))
+
+        self.assertEqual(len(before), len(after))
+
+class RecipeSearchTest(TestCase):
+    def setUp(self):
+        # Create recipes with tags and ingredients to search over
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.other_user = User.objects.create_user(username='otheruser', password='testpassword')
+
+        self.curry = Recipe.objects.create(user=self.other_user, name='Chicken Curry', difficulty=2,
+                                           time_needed=timedelta(minutes=40), public=True,
+                                           instructions='Fry the onions, add the spices.')
+        self.soup = Recipe.objects.create(user=self.other_user, name='Tomato Soup', difficulty=1,
+                                          time_needed=timedelta(minutes=20), public=True,
+                                          instructions='Serve with leftover chicken.')
+        self.secret = Recipe.objects.create(user=self.other_user, name='Secret Chicken', difficulty=1,
+                                            time_needed=timedelta(minutes=20), public=False,
+                                            instructions='Private.')
+
+        tomato = Ingredient.objects.create(name='Tomato', measurement_unit='g')
+        IngredientInRecipe.objects.create(recipe=self.soup, ingredient=tomato, measurement_amount=400)
+        RecipeTag.objects.create(recipe=self.curry, tag=Tag.objects.create(name='Spicy'))
+
+    def search_names(self, text):
+        return [recipe.name for recipe in search_recipes(Recipe.objects.filter(public=True), text)]
+
+    def test_name_matches_rank_first(self):
+        # A match in the name outranks a match in the instructions
+        self.assertEqual(self.search_names('chicken'), ['Chicken Curry', 'Tomato Soup'])
+
+    def test_prefix_and_related_matches(self):
+        # Words are prefix matched, and tag and ingredient names are searchable
+        self.assertEqual(self.search_names('chick cur'), ['Chicken Curry'])
+        self.assertEqual(self.search_names('spicy'), ['Chicken Curry'])
+        self.assertEqual(self.search_names('tomato'), ['Tomato Soup'])
+        self.assertEqual(self.search_names('"*'), [])
+
+    def test_index_follows_changes(self):
+        # Renaming, tagging and deleting recipes keeps the index in sync
+        self.soup.name = 'Gazpacho'
+        self.soup.save()
+        self.assertEqual(self.search_names('gazpacho'), ['Gazpacho'])
+
+        RecipeTag.objects.create(recipe=self.soup, tag=Tag.objects.create(name='Vegan'))
+        self.assertEqual(self.search_names('vegan'), ['Gazpacho'])
+
+        self.curry.delete()
+        self.assertEqual(self.search_names('spicy'), [])
+
+    def test_rebuild_index(self):
+        self.assertEqual(rebuild_index(), 3)
+        self.assertEqual(self.search_names('chicken'), ['Chicken Curry', 'Tomato Soup'])
+
+    def test_recipe_list_search_respects_visibility(self):
+        # Private recipes only show up in their owner's search results
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.get(reverse('recipe_list'), {'q': 'chicken'})
+        self.assertEqual([recipe.name for recipe in response.context['public_recipes']], ['Chicken Curry', 'Tomato Soup'])
+        self.assertNotContains(response, 'Secret Chicken')
+
+    @override_settings(RECIPE_PAGE_SIZE=1)
+    def test_search_results_paginate_by_rank(self):
+        response = self.client.get(reverse('recipe_list'), {'q': 'chicken'})
+        self.assertEqual([recipe.name for recipe in response.context['public_recipes']], ['Chicken Curry'])
+        response = self.client.get(reverse('recipe_list') + response.context['public_next_url'])
+        self.assertEqual([recipe.name for recipe in response.context['public_recipes']], ['Tomato Soup'])
+        self.assertIsNone(response.context['public_next_url'])
+
+class RecipeInstructionsRenderingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.recipe = Recipe.objects.create(user=self.user, name='Pancakes', difficulty=1,
+                                            time_needed=timedelta(minutes=20), public=True,
+                                            instructions='Mix the **batter**')
+
+    def test_form_save_renders_instructions(self):
+        # Saving the instructions form stores the rendered HTML
+        form = RecipeInstructionsForm({'instructions': '# Method'}, instance=self.recipe)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.instructions_html, '<h1>Method</h1>')
+
+    def test_detail_view_uses_stored_html(self):
+        # The first view fills in the missing HTML, later views do not render Markdown again
+        response = self.client.get(reverse('recipe_detail', args=[self.recipe.id]))
+        self.assertContains(response, '<strong>batter</strong>')
+
+        with mock.patch('mealplanner.models.render_instructions') as render:
+            response = self.client.get(reverse('recipe_detail', args=[self.recipe.id]))
+            render.assert_not_called()
+        self.assertContains(response, '<strong>batter</strong>')
+
+    def test_prerender_command(self):
+        call_command('prerender_instructions', workers=2, stdout=StringIO())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.instructions_html, '<p>Mix the <strong>batter</strong></p>')
+        self.assertFalse(self.recipe.refresh_instructions_html())
+
+class NutritionCacheTest(TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def fetch_many(self, lines):
+        # Stand-in for the Nutritionix client, recording which lines were looked up
+        self.calls += lines
+        food = {'nf_calories': 100, 'nf_total_fat': 1, 'nf_total_carbohydrate': 2, 'nf_protein': 3}
+        return {line: {'foods': [food]} for line in lines}
+
+    def test_normalize_line(self):
+        self.assertEqual(nutrition.normalize_line(100.0, 'g', '  Chicken   Breast'), '100 g of chicken breast')
+
+    def test_only_misses_go_upstream(self):
+        nutrition.lookup_lines(['100 g of rice'], self.fetch_many)
+        results = nutrition.lookup_lines(['100 g of rice', '1 unit of egg'], self.fetch_many)
+
+        self.assertEqual(self.calls, ['100 g of rice', '1 unit of egg'])
+        self.assertEqual(results['100 g of rice']['calories'], 100)
+        self.assertEqual(NutritionCacheEntry.objects.get(line='100 g of rice').hits, 1)
+
+    @override_settings(NUTRITION_CACHE_TTL=0)
+    def test_expired_lines_are_fetched_again(self):
+        nutrition.lookup_lines(['100 g of rice'], self.fetch_many)
+        nutrition.lookup_lines(['100 g of rice'], self.fetch_many)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(NutritionCacheEntry.objects.count(), 1)
+
+    @override_settings(NUTRITION_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_lines_are_evicted(self):
+        nutrition.lookup_lines(['1 g of a'], self.fetch_many)
+        nutrition.lookup_lines(['1 g of b'], self.fetch_many)
+        nutrition.lookup_lines(['1 g of a'], self.fetch_many)
+        nutrition.lookup_lines(['1 g of c'], self.fetch_many)
+        self.assertEqual(sorted(NutritionCacheEntry.objects.values_list('line', flat=True)), ['1 g of a', '1 g of c'])
+
+    def test_failed_lookups_are_not_cached(self):
+        results = nutrition.lookup_lines(['100 g of rice'], lambda lines: dict.fromkeys(lines))
+        self.assertIsNone(results['100 g of rice'])
+        self.assertFalse(NutritionCacheEntry.objects.exists())
+
+    def test_concurrent_lookups_are_coalesced(self):
+        # A lookup of a line that is already in flight waits for the first instead of fetching it again
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_fetch_many(lines):
+            started.set()
+            release.wait(5)
+            return self.fetch_many(lines)
+
+        leader_result = []
+        leader = threading.Thread(
+            target=lambda: leader_result.append(nutrition.fetch_coalesced(['1 g of a'], slow_fetch_many))
+        )
+        leader.start()
+        started.wait(5)
+
+        follower_result = []
+        follower = threading.Thread(
+            target=lambda: follower_result.append(nutrition.fetch_coalesced(['1 g of a', '1 g of b'], self.fetch_many))
+        )
+        follower.start()
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(self.calls, ['1 g of b', '1 g of a'])
+        self.assertEqual(leader_result[0][1], {'1 g of a'})
+        self.assertEqual(follower_result[0][1], {'1 g of b'})
+        self.assertIsNotNone(follower_result[0][0]['1 g of a'])
+
+    def test_recipe_view_uses_cache(self):
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        recipe = Recipe.objects.create(user=user, name='Rice', difficulty=1, time_needed=timedelta(minutes=20),
+                                       instructions='Boil')
+        rice = Ingredient.objects.create(name='Rice', measurement_unit='g')
+        IngredientInRecipe.objects.create(recipe=recipe, ingredient=rice, measurement_amount=100)
+        IngredientInRecipe.objects.create(recipe=recipe, ingredient=rice, measurement_amount=100)
+        self.client.login(username='testuser', password='testpassword')
+
+        async def nutrients_many(lines):
+            return self.fetch_many(lines)
+
+        with mock.patch('mealplanner.views.get_client') as get_client:
+            get_client.return_value.nutrients_many = nutrients_many
+            response = self.client.get(reverse('get_nutri_data', args=[recipe.id]))
+            self.client.get(reverse('get_nutri_data', args=[recipe.id]))
+
+        self.assertEqual(response.json(), {'calories': 200, 'fat': 2, 'carbs': 4, 'protein': 6})
+        self.assertEqual(self.calls, ['100 g of rice'])
+
+class NutritionixClientTest(SimpleTestCase):
+    # Runs the client against a local stand-in for the Nutritionix API
+    def setUp(self):
+        self.requests = []
+        self.fail_first = 0
+        self.delay = 0
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep connections alive
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                test.requests.append((body['query'], self.headers['x-app-id'], self.client_address))
+                time.sleep(test.delay)
+
+                if len(test.requests) <= test.fail_first:
+                    status, payload = 503, {}
+                else:
+                    status, payload = 200, {'foods': [{'food_name': body['query'], 'nf_calories': 50}]}
+
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client timed out and went away
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = NutritionixClient(
+            'app', 'key', url=f'http://127.0.0.1:{self.server.server_port}/', retries=2, backoff=0.01,
+            read_timeout=0.5,
+        )
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_request_and_connection_reuse(self):
+        self.assertEqual(self.client.nutrients('1 apple')['foods'][0]['food_name'], '1 apple')
+        self.client.nutrients('1 pear')
+        # Both requests carried the credentials and came over the same pooled connection
+        self.assertEqual(self.requests[0][1], 'app')
+        self.assertEqual(self.requests[0][2], self.requests[1][2])
+
+    def test_server_errors_are_retried(self):
+        self.fail_first = 2
+        with self.assertLogs('mealplanner.nutritionix', 'WARNING') as logs:
+            self.assertIsNotNone(self.client.nutrients('1 apple'))
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(len(logs.records), 2)
+
+    def test_gives_up_after_retries(self):
+        self.fail_first = 10
+        with self.assertLogs('mealplanner.nutritionix', 'ERROR'):
+            self.assertIsNone(self.client.nutrients('1 apple'))
+        self.assertEqual(len(self.requests), 3)
+
+    def test_read_timeout(self):
+        self.delay = 1
+        started = time.monotonic()
+        with self.assertLogs('mealplanner.nutritionix', 'ERROR'):
+            self.assertIsNone(self.client.nutrients('1 apple'))
+        self.assertLess(time.monotonic() - started, 3)
+
+    # Run a coroutine on a new event loop, closing the client's connections before the loop goes
+    def run_async(self, coroutine):
+        async def run():
+            try:
+                return await coroutine
+            finally:
+                await self.client.aclose()
+        return asyncio.run(run())
+
+    def test_async_requests_are_retried(self):
+        self.fail_first = 2
+        with self.assertLogs('mealplanner.nutritionix', 'WARNING'):
+            self.assertEqual(self.run_async(self.client.nutrients_async('1 apple'))['foods'][0]['food_name'], '1 apple')
+        self.assertEqual(len(self.requests), 3)
+
+    def test_async_connection_reuse(self):
+        # Lookups on the same event loop share one client, and its keep-alive connection
+        async def lookups():
+            await self.client.nutrients_async('1 apple')
+            await self.client.nutrients_many(['1 pear'])
+        self.run_async(lookups())
+        self.assertEqual(len({address for _, _, address in self.requests}), 1)
+        self.assertEqual(len(self.client.async_clients), 0)
+
+    def test_fan_out(self):
+        # Many queries are looked up concurrently
+        self.delay = 0.2
+        started = time.monotonic()
+        queries = [f'{i} apples' for i in range(8)]
+        responses = self.run_async(self.client.nutrients_many(queries))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(set(responses), set(queries))
+
+class MealPlanNutritionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.mealplan = MealPlan.objects.create(user=self.user, name='Week')
+        self.client.login(username='testuser', password='testpassword')
+
+    def add_recipe(self, weekday, calories=None):
+        # Plan a recipe, with nutrition data if calories are given
+        recipe = Recipe.objects.create(user=self.user, name='Recipe', difficulty=1,
+                                       time_needed=timedelta(minutes=20), instructions='Cook')
+        if calories is not None:
+            RecipeNutrition.objects.create(recipe=recipe, calories=calories, calorie_colour=0, fat=1, fat_colour=0,
+                                           carbs=2, carbs_colour=0, protein=3, protein_colour=0)
+        MealPlanItem.objects.create(meal_plan=self.mealplan, recipe=recipe, weekday=weekday)
+        return recipe
+
+    def test_daily_totals(self):
+        recipe = self.add_recipe(0, calories=500)
+        MealPlanItem.objects.create(meal_plan=self.mealplan, recipe=recipe, weekday=0)
+        self.add_recipe(0)
+        self.add_recipe(2, calories=300)
+
+        response = self.client.get(reverse('mealplan_detail', args=[self.mealplan.id]))
+        summary = response.context['nutrition_summary']
+
+        self.assertEqual(len(summary), 7)
+        self.assertEqual(summary[0], {'day': 'Monday', 'calories': 1000, 'fat': 2, 'carbs': 4, 'protein': 6})
+        self.assertEqual(summary[1], {'day': 'Tuesday', 'calories': 0, 'fat': 0, 'carbs': 0, 'protein': 0})
+        self.assertEqual(summary[2]['calories'], 300)
+
+    def test_query_count_is_constant(self):
+        self.add_recipe(0, calories=500)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(reverse('mealplan_detail', args=[self.mealplan.id]))
+
+        for weekday in range(7):
+            for _ in range(3):
+                self.add_recipe(weekday, calories=400)
+
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(reverse('mealplan_detail', args=[self.mealplan.id]))
+
+        self.assertEqual(len(before), len(after))
+
+class MealPlanSummaryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.mealplan = MealPlan.objects.create(user=self.user, name='Week')
+        self.flour = Ingredient.objects.create(name='Flour', measurement_unit='g')
+        self.egg = Ingredient.objects.create(name='Egg', measurement_unit='unit')
+
+        self.cake = self.create_recipe('Cake', calories=400)
+        IngredientInRecipe.objects.create(recipe=self.cake, ingredient=self.flour, measurement_amount=200)
+        self.omelette = self.create_recipe('Omelette', calories=250)
+        IngredientInRecipe.objects.create(recipe=self.omelette, ingredient=self.egg, measurement_amount=3)
+
+    def create_recipe(self, name, calories):
+        recipe = Recipe.objects.create(user=self.user, name=name, difficulty=1, time_needed=timedelta(minutes=20),
+                                       instructions='Cook')
+        RecipeNutrition.objects.create(recipe=recipe, calories=calories, calorie_colour=0, fat=10, fat_colour=0,
+                                       carbs=20, carbs_colour=0, protein=5, protein_colour=0)
+        return recipe
+
+    def stored_summary(self):
+        days = list(MealPlanDaySummary.objects.filter(meal_plan=self.mealplan).order_by('weekday')
+                    .values_list('weekday', 'calories', 'fat', 'carbs', 'protein'))
+        ingredients = sorted(MealPlanIngredientTotal.objects.filter(meal_plan=self.mealplan)
+                             .values_list('ingredient__name', 'total_amount', 'line_count'))
+        return days, ingredients
+
+    def assertMatchesRebuild(self):
+        # The incrementally maintained summary matches one recomputed from scratch
+        incremental = self.stored_summary()
+        rebuild_summary(self.mealplan)
+        self.assertEqual(incremental, self.stored_summary())
+
+    def test_summary_follows_changes(self):
+        item = MealPlanItem.objects.create(meal_plan=self.mealplan, recipe=self.cake, weekday=0)
+        MealPlanItem.objects.create(meal_plan=self.mealplan, recipe=self.cake, weekday=1)
+        MealPlanItem.objects.create(meal_plan=self.mealplan, recipe=self.omelette, weekday=1)
+        days, ingredients = self.stored_summary()
+        self.assertEqual(days[1], (1, 650, 20, 40, 10))
+        self.assertEqual(ingredients, [('Egg', 3, 1), ('Flour', 400, 2)])
+        self.assertMatchesRebuild()
+
+        # Move a recipe to another day, then swap it for another recipe
+        item.weekday = 3
+        item.save()
+        self.assertMatchesRebuild()
+        item.recipe = self.omelette
+        item.save()
+        self.assertMatchesRebuild()
+
+        # Change a recipe's ingredients and nutrition
+        line = IngredientInRecipe.objects.create(recipe=self.cake, ingredient=self.egg, measurement_amount=2)
+        line.measurement_amount = 4
+        line.save()
+        self.assertMatchesRebuild()
+        nutrition = RecipeNutrition.objects.get(recipe=self.omelette)
+        nutrition.calories = 300
+        nutrition.save()
+        self.assertMatchesRebuild()
+        IngredientInRecipe.objects.filter(recipe=self.cake, ingredient=self.flour).delete()
+        self.assertMatchesRebuild()
+
+        # Remove recipes from the plan, and delete a recipe entirely
+        item.delete()
+        self.assertMatchesRebuild()
+        self.cake.delete()
+        self.assertMatchesRebuild()
+        self.assertEqual(self.stored_summary()[1], [('Egg', 3, 1)])
+
+    def test_whatif_swap(self):
+        MealPlanItem.objects.create(meal_plan=self.mealplan, recipe=self.cake, weekday=1)
+        self.client.login(username='testuser', password='testpassword')
+
+        response = self.client.get(reverse('mealplan_whatif', args=[self.mealplan.id]),
+                                   {'weekday': 1, 'remove': self.cake.id, 'add': self.omelette.id})
+        data = response.json()
+
+        self.assertEqual(data['nutrition']['before']['calories'], 400)
+        self.assertEqual(data['nutrition']['delta']['calories'], -150)
+        self.assertEqual(data['ingredients'], [
+            {'ingredient': 'Egg', 'unit': 'unit', 'delta': 3, 'before': 0, 'after': 3},
+            {'ingredient': 'Flour', 'unit': 'g', 'delta': -200, 'before': 200, 'after': 0},
+        ])
+
+        # Nothing was changed
+        self.assertEqual(self.stored_summary()[0][1][1], 400)
+
+    def test_whatif_validation(self):
+        MealPlanItem.objects.create(meal_plan=self.mealplan, recipe=self.cake, weekday=1)
+        self.client.login(username='testuser', password='testpassword')
+        url = reverse('mealplan_whatif', args=[self.mealplan.id])
+
+        self.assertEqual(self.client.get(url, {'weekday': 2, 'remove': self.cake.id}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'weekday': 'x'}).status_code, 400)
+
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        private = Recipe.objects.create(user=other_user, name='Private', difficulty=1,
+                                        time_needed=timedelta(minutes=20), instructions='Cook')
+        self.assertEqual(self.client.get(url, {'weekday': 1, 'add': private.id}).status_code, 404)
+
+class MealPlanEditSaveTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.mealplan = MealPlan.objects.create(user=self.user, name='Week')
+        self.recipe = Recipe.objects.create(user=self.user, name='Stew', difficulty=1,
+                                            time_needed=timedelta(minutes=20), instructions='Cook')
+        RecipeNutrition.objects.create(recipe=self.recipe, calories=100, calorie_colour=0, fat=1, fat_colour=0,
+                                       carbs=2, carbs_colour=0, protein=3, protein_colour=0)
+        self.items = [MealPlanItem.objects.create(meal_plan=self.mealplan, recipe=self.recipe, weekday=i % 7)
+                      for i in range(21)]
+        self.url = reverse('mealplan_edit', args=[self.mealplan.id])
+        self.client.login(username='testuser', password='testpassword')
+
+    def save(self, items):
+        return self.client.post(self.url, json.dumps({'meal_plan_items': items}), content_type='application/json')
+
+    def test_only_changed_rows_are_written(self):
+        # Move the Monday items to Sunday and leave the rest where they are
+        items = [{'id': str(item.id), 'weekday': str(6 if item.weekday == 0 else item.weekday)} for item in self.items]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.save(items)
+
+        self.assertEqual(response.json(), {'status': 'success', 'updated': 3})
+        self.assertEqual(MealPlanItem.objects.filter(meal_plan=self.mealplan, weekday=6).count(), 6)
+        self.assertLess(len(queries), 15)
+
+        # The stored summary moved with the items
+        days = dict(MealPlanDaySummary.objects.filter(meal_plan=self.mealplan).values_list('weekday', 'calories'))
+        self.assertEqual(days[0], 0)
+        self.assertEqual(days[6], 600)
+
+    def test_other_users_cannot_save(self):
+        User.objects.create_user(username='otheruser', password='testpassword')
+        self.client.login(username='otheruser', password='testpassword')
+        response = self.save([{'id': self.items[0].id, 'weekday': 3}])
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(MealPlanItem.objects.get(id=self.items[0].id).weekday, 0)
+
+    def test_invalid_batches_change_nothing(self):
+        other_plan = MealPlan.objects.create(user=self.user, name='Other')
+        other_item = MealPlanItem.objects.create(meal_plan=other_plan, recipe=self.recipe, weekday=0)
+
+        for items in ([{'id': self.items[0].id, 'weekday': 9}],
+                      [{'id': self.items[0].id}],
+                      [{'id': self.items[0].id, 'weekday': 3}, {'id': other_item.id, 'weekday': 3}]):
+            self.assertEqual(self.save(items).status_code, 400)
+
+        self.assertEqual(MealPlanItem.objects.get(id=self.items[0].id).weekday, 0)
+        self.assertEqual(MealPlanItem.objects.get(id=other_item.id).weekday, 0)
+
+class ShoppingListExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        flour = Ingredient.objects.create(name='Flour', measurement_unit='g')
+        flour_kg = Ingredient.objects.create(name='Flour', measurement_unit='kg')
+        milk = Ingredient.objects.create(name='Milk', measurement_unit='ml')
+        milk_tbsp = Ingredient.objects.create(name='Milk', measurement_unit='tbsp')
+
+        self.bread = Recipe.objects.create(user=self.user, name='Bread', difficulty=1,
+                                           time_needed=timedelta(minutes=60), instructions='Bake')
+        IngredientInRecipe.objects.create(recipe=self.bread, ingredient=flour, measurement_amount=500)
+        IngredientInRecipe.objects.create(recipe=self.bread, ingredient=flour_kg, measurement_amount=0.25)
+        IngredientInRecipe.objects.create(recipe=self.bread, ingredient=milk_tbsp, measurement_amount=2)
+        self.custard = Recipe.objects.create(user=self.user, name='Custard', difficulty=1,
+                                             time_needed=timedelta(minutes=20), instructions='Stir')
+        IngredientInRecipe.objects.create(recipe=self.custard, ingredient=milk, measurement_amount=470)
+
+        self.plan1 = MealPlan.objects.create(user=self.user, name='Week 1')
+        self.plan2 = MealPlan.objects.create(user=self.user, name='Week 2')
+        MealPlanItem.objects.create(meal_plan=self.plan1, recipe=self.bread, weekday=0)
+        MealPlanItem.objects.create(meal_plan=self.plan2, recipe=self.bread, weekday=0)
+        MealPlanItem.objects.create(meal_plan=self.plan2, recipe=self.custard, weekday=1)
+        self.client.login(username='testuser', password='testpassword')
+
+    def export(self, **params):
+        return self.client.get(reverse('shopping_list_export'), {'plan': [self.plan1.id, self.plan2.id], **params})
+
+    def test_combined_plans_with_normalized_units(self):
+        response = self.export(format='json')
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [
+            {'ingredient': 'Flour', 'amount': 1.5, 'unit': 'kg'},
+            {'ingredient': 'Milk', 'amount': 530.0, 'unit': 'ml'},
+        ])
+
+    def test_csv_export(self):
+        response = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines(),
+                         ['ingredient,amount,unit', 'Flour,1.5,kg', 'Milk,530.0,ml'])
+
+    async def test_async_streams_match(self):
+        plans = MealPlan.objects.filter(id__in=[self.plan1.id, self.plan2.id])
+        sync_rows = await sync_to_async(lambda: list(iter_shopping_list(plans)))()
+        for stream, astream in [(stream_csv, astream_csv), (stream_json, astream_json)]:
+            self.assertEqual([line async for line in astream(aiter_shopping_list(plans, chunk_size=1))],
+                             list(stream(sync_rows)))
+
+    def test_only_own_plans(self):
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        other_plan = MealPlan.objects.create(user=other_user, name='Theirs')
+        response = self.client.get(reverse('shopping_list_export'), {'plan': [self.plan1.id, other_plan.id]})
+        self.assertEqual(response.status_code, 400)
+
+class DataGenerationTest(TestCase):
+    sizes = {'users': 3, 'ingredients': 40, 'tags': 10, 'recipes': 30, 'plans': 4}
+
+    def test_generated_data(self):
+        counts = generate(seed=1, **self.sizes)
+        self.assertEqual(Recipe.objects.count(), 30)
+        self.assertEqual(MealPlanItem.objects.count(), counts['plan_items'])
+        self.assertEqual(Recipe.objects.exclude(instructions_html='').count(), 30)
+
+        # The search index and summaries are built even though bulk_create skips the signals
+        self.assertTrue(search_recipes(Recipe.objects.all(), Recipe.objects.first().name).exists())
+        plan = MealPlan.objects.first()
+        stored = list(MealPlanIngredientTotal.objects.filter(meal_plan=plan).order_by('ingredient_id').values_list('ingredient_id', 'total_amount'))
+        rebuild_summary(plan)
+        self.assertEqual(stored, list(MealPlanIngredientTotal.objects.filter(meal_plan=plan).order_by('ingredient_id').values_list('ingredient_id', 'total_amount')))
+
+    def test_same_seed_same_data(self):
+        generate(seed=1, **self.sizes)
+        first = list(Recipe.objects.order_by('id').values_list('name', 'difficulty', 'public'))
+        Recipe.objects.all().delete()
+        User.objects.all().delete()
+        generate(seed=1, **self.sizes)
+        self.assertEqual(first, list(Recipe.objects.order_by('id').values_list('name', 'difficulty', 'public')))
+
+    def test_generate_twice(self):
+        # A second run adds new users rather than clashing with the first run's
+        generate(seed=1, **self.sizes)
+        generate(seed=2, **self.sizes)
+        self.assertEqual(User.objects.count(), 6)
+        self.assertEqual(Recipe.objects.count(), 60)
+
+    def test_benchmark_results(self):
+        generate(seed=1, **self.sizes)
+        results = run_benchmarks(runs=1)
+        self.assertEqual({result['view'] for result in results},
+                         {'recipe_list', 'recipe_list_search', 'recipe_detail', 'edit_recipe', 'mealplan_detail'})
+        for result in results:
+            self.assertGreater(result['queries'], 0)
+            self.assertGreater(result['peak_memory_kb'], 0)
+
+        # A view that got twice as slow is reported, unchanged metrics are not
+        old = [{'size': 'small', **result} for result in results]
+        new = [{**result, 'wall_ms': {**result['wall_ms'], 'median': result['wall_ms']['median'] * 2}} for result in old]
+        self.assertEqual({(view, metric) for _, view, metric, *_ in find_regressions(old, new)},
+                         {(result['view'], 'wall_ms') for result in results})
+
+@override_settings(SERVER_TIMING=True)
+class ServerTimingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.recipe = Recipe.objects.create(user=self.user, name='Soup', difficulty=1, public=True,
+                                            time_needed=timedelta(minutes=20), instructions='Boil')
+
+    def get_timings(self, response):
+        timings = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, duration, *desc = metric.split(';')
+            timings[name] = (float(duration.split('=')[1]), desc)
+        return timings
+
+    def test_header_and_log_line(self):
+        with self.assertLogs('mealplanner.timing', 'INFO') as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('recipe_detail', args=[self.recipe.id]))
+
+        timings = self.get_timings(response)
+        self.assertEqual(set(timings), {'db', 'template', 'view', 'total'})
+        self.assertEqual(timings['db'][1], [f'desc="{len(queries)} queries"'])
+        self.assertGreater(timings['template'][0], 0)
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'recipe_detail')
+        self.assertEqual(line['status'], 200)
+        self.assertEqual(line['queries'], len(queries))
+        self.assertAlmostEqual(line['db_ms'] + line['template_ms'] + line['view_ms'], line['total_ms'], places=2)
+
+    def test_accounts_urls(self):
+        with self.assertLogs('mealplanner.timing', 'INFO'):
+            response = self.client.get(reverse('signup'))
+        self.assertIn('Server-Timing', response)
+
+    def test_async_requests_stay_async(self):
+        async def view(request):
+            return HttpResponse()
+        self.assertTrue(iscoroutinefunction(ServerTimingMiddleware(view)))
+
+        with self.assertLogs('mealplanner.timing', 'INFO') as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = async_to_sync(self.async_client.get)(reverse('recipe_detail', args=[self.recipe.id]))
+        self.assertEqual(self.get_timings(response)['db'][1], [f'desc="{len(queries)} queries"'])
+        self.assertGreater(len(queries), 0)
+        self.assertEqual(json.loads(logs.records[0].getMessage())['view'], 'recipe_detail')
+
+    @override_settings(SERVER_TIMING=False)
+    def test_off(self):
+        response = self.client.get(reverse('recipe_list'))
+        self.assertNotIn('Server-Timing', response)
+
+class QueryPlanTest(TestCase):
+    def test_hot_lookups_use_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('All query plans use an index.', out.getvalue())
+
+    def test_full_scans_found(self):
+        self.assertEqual(find_full_scans(['SCAN mealplanner_tag']), ['SCAN mealplanner_tag'])
+        self.assertEqual(find_full_scans(['SCAN mealplanner_recipe USING INDEX recipe_public_idx'], {'recipe_public_idx'}), [])
+        self.assertEqual(find_full_scans(['SEARCH mealplanner_tag USING COVERING INDEX tag_name_idx (name=?)']), [])
+
+    def test_dropped_index_fails(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX tag_name_idx')
+        with self.assertRaisesMessage(CommandError, 'tag by name'):
+            call_command('check_query_plans', stdout=StringIO())
+
+class RecipeImportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.flour = Ingredient.objects.create(name='Flour', measurement_unit='g')
+
+    def import_file(self, content, suffix, **options):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_recipes', f.name, user='testuser', stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_jsonl_import(self):
+        records = [
+            {'name': 'Pancakes', 'difficulty': 1, 'time_needed': 20, 'public': True, 'instructions': '1. Mix',
+             'ingredients': [{'name': 'Flour', 'unit': 'g', 'amount': 200}, {'name': 'Egg', 'unit': 'unit', 'amount': 2}],
+             'tags': ['Breakfast', 'Breakfast'], 'nutrition': {'calories': 520, 'fat': 12, 'carbs': 80, 'protein': 18}},
+            {'name': 'Omelette', 'difficulty': 2, 'time_needed': '00:10:00',
+             'ingredients': [{'name': 'Egg', 'unit': 'unit', 'amount': 3}], 'tags': ['Breakfast']},
+            {'name': 'Broken', 'difficulty': 7},
+            {'type': 'meal_plan', 'name': 'Week 1'},
+        ]
+        out, err = self.import_file('\n'.join(json.dumps(record) for record in records) + '\nnot json\n', '.jsonl', batch_size=1)
+
+        self.assertIn('Imported 2 recipes (2 skipped), creating 1 ingredients and 1 tags.', out)
+        self.assertIn('Skipped line 3: invalid difficulty 7', err)
+        self.assertIn('Skipped line 5: invalid JSON', err)
+
+        pancakes = Recipe.objects.get(name='Pancakes')
+        self.assertEqual(pancakes.user, self.user)
+        self.assertEqual(pancakes.instructions_html, '<ol>\n<li>Mix</li>\n</ol>')
+        self.assertEqual(pancakes.recipe_ingredients.get(ingredient__name='Flour').ingredient, self.flour)
+        self.assertEqual(list(pancakes.tags.values_list('tag__name', flat=True)), ['Breakfast'])
+        self.assertEqual(pancakes.recipenutrition.calories, 520)
+        self.assertEqual(Recipe.objects.get(name='Omelette').time_needed, timedelta(minutes=10))
+        self.assertEqual(Tag.objects.filter(name='Breakfast').count(), 1)
+        self.assertEqual(list(search_recipes(Recipe.objects.all(), 'egg').values_list('name', flat=True)), ['Omelette', 'Pancakes'])
+
+    def test_fields_that_are_not_lists(self):
+        records = [
+            {'name': 'Toast', 'difficulty': 1, 'time_needed': 5, 'tags': 'Breakfast'},
+            {'name': 'Jam', 'difficulty': 1, 'time_needed': 5, 'ingredients': {'name': 'Sugar', 'unit': 'g', 'amount': 1}},
+            {'name': 'Porridge', 'difficulty': 1, 'time_needed': 5, 'ingredients': ['Oats']},
+        ]
+        out, err = self.import_file('\n'.join(json.dumps(record) for record in records), '.jsonl')
+        self.assertIn('Imported 0 recipes (3 skipped)', out)
+        self.assertIn('Skipped line 1: tags is not a list', err)
+        self.assertIn('Skipped line 2: ingredients is not a list', err)
+        self.assertIn('Skipped line 3: ingredient is not an object', err)
+        self.assertFalse(Tag.objects.exists())
+
+    def test_csv_import(self):
+        content = (
+            'name,difficulty,time_needed,public,instructions,ingredients,tags,calories,fat,carbs,protein\n'
+            'Bread,1,60,yes,Bake,500 g Flour; 1 tsp Fine salt,Baking; Vegan,1200,10,240,40\n'
+        )
+        out, _ = self.import_file(content, '.csv')
+        self.assertIn('Imported 1 recipes (0 skipped)', out)
+
+        bread = Recipe.objects.get(name='Bread')
+        self.assertTrue(bread.public)
+        self.assertEqual(
+            sorted(bread.recipe_ingredients.values_list('ingredient__name', 'ingredient__measurement_unit', 'measurement_amount')),
+            [('Fine salt', 'tsp', 1.0), ('Flour', 'g', 500.0)],
+        )
+        self.assertEqual(sorted(bread.tags.values_list('tag__name', flat=True)), ['Baking', 'Vegan'])
+        self.assertEqual(bread.recipenutrition.carbs, 240)
+
+    def test_batches_use_bulk_inserts(self):
+        records = [
+            {'name': f'Recipe {i}', 'difficulty': 1, 'time_needed': 10, 'tags': ['Quick'],
+             'ingredients': [{'name': 'Flour', 'unit': 'g', 'amount': i}]}
+            for i in range(50)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            self.import_file('\n'.join(json.dumps(record) for record in records), '.jsonl', batch_size=25)
+        self.assertEqual(Recipe.objects.count(), 50)
+        self.assertLess(len(queries), 30)
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        flour = Ingredient.objects.create(name='Flour', measurement_unit='g')
+        self.bread = Recipe.objects.create(user=self.user, name='Bread', difficulty=1, public=True,
+                                           time_needed=timedelta(minutes=60), instructions='Bake')
+        IngredientInRecipe.objects.create(recipe=self.bread, ingredient=flour, measurement_amount=500)
+        RecipeTag.objects.create(recipe=self.bread, tag=Tag.objects.create(name='Baking'))
+        RecipeNutrition.objects.create(recipe=self.bread, calories=1200, fat=10, carbs=240, protein=25)
+        Recipe.objects.create(user=self.user, name='Toast', difficulty=1, time_needed=timedelta(minutes=5), instructions='Toast')
+        self.plan = MealPlan.objects.create(user=self.user, name='Week 1')
+        MealPlanItem.objects.create(meal_plan=self.plan, recipe=self.bread, weekday=2)
+
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        Recipe.objects.create(user=other_user, name='Not mine', difficulty=1, time_needed=timedelta(minutes=5), instructions='')
+        self.client.login(username='testuser', password='testpassword')
+
+    def read_export(self, url):
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.is_async)  # Under WSGI the export streams from a sync iterator
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_export_everything(self):
+        records = self.read_export(reverse('export_data'))
+        self.assertEqual([(record['type'], record['name']) for record in records],
+                         [('recipe', 'Bread'), ('recipe', 'Toast'), ('meal_plan', 'Week 1')])
+        self.assertEqual(records[0]['ingredients'], [{'name': 'Flour', 'unit': 'g', 'amount': 500.0}])
+        self.assertEqual(records[0]['tags'], ['Baking'])
+        self.assertEqual(records[0]['nutrition']['calorie_colour'], 3)
+        self.assertIsNone(records[1]['nutrition'])
+        self.assertEqual(records[2]['items'], [{'weekday': 2, 'recipe_id': self.bread.id, 'recipe': 'Bread'}])
+
+    def test_export_by_type(self):
+        self.assertEqual({record['type'] for record in self.read_export(reverse('export_recipes'))}, {'recipe'})
+        self.assertEqual({record['type'] for record in self.read_export(reverse('export_mealplans'))}, {'meal_plan'})
+
+    def test_queries_per_chunk(self):
+        # Prefetching happens once per chunk, not once per recipe
+        for i in range(20):
+            Recipe.objects.create(user=self.user, name=f'Extra {i}', difficulty=1, time_needed=timedelta(minutes=5), instructions='')
+        with CaptureQueriesContext(connection) as queries:
+            records = list(stream_export(self.user, ('recipe',), chunk_size=100))
+        self.assertEqual(len(records), 22)
+        self.assertEqual(len(queries), 3)
+
+    async def test_async_export_matches(self):
+        for i in range(5):
+            await Recipe.objects.acreate(user=self.user, name=f'Extra {i}', difficulty=1, time_needed=timedelta(minutes=5), instructions='')
+        lines = [line async for line in astream_export(self.user, chunk_size=2)]
+        self.assertEqual(lines, await sync_to_async(lambda: list(stream_export(self.user, chunk_size=2)))())
+        self.assertEqual(len(lines), 8)
+
+    def test_command_round_trip(self):
+        out = StringIO()
+        call_command('export_data', user='testuser', type=['recipe'], stdout=out)
+        User.objects.create_user(username='restored', password='testpassword')
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write(out.getvalue())
+        self.addCleanup(os.remove, f.name)
+        call_command('import_recipes', f.name, user='restored', stdout=StringIO())
+
+        restored = Recipe.objects.get(user__username='restored', name='Bread')
+        self.assertEqual(restored.time_needed, timedelta(minutes=60))
+        self.assertEqual(restored.recipenutrition.protein_colour, 2)
+        self.assertEqual(list(restored.tags.values_list('tag__name', flat=True)), ['Baking'])
+
+class JsonApiTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        self.flour = Ingredient.objects.create(name='Flour', measurement_unit='g')
+        self.bread = Recipe.objects.create(user=self.user, name='Bread', difficulty=2, public=True,
+                                           time_needed=timedelta(minutes=60), instructions='Bake')
+        IngredientInRecipe.objects.create(recipe=self.bread, ingredient=self.flour, measurement_amount=500)
+        self.secret = Recipe.objects.create(user=self.user, name='Secret', difficulty=1,
+                                            time_needed=timedelta(minutes=5), instructions='Shh')
+        self.theirs = Recipe.objects.create(user=self.other_user, name='Theirs', difficulty=3, public=True,
+                                            time_needed=timedelta(minutes=5), instructions='')
+        Recipe.objects.create(user=self.other_user, name='Their secret', difficulty=1,
+                              time_needed=timedelta(minutes=5), instructions='')
+        self.plan = MealPlan.objects.create(user=self.user, name='Week 1')
+        MealPlanItem.objects.create(meal_plan=self.plan, recipe=self.bread, weekday=1)
+
+    def get_names(self, response):
+        return [recipe['name'] for recipe in response.json()['results']]
+
+    def test_recipe_visibility(self):
+        self.assertEqual(self.get_names(self.client.get(reverse('api_recipe_list'))), ['Bread', 'Theirs'])
+        self.client.login(username='testuser', password='testpassword')
+        self.assertEqual(self.get_names(self.client.get(reverse('api_recipe_list'))), ['Bread', 'Secret', 'Theirs'])
+        self.assertEqual(self.client.get(reverse('api_recipe_detail', args=[self.secret.id])).status_code, 200)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api_recipe_detail', args=[self.secret.id])).status_code, 403)
+        self.assertEqual(self.client.get(reverse('api_recipe_detail', args=[999])).status_code, 404)
+
+    def test_sparse_fields_and_pagination(self):
+        response = self.client.get(reverse('api_recipe_list'), {'fields': 'name,ingredients', 'limit': 1, 'sort': '-difficulty'})
+        self.assertEqual(response.json()['results'], [{'name': 'Theirs', 'ingredients': []}])
+
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(response.json(), {
+            'results': [{'name': 'Bread', 'ingredients': [{'name': 'Flour', 'unit': 'g', 'amount': 500.0}]}],
+            'next': None,
+        })
+        self.assertEqual(self.client.get(reverse('api_recipe_list'), {'fields': 'name,password'}).status_code, 400)
+
+    def test_not_modified(self):
+        url = reverse('api_recipe_detail', args=[self.bread.id])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(response.json()['ingredients'][0]['amount'], 500.0)
+
+        # A matching ETag is answered from the version alone
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(queries), 1)
+
+        # Changing an ingredient changes the recipe's version
+        IngredientInRecipe.objects.filter(recipe=self.bread).get().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Different fields are a different representation
+        self.assertNotEqual(self.client.get(url, {'fields': 'name'})['ETag'], response['ETag'])
+
+    def test_list_not_modified(self):
+        url = reverse('api_recipe_list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.theirs.name = 'Renamed'
+        self.theirs.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_mealplans(self):
+        url = reverse('api_mealplan_detail', args=[self.plan.id])
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.login(username='otheruser', password='testpassword')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(reverse('api_mealplan_list')).json()['results'], [])
+
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.get(url)
+        data = response.json()
+        self.assertEqual(data['items'], [{'id': self.plan.meal_plan_items.get().id, 'weekday': 1, 'recipe_id': self.bread.id, 'recipe': 'Bread'}])
+        self.assertEqual(data['shopping_list'], [{'ingredient': 'Flour', 'unit': 'g', 'amount': 500.0}])
+        self.assertEqual(len(data['nutrition']), 7)
+        self.assertEqual(self.client.get(reverse('api_mealplan_list')).json()['results'], [{'id': self.plan.id, 'name': 'Week 1'}])
+
+        # Editing a recipe in the plan changes the plan's version
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        RecipeNutrition.objects.create(recipe=self.bread, calories=1200, fat=10, carbs=240, protein=25)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['nutrition'][1]['calories'], 1200)
+
+    def test_mealplan_nutrition_is_prefetched(self):
+        # Listing the plans' nutrition takes the same number of queries however many plans there are
+        self.client.login(username='testuser', password='testpassword')
+        url = reverse('api_mealplan_list')
+        rebuild_summary(self.plan)
+        with CaptureQueriesContext(connection) as one_plan:
+            self.client.get(url, {'fields': 'id,nutrition'})
+
+        for i in range(3):
+            plan = MealPlan.objects.create(user=self.user, name=f'Week {i + 2}')
+            MealPlanItem.objects.create(meal_plan=plan, recipe=self.bread, weekday=i)
+            rebuild_summary(plan)
+        with CaptureQueriesContext(connection) as four_plans:
+            response = self.client.get(url, {'fields': 'id,nutrition'})
+
+        self.assertEqual(len(four_plans), len(one_plan))
+        results = response.json()['results']
+        self.assertEqual(len(results), 4)
+        self.assertEqual([day['weekday'] for day in results[1]['nutrition']], list(range(7)))
+
+@override_settings(PAGE_CACHE_TIMEOUT=60, PAGE_CACHE_GRACE=300, PAGE_CACHE_LOCK_TIMEOUT=2)
+class PageCacheTest(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.recipe = Recipe.objects.create(user=self.user, name='Soup', difficulty=1, public=True,
+                                            time_needed=timedelta(minutes=20), instructions='Boil')
+
+    def get_key(self, url):
+        return get_page_key(RequestFactory().get(url), get_generation(get_cache()))
+
+    def test_anonymous_pages_cached(self):
+        url = reverse('recipe_detail', args=[self.recipe.id])
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Soup')
+        self.assertNotContains(self.client.get(reverse('recipe_list')), 'csrfmiddlewaretoken')
+
+        # Each query string is cached separately
+        self.assertEqual(self.client.get(reverse('recipe_list'), {'difficulty': 1})['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(reverse('recipe_list'), {'difficulty': 2})['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(reverse('recipe_list'), {'difficulty': 1})['X-Page-Cache'], 'hit')
+
+    def test_logged_in_not_cached(self):
+        self.client.login(username='testuser', password='testpassword')
+        self.assertNotIn('X-Page-Cache', self.client.get(reverse('recipe_list')))
+
+    def test_saves_invalidate(self):
+        url = reverse('recipe_detail', args=[self.recipe.id])
+        self.client.get(url)
+        RecipeNutrition.objects.create(recipe=self.recipe, calories=321, calorie_colour=1, fat=1, fat_colour=1,
+                                       carbs=1, carbs_colour=1, protein=1, protein_colour=1)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, '321')
+
+        IngredientInRecipe.objects.create(recipe=self.recipe, measurement_amount=1,
+                                          ingredient=Ingredient.objects.create(name='Leek', measurement_unit='unit'))
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+
+    def test_stale_copy_served_while_another_worker_renders(self):
+        url = reverse('recipe_detail', args=[self.recipe.id])
+        self.client.get(url)
+        key = self.get_key(url)
+        entry = get_cache().get(key)
+        get_cache().set(key, {**entry, 'fresh_until': 0})
+        get_cache().add(key + ':lock', 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url)['X-Page-Cache'], 'stale')
+
+        # Once the lock is free the next request renders it again
+        get_cache().delete(key + ':lock')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+
+    def test_waits_for_another_worker(self):
+        url = reverse('recipe_detail', args=[self.recipe.id])
+        key = self.get_key(url)
+        get_cache().add(key + ':lock', 1)
+        entry = {'content': b'rendered elsewhere', 'content_type': 'text/html', 'fresh_until': time.time() + 60}
+        timer = threading.Timer(0.2, get_cache().set, [key, entry])
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertEqual(response.content, b'rendered elsewhere')
+
+class RecipeCardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.recipes = [
+            Recipe.objects.create(user=self.user, name=f'Recipe {i}', difficulty=1, public=True,
+                                  time_needed=timedelta(minutes=90), instructions='Cook')
+            for i in range(3)
+        ]
+        RecipeTag.objects.create(recipe=self.recipes[0], tag=Tag.objects.create(name='Quick'))
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_cards_cached_per_version(self):
+        recipes = list(Recipe.objects.order_by('id'))
+        cards = render_recipe_cards(recipes)
+        self.assertEqual(len(cards), 3)
+        self.assertIn('Quick', cards[0])
+        self.assertIn('No tags', cards[1])
+        self.assertIsNotNone(get_card_cache().get(get_card_key(recipes[0])))
+
+        # With every card cached, the tags aren't loaded
+        with self.assertNumQueries(0):
+            self.assertEqual(render_recipe_cards(recipes), cards)
+
+        # Retagging a recipe gives it a new version, so only its card is rendered again
+        RecipeTag.objects.create(recipe=self.recipes[1], tag=Tag.objects.create(name='Vegan'))
+        recipes = list(Recipe.objects.order_by('id'))
+        with CaptureQueriesContext(connection) as queries:
+            new_cards = render_recipe_cards(recipes)
+        self.assertEqual(len(queries), 1)
+        self.assertIn(str(self.recipes[1].id), queries[0]['sql'])
+        self.assertIn('Vegan', new_cards[1])
+        self.assertEqual([new_cards[0], new_cards[2]], [cards[0], cards[2]])
+
+    @override_settings(
+        CACHES={**settings.CACHES, 'cards': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'cards'}},
+        RECIPE_CARD_CACHE_ALIAS='cards',
+    )
+    def test_cards_use_their_cache_alias(self):
+        recipes = list(Recipe.objects.order_by('id'))
+        render_recipe_cards(recipes)
+        self.assertIsNotNone(caches['cards'].get(get_card_key(recipes[0])))
+        self.assertIsNone(cache.get(get_card_key(recipes[0])))
+        caches['cards'].clear()
+
+    def test_recipe_list_shows_cards(self):
+        response = self.client.get(reverse('recipe_list'))
+        self.assertContains(response, '1 hrs 30 mins', count=3)
+        self.assertContains(response, reverse('recipe_detail', args=[self.recipes[2].id]))
+
+class IngredientAutocompleteTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        for name in ['Chicken thighs', 'Chickpeas', 'Chicken', 'Crème fraîche', 'Rice']:
+            Ingredient.objects.create(name=name, measurement_unit='g')
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_prefix_matches_ranked(self):
+        names = [ingredient.name for ingredient in autocomplete_ingredients('  CHICK')]
+        self.assertEqual(names, ['Chicken', 'Chickpeas', 'Chicken thighs'])
+        self.assertEqual([ingredient.name for ingredient in autocomplete_ingredients('creme f')], ['Crème fraîche'])
+        self.assertEqual(list(autocomplete_ingredients(' ')), [])
+
+    def test_renamed_ingredient_found(self):
+        ingredient = Ingredient.objects.get(name='Rice')
+        ingredient.name = 'Basmati rice'
+        ingredient.save()
+        self.assertEqual(list(autocomplete_ingredients('basm')), [ingredient])
+
+    def test_autocomplete_view(self):
+        response = self.client.get(reverse('ingredient_autocomplete'), {'q': 'chicken'})
+        self.assertContains(response, '<option value=', count=2)
+        self.assertContains(response, 'Chicken thighs (grams)')
+        self.assertContains(self.client.get(reverse('ingredient_autocomplete'), {'q': 'zzz'}), 'No matching ingredients')
+
+    def test_edit_recipe_lists_no_ingredients(self):
+        recipe = Recipe.objects.create(user=self.user, name='Curry', difficulty=1, time_needed=timedelta(minutes=30),
+                                       instructions='Cook')
+        response = self.client.get(reverse('edit_recipe', args=[recipe.id]))
+        self.assertContains(response, reverse('ingredient_autocomplete'))
+        self.assertNotContains(response, 'Chickpeas')
+
+class RecipeFacetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        self.vegan = Tag.objects.create(name='Vegan')
+        self.quick = Tag.objects.create(name='Quick')
+        Tag.objects.create(name='Unused')
+        for difficulty, minutes, tags, public in [
+            (1, 20, [self.vegan, self.quick], True), (1, 40, [self.vegan], True), (2, 60, [self.vegan], True),
+            (3, 20, [self.quick], False),
+        ]:
+            recipe = Recipe.objects.create(user=self.user, name='Recipe', difficulty=difficulty, public=public,
+                                           time_needed=timedelta(minutes=minutes), instructions='Cook')
+            for tag in tags:
+                RecipeTag.objects.create(recipe=recipe, tag=tag)
+        private = Recipe.objects.create(user=self.other_user, name='Private', difficulty=1, time_needed=timedelta(minutes=10),
+                                        instructions='Cook')
+        RecipeTag.objects.create(recipe=private, tag=Tag.objects.get(name='Unused'))
+
+    def test_counts_for_visible_recipes(self):
+        facets = get_facets(QueryDict(), self.user)
+        self.assertEqual(facets['difficulty'], {1: 2, 2: 1, 3: 1})
+        self.assertEqual(facets['time_category'], {'under_30': 2, '30_to_45': 1, 'over_45': 1})
+        self.assertEqual(facets['tags'], [(self.vegan.id, 'Vegan', 3), (self.quick.id, 'Quick', 2)])
+
+    def test_counts_ignore_own_filter(self):
+        with self.assertNumQueries(5):  # One per facet, and checking the chosen tag for the two filtered by it
+            facets = get_facets(QueryDict(f'difficulty=1&tags={self.quick.id}'), AnonymousUser())
+        self.assertEqual(facets['difficulty'], {1: 1})
+        self.assertEqual(facets['time_category'], {'under_30': 1, '30_to_45': 0, 'over_45': 0})
+        self.assertEqual(facets['tags'], [(self.vegan.id, 'Vegan', 2), (self.quick.id, 'Quick', 1)])
+
+    def test_chosen_tags_always_listed(self):
+        # Unused has no visible recipes at all, and Quick none with difficulty 2, but both stay selectable
+        unused = Tag.objects.get(name='Unused')
+        with self.settings(TAG_FACET_LIMIT=1):
+            facets = get_facets(QueryDict(f'difficulty=2&tags={self.quick.id}&tags={unused.id}'), self.user)
+        self.assertEqual(facets['tags'], [(self.vegan.id, 'Vegan', 1), (self.quick.id, 'Quick', 0), (unused.id, 'Unused', 0)])
+
+        recipe_filter = RecipeFilter(QueryDict(f'tags={unused.id}'), queryset=Recipe.objects.all())
+        recipe_filter.apply_facets(facets)
+        self.assertIn(unused.id, [tag_id for tag_id, _ in recipe_filter.form.fields['tags'].widget.choices])
+
+    def test_counts_cached_until_recipes_change(self):
+        get_facets(QueryDict(), self.user)
+        with self.assertNumQueries(0):
+            get_facets(QueryDict('sort=difficulty'), self.user)
+
+        Recipe.objects.create(user=self.user, name='New', difficulty=2, time_needed=timedelta(minutes=10),
+                              instructions='Cook')
+        self.assertEqual(get_facets(QueryDict(), self.user)['difficulty'], {1: 2, 2: 2, 3: 1})
+
+    def test_filter_form_shows_counts(self):
+        response = self.client.get(reverse('recipe_list'), {'tags': self.vegan.id})
+        self.assertContains(response, f'<option value="{self.vegan.id}" selected>Vegan (3)</option>', html=True)
+        self.assertContains(response, '<option value="1">Easy (2)</option>', html=True)
+        self.assertNotContains(response, 'Unused')
+        self.assertEqual(len(response.context['public_recipes']), 3)
+
+    def test_no_counts_during_search(self):
+        response = self.client.get(reverse('recipe_list'), {'q': 'recipe', 'difficulty': 2})
+        self.assertContains(response, '<option value="1">Easy</option>', html=True)
+        self.assertNotContains(response, 'Vegan (')
+
+class AsyncViewTest(TestCase):
+    # Requests go through the ASGI handler, so the async views run on the event loop
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        cls.other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        cls.recipe = Recipe.objects.create(user=cls.user, name='Rice', difficulty=1, public=True,
+                                           time_needed=timedelta(minutes=20), instructions='Boil')
+        rice = Ingredient.objects.create(name='Rice', measurement_unit='g')
+        IngredientInRecipe.objects.create(recipe=cls.recipe, ingredient=rice, measurement_amount=100)
+        cls.mealplan = MealPlan.objects.create(user=cls.user, name='Week one')
+        MealPlanItem.objects.create(meal_plan=cls.mealplan, recipe=cls.recipe, weekday=2)
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_anonymous_recipe_pages(self):
+        response = await self.async_client.get(reverse('recipe_list'))
+        self.assertContains(response, 'Rice')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+
+        response = await self.async_client.get(reverse('recipe_detail', args=[self.recipe.id]))
+        self.assertContains(response, '100.0')
+        response = await self.async_client.get(reverse('recipe_detail', args=[self.recipe.id]))
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+
+    async def test_mealplan_detail(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('mealplan_detail', args=[self.mealplan.id]))
+        self.assertContains(response, 'Week one')
+        self.assertContains(response, 'Wednesday')
+
+        await self.async_client.aforce_login(self.other_user)
+        response = await self.async_client.get(reverse('mealplan_detail', args=[self.mealplan.id]))
+        self.assertEqual(response.status_code, 403)
+
+    async def test_exports_stream(self):
+        # Under ASGI the exports are async iterators, so Django sends each chunk as it is produced
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('export_data'))
+        self.assertTrue(response.streaming)
+        self.assertTrue(response.is_async)
+        lines = [json.loads(line) async for line in response.streaming_content]
+        self.assertEqual([(record['type'], record['name']) for record in lines], [('recipe', 'Rice'), ('meal_plan', 'Week one')])
+
+        response = await self.async_client.get(reverse('shopping_list_export'), {'plan': self.mealplan.id})
+        self.assertTrue(response.is_async)
+        self.assertEqual([line async for line in response.streaming_content], [b'ingredient,amount,unit\r\n', b'Rice,100.0,g\r\n'])
+
+    async def test_nutrition_lookup(self):
+        async def nutrients_many(lines):
+            food = {'nf_calories': 130, 'nf_total_fat': 0.3, 'nf_total_carbohydrate': 28, 'nf_protein': 2.7}
+            return {line: {'foods': [food]} for line in lines}
+
+        await self.async_client.aforce_login(self.user)
+        with mock.patch('mealplanner.views.get_client') as get_client:
+            get_client.return_value.nutrients_many = nutrients_many
+            response = await self.async_client.get(reverse('get_nutri_data', args=[self.recipe.id]))
+        self.assertEqual(response.json(), {'calories': 130, 'fat': 0.3, 'carbs': 28, 'protein': 2.7})
+        self.assertTrue(await NutritionCacheEntry.objects.filter(line='100 g of rice').aexists())
+
+
+class NutritionJobTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        cls.other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        cls.recipe = Recipe.objects.create(user=cls.user, name='Rice', difficulty=1, public=True,
+                                           time_needed=timedelta(minutes=20), instructions='Boil')
+        rice = Ingredient.objects.create(name='Rice', measurement_unit='g')
+        IngredientInRecipe.objects.create(recipe=cls.recipe, ingredient=rice, measurement_amount=100)
+        Job.objects.all().delete()  # Adding the ingredient queued a similar recipes refresh
+
+    # Patch the Nutritionix client used by the jobs (and quieten their logging), failing the first `failures` lookups
+    def mock_client(self, failures=0):
+        calls = []
+
+        async def nutrients_many(lines):
+            calls.append(lines)
+            if len(calls) <= failures:
+                return dict.fromkeys(lines)
+            food = {'nf_calories': 130, 'nf_total_fat': 0.3, 'nf_total_carbohydrate': 28, 'nf_protein': 2.7}
+            return {line: {'foods': [food]} for line in lines}
+
+        patcher = mock.patch('mealplanner.jobs.get_client')
+        patcher.start().return_value.nutrients_many = nutrients_many
+        self.addCleanup(patcher.stop)
+        logger_patcher = mock.patch('mealplanner.jobs.logger')
+        logger_patcher.start()
+        self.addCleanup(logger_patcher.stop)
+        return calls
+
+    def test_jobs_are_deduplicated_while_queued(self):
+        job = jobs.enqueue(jobs.NUTRITION_JOB, self.recipe.id)
+        self.assertEqual(jobs.enqueue(jobs.NUTRITION_JOB, self.recipe.id), job)
+        self.assertEqual(jobs.enqueue_many(jobs.NUTRITION_JOB, [self.recipe.id, self.recipe.id]), 0)
+        self.assertEqual(Job.objects.count(), 1)
+
+        # Once it is running, new work for the same recipe gets a job of its own
+        self.assertEqual(jobs.claim_job('worker'), job)
+        self.assertIsNone(jobs.claim_job('another worker'))
+        self.assertNotEqual(jobs.enqueue(jobs.NUTRITION_JOB, self.recipe.id), job)
+
+    def test_job_saves_nutrition(self):
+        self.mock_client()
+        RecipeNutrition.objects.create(recipe=self.recipe, calories=1000, fat=1, carbs=1, protein=1)
+        jobs.enqueue(jobs.NUTRITION_JOB, self.recipe.id)
+
+        self.assertEqual(jobs.work(burst=True), 1)
+        job = Job.objects.get()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.result, {'calories': 130, 'fat': 0.3, 'carbs': 28, 'protein': 2.7})
+
+        # The totals are replaced and the colours follow them
+        nutrition = RecipeNutrition.objects.get(recipe=self.recipe)
+        self.assertEqual((nutrition.calories, nutrition.calorie_colour), (130, 1))
+
+    def test_enqueue_many_counts_new_jobs(self):
+        # A job waiting to be retried later is made due now rather than queued twice
+        later = timezone.now() + timedelta(hours=1)
+        Job.objects.create(kind=jobs.NUTRITION_JOB, key=str(self.recipe.id), run_after=later)
+        self.assertEqual(jobs.enqueue_many(jobs.NUTRITION_JOB, [self.recipe.id, 'other'], batch_size=1), 1)
+        self.assertEqual(Job.objects.count(), 2)
+        self.assertLess(Job.objects.get(key=str(self.recipe.id)).run_after, later)
+
+    def test_enqueue_many_ignores_jobs_queued_elsewhere(self):
+        # Another process queues and starts the same work while this batch is being inserted
+        bulk_create = Job.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            Job.objects.create(kind=jobs.NUTRITION_JOB, key='other', status='running', run_after=timezone.now())
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Job.objects, 'bulk_create', racing_bulk_create):
+            self.assertEqual(jobs.enqueue_many(jobs.NUTRITION_JOB, ['other']), 1)
+        self.assertEqual(Job.objects.filter(key='other').count(), 2)
+
+    @override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_BACKOFF=0)
+    def test_failed_jobs_are_retried(self):
+        self.mock_client(failures=2)
+        job = jobs.enqueue(jobs.NUTRITION_JOB, self.recipe.id)
+
+        jobs.run_job(jobs.claim_job('worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('unavailable', job.last_error)
+
+        # Out of attempts
+        jobs.run_job(jobs.claim_job('worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertFalse(RecipeNutrition.objects.filter(recipe=self.recipe).exists())
+
+        # Retrying from the admin queues the work again
+        self.assertEqual(jobs.retry_failed_jobs(Job.objects.all()), 1)
+        jobs.work(burst=True)
+        self.assertEqual(Job.objects.filter(status='done').count(), 1)
+        self.assertTrue(RecipeNutrition.objects.filter(recipe=self.recipe).exists())
+
+    @override_settings(JOB_TIMEOUT=60)
+    def test_lost_jobs_are_run_again(self):
+        job = jobs.enqueue(jobs.NUTRITION_JOB, self.recipe.id)
+        jobs.claim_job('dead worker')
+        Job.objects.filter(id=job.id).update(locked_at=timezone.now() - timedelta(minutes=5))
+
+        jobs.requeue_stale_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertIn('dead worker', job.last_error)
+
+    @override_settings(JOB_TIMEOUT=60)
+    def test_stale_job_requeued_once(self):
+        job = jobs.enqueue(jobs.NUTRITION_JOB, self.recipe.id)
+        jobs.claim_job('dead worker')
+        Job.objects.filter(id=job.id).update(locked_at=timezone.now() - timedelta(minutes=5))
+        stale = Job.objects.get(id=job.id)
+
+        # One worker requeues the job and another claims it, then a second worker's stale copy is ignored
+        jobs.requeue_stale_jobs()
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.assertEqual(jobs.claim_job('new worker'), job)
+        self.assertFalse(jobs.retry_job(stale, 'Timed out on dead worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), ('running', 'new worker', 2))
+
+    @override_settings(JOB_RETENTION=60 * 60)
+    def test_old_finished_jobs_are_purged(self):
+        for status in ['done', 'failed', 'queued']:
+            Job.objects.create(kind=jobs.NUTRITION_JOB, key=f'old {status}', status=status, run_after=timezone.now())
+        Job.objects.update(updated_at=timezone.now() - timedelta(hours=2))
+        Job.objects.create(kind=jobs.NUTRITION_JOB, key='recent done', status='done', run_after=timezone.now())
+
+        # Queued jobs are never purged (this one isn't due, so the worker has nothing to run)
+        Job.objects.filter(key='old queued').update(run_after=timezone.now() + timedelta(hours=1))
+        with mock.patch('mealplanner.jobs.logger'):
+            self.assertEqual(jobs.work(burst=True), 0)
+        self.assertEqual(set(Job.objects.values_list('key', flat=True)), {'old queued', 'recent done'})
+
+    def test_status_endpoint(self):
+        self.mock_client()
+        url = reverse('nutrition_job', args=[self.recipe.id])
+        self.client.login(username='otheruser', password='testpassword')
+        self.assertEqual(self.client.post(url).status_code, 403)
+
+        self.client.login(username='testuser', password='testpassword')
+        self.assertEqual(self.client.get(url).json(), {'status': None})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'queued')
+
+        call_command('run_jobs', burst=True, stdout=StringIO())
+        status = self.client.get(url).json()
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['result']['calories'], 130)
+
+    def test_admin_queues_recipes(self):
+        admin = User.objects.create_superuser(username='admin', password='adminpassword')
+        other = Recipe.objects.create(user=self.user, name='Beans', difficulty=1, time_needed=timedelta(minutes=5))
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:mealplanner_recipe_changelist'), {
+            'action': 'queue_nutrition_estimates', '_selected_action': [self.recipe.id, other.id],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(Job.objects.values_list('key', flat=True)), {str(self.recipe.id), str(other.id)})
+
+
+class MealPlanGeneratorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        cls.quick = Tag.objects.create(name='Quick')
+        cls.recipes = []
+        for i in range(12):
+            recipe = Recipe.objects.create(user=cls.user if i % 2 else other_user, name=f'Recipe {i}', public=i != 0,
+                                           difficulty=1 + i % 3, time_needed=timedelta(minutes=10 + 5 * i))
+            RecipeNutrition.objects.create(recipe=recipe, calories=300 + 50 * i, calorie_colour=0, fat=10 + i,
+                                           fat_colour=0, carbs=40, carbs_colour=0, protein=20, protein_colour=0)
+            if i < 6:
+                RecipeTag.objects.create(recipe=recipe, tag=cls.quick)
+            cls.recipes.append(recipe)
+
+    def test_plan_week_comes_close_to_targets(self):
+        rng = np.random.default_rng(0)
+        nutrition = np.column_stack([rng.uniform(150, 1100, 2000), rng.uniform(2, 60, 2000),
+                                     rng.uniform(5, 120, 2000), rng.uniform(2, 60, 2000)])
+        targets = [2000, 70, 250, 90]
+
+        start = time.perf_counter()
+        picks = plan_week(nutrition, targets, days=7, meals_per_day=3, rng=rng)
+        self.assertLess(time.perf_counter() - start, 1)
+
+        self.assertEqual(picks.shape, (7, 3))
+        self.assertEqual(len(set(picks.flat)), 21)  # No recipe is repeated
+        totals = nutrition[picks].sum(axis=1)
+        self.assertTrue((np.abs(totals - targets) / targets < 0.1).all())
+        self.assertTrue((score_days(totals, targets) < 0.02).all())
+
+    def test_plan_week_with_fewer_recipes_than_meals(self):
+        rng = np.random.default_rng(0)
+        nutrition = np.column_stack([rng.uniform(150, 1100, 5), rng.uniform(2, 60, 5),
+                                     rng.uniform(5, 120, 5), rng.uniform(2, 60, 5)])
+        picks = plan_week(nutrition, [2000, 70, 250, 90], days=7, meals_per_day=3, rng=rng)
+
+        # 21 meals from 5 recipes: every recipe is used, and none more than once beyond the others
+        uses = np.bincount(picks.ravel(), minlength=5)
+        self.assertEqual(uses.sum(), 21)
+        self.assertLessEqual(uses.max() - uses.min(), 1)
+
+    def test_generate_view_writes_plan(self):
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.post(reverse('generate_mealplan'), {
+            'name': 'Auto week', 'calories': 600, 'protein': 20, 'meals_per_day': 1,
+            'tags': [self.quick.id], 'max_difficulty': 2,
+        })
+        mealplan = MealPlan.objects.get(name='Auto week')
+        self.assertRedirects(response, reverse('mealplan_edit', args=[mealplan.id]))
+
+        # One recipe a day, all visible, quick and no harder than medium
+        items = MealPlanItem.objects.filter(meal_plan=mealplan)
+        self.assertEqual(sorted(items.values_list('weekday', flat=True)), list(range(7)))
+        allowed = {recipe.id for i, recipe in enumerate(self.recipes) if 0 < i < 6 and 1 + i % 3 <= 2}
+        self.assertTrue(set(items.values_list('recipe_id', flat=True)) <= allowed)
+
+        # The summaries were built for the bulk inserted items
+        monday = MealPlanDaySummary.objects.get(meal_plan=mealplan, weekday=0)
+        planned = items.get(weekday=0).recipe.recipenutrition
+        self.assertEqual(monday.calories, planned.calories)
+
+    def test_generate_view_without_matches(self):
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.post(reverse('generate_mealplan'), {
+            'name': 'Too quick', 'calories': 600, 'meals_per_day': 1, 'max_time': '00:01:00',
+        })
+        self.assertContains(response, 'No recipes with nutrition information match')
+        response = self.client.post(reverse('generate_mealplan'), {'name': 'No targets', 'meals_per_day': 1})
+        self.assertContains(response, 'Set a target')
+        self.assertFalse(MealPlan.objects.exists())
+
+
+class SimilarRecipeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        ingredients = {name: Ingredient.objects.create(name=name, measurement_unit='g') for name in
+                       ['Chicken', 'Rice', 'Onion', 'Curry paste', 'Coconut milk', 'Lettuce', 'Tomato', 'Basil']}
+        spicy = Tag.objects.create(name='Spicy')
+
+        def make(name, names, user=cls.user, public=True, tags=()):
+            recipe = Recipe.objects.create(user=user, name=name, public=public, difficulty=1, time_needed=timedelta(minutes=30))
+            for ingredient in names:
+                IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredients[ingredient], measurement_amount=100)
+            for tag in tags:
+                RecipeTag.objects.create(recipe=recipe, tag=tag)
+            return recipe
+
+        cls.curry = make('Chicken curry', ['Chicken', 'Rice', 'Onion', 'Curry paste'], tags=[spicy])
+        cls.thai_curry = make('Thai curry', ['Chicken', 'Rice', 'Onion', 'Curry paste', 'Coconut milk'], tags=[spicy])
+        cls.secret_curry = make('Secret curry', ['Chicken', 'Rice', 'Onion', 'Curry paste'], user=other_user, public=False)
+        cls.salad = make('Salad', ['Lettuce', 'Tomato', 'Onion'])
+        cls.pasta = make('Pasta', ['Tomato', 'Basil'])
+        cls.ingredients = ingredients
+
+    def test_similarities_are_cosines(self):
+        vectors = similarity.load_vectors()
+        rows = np.arange(len(vectors['recipe_ids']))
+        similarities = similarity.get_similarities(vectors, rows)
+
+        self.assertTrue(np.allclose(np.diag(similarities), 1))
+        self.assertTrue(np.allclose(similarities, similarities.T))
+        curry, secret, pasta = np.searchsorted(vectors['recipe_ids'], [self.curry.id, self.secret_curry.id, self.pasta.id])
+        self.assertAlmostEqual(similarities[curry, pasta], 0)
+        self.assertLess(similarities[curry, secret], 1)  # Same ingredients, but only the curry is tagged
+
+    def test_neighbour_vectors_match_full_vectors(self):
+        # Refreshing the curry only loads recipes sharing something with it, weighted as in the full set
+        vectors = similarity.load_vectors(similarity.get_neighbours(self.curry.id))
+        self.assertNotIn(self.pasta.id, vectors['recipe_ids'])
+        full = similarity.load_vectors()
+
+        def scores(vectors):
+            row = np.searchsorted(vectors['recipe_ids'], self.curry.id)
+            similarities = similarity.get_similarities(vectors, np.array([row]))[0]
+            return dict(zip(vectors['recipe_ids'].tolist(), similarities.tolist()))
+        neighbour_scores, full_scores = scores(vectors), scores(full)
+        for recipe_id, score in neighbour_scores.items():
+            self.assertAlmostEqual(score, full_scores[recipe_id])
+
+    def test_rebuild_stores_public_matches(self):
+        similarity.rebuild_similar_recipes(batch_size=2)
+
+        suggestions = list(SimilarRecipe.objects.filter(recipe=self.curry).order_by('rank').values_list('similar_id', flat=True))
+        self.assertEqual(suggestions[0], self.thai_curry.id)
+        self.assertNotIn(self.secret_curry.id, suggestions)  # Private
+        self.assertNotIn(self.pasta.id, suggestions)  # Nothing in common
+        self.assertIn(self.curry.id, SimilarRecipe.objects.filter(recipe=self.secret_curry).values_list('similar_id', flat=True))
+
+    def test_refresh_after_ingredients_change(self):
+        similarity.rebuild_similar_recipes()
+        Job.objects.all().delete()
+
+        # Turning the pasta into a curry queues a refresh, which adds it to the curries' suggestions
+        for name in ['Chicken', 'Rice', 'Curry paste']:
+            IngredientInRecipe.objects.create(recipe=self.pasta, ingredient=self.ingredients[name], measurement_amount=100)
+        self.assertEqual(Job.objects.filter(kind=jobs.SIMILAR_JOB, status='queued').count(), 1)
+        with mock.patch('mealplanner.jobs.logger'):
+            jobs.work(burst=True)
+        self.assertTrue(SimilarRecipe.objects.filter(recipe=self.curry, similar=self.pasta).exists())
+        self.assertTrue(SimilarRecipe.objects.filter(recipe=self.pasta, similar=self.curry).exists())
+
+        # And taking them out again removes it
+        IngredientInRecipe.objects.filter(recipe=self.pasta, ingredient__name__in=['Chicken', 'Rice', 'Curry paste']).delete()
+        similarity.refresh_similar_recipes(self.pasta.id)
+        self.assertFalse(SimilarRecipe.objects.filter(recipe=self.curry, similar=self.pasta).exists())
+
+    def test_refresh_queued_when_visibility_changes(self):
+        Job.objects.all().delete()
+        self.pasta.name = 'Spaghetti'
+        self.pasta.save()
+        self.assertFalse(Job.objects.exists())
+
+        self.pasta.public = not self.pasta.public
+        self.pasta.save()
+        self.assertEqual(list(Job.objects.values_list('kind', 'key')), [(jobs.SIMILAR_JOB, str(self.pasta.id))])
+
+    def test_recipe_page_shows_suggestions(self):
+        similarity.rebuild_similar_recipes()
+        response = self.client.get(reverse('recipe_detail', args=[self.curry.id]))
+        self.assertContains(response, 'Similar recipes')
+        self.assertContains(response, 'Thai curry')
+        self.assertNotContains(response, 'Secret curry')
+
+
+class PantryTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='testpassword')
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        cls.ingredients = {name: Ingredient.objects.create(name=name, measurement_unit='g') for name in
+                           ['Rice', 'Onion', 'Chicken', 'Curry paste', 'Tomato']}
+        rice_units = Ingredient.objects.create(name='Rice', measurement_unit='unit')
+
+        def make(name, ingredients, user=cls.user, public=True):
+            recipe = Recipe.objects.create(user=user, name=name, public=public, difficulty=1, time_needed=timedelta(minutes=30))
+            for ingredient in ingredients:
+                IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, measurement_amount=100)
+            return recipe
+
+        i = cls.ingredients
+        cls.fried_rice = make('Fried rice', [rice_units, i['Onion']])
+        cls.curry = make('Chicken curry', [i['Rice'], i['Onion'], i['Chicken'], i['Curry paste']])
+        cls.soup = make('Tomato soup', [i['Tomato'], i['Onion']])
+        cls.secret = make('Secret rice', [i['Rice']], user=other_user, public=False)
+        cls.mine = make('My rice', [i['Rice'], i['Chicken'], i['Tomato']], public=False)
+
+    def setUp(self):
+        pantry.clear_index()
+
+    def test_recipes_ranked_by_coverage(self):
+        recipes, unknown = pantry.match_pantry(['rice', ' ONION ', 'Chicken', 'Truffle'], AnonymousUser())
+        self.assertEqual(unknown, ['Truffle'])
+        self.assertEqual([recipe.name for recipe in recipes], ['Fried rice', 'Chicken curry', 'Tomato soup'])
+        self.assertEqual((recipes[1].matched, recipes[1].total, recipes[1].missing), (3, 4, 1))
+
+        # Users also see their own private recipes
+        recipes, _ = pantry.match_pantry(['rice', 'chicken', 'tomato'], self.user)
+        self.assertEqual(recipes[0], self.mine)
+        self.assertNotIn(self.secret, recipes)
+
+    def test_index_follows_changes(self):
+        pantry.match_pantry(['rice'], self.user)  # Build the index
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientInRecipe.objects.create(recipe=self.soup, ingredient=self.ingredients['Rice'], measurement_amount=50)
+            self.soup.public = False
+            self.soup.save()
+            ingredient = self.ingredients['Curry paste']
+            ingredient.name = 'Garam masala'
+            ingredient.save()
+
+        # Matching only reads the index, the one query loads the matching recipes
+        with self.assertNumQueries(1):
+            recipes, unknown = pantry.match_pantry(['Tomato', 'rice', 'garam masala', 'curry paste'], self.user)
+        self.assertEqual(unknown, ['curry paste'])
+        soup = next(recipe for recipe in recipes if recipe == self.soup)
+        self.assertEqual((soup.matched, soup.total), (2, 3))
+        self.assertIn(self.curry, recipes)
+
+        recipes, _ = pantry.match_pantry(['tomato'], AnonymousUser())
+        self.assertNotIn(self.soup, recipes)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.curry.delete()
+        recipes, _ = pantry.match_pantry(['rice', 'garam masala'], self.user)
+        self.assertNotIn(self.curry, recipes)
+
+    def test_rolled_back_changes_leave_index_alone(self):
+        pantry.match_pantry(['rice'], self.user)  # Build the index
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    IngredientInRecipe.objects.create(recipe=self.soup, ingredient=self.ingredients['Rice'], measurement_amount=50)
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(callbacks, [])
+        recipes, _ = pantry.match_pantry(['rice'], AnonymousUser())
+        self.assertNotIn(self.soup, recipes)
+
+    def test_pantry_page_and_api(self):
+        response = self.client.get(reverse('pantry_search'), {'ingredients': 'rice\nonion, chicken'})
+        self.assertContains(response, 'Chicken curry')
+        self.assertContains(response, '3 of 4 ingredients, 1 missing')
+
+        response = self.client.get(reverse('api_pantry_match'), {'ingredient': ['rice,onion', 'chicken']})
+        self.assertEqual(response.json()['results'][0], {
+            'id': self.fried_rice.id, 'name': 'Fried rice', 'matched': 2, 'total': 2, 'missing': 0,
+        })
+        self.assertEqual(self.client.get(reverse('api_pantry_match')).status_code, 400)
+
+class NutritionColourTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.recipes = [
+            Recipe.objects.create(user=self.user, name=f'Recipe {i}', difficulty=1, time_needed=timedelta(minutes=10), instructions='')
+            for i in range(5)
+        ]
+
+    def test_get_colours(self):
+        colours = colours_module.get_colours([[400, 10.5, 90, 31], [np.nan, 0, 91, 15]])
+        self.assertEqual(colours.tolist(), [[1, 2, 2, 3], [0, 1, 3, 1]])
+
+    def test_saving_sets_colours(self):
+        nutrition = RecipeNutrition.objects.create(recipe=self.recipes[0], calories=800, fat=5, carbs=50, protein=15,
+                                                   calorie_colour=1)
+        self.assertEqual((nutrition.calorie_colour, nutrition.fat_colour, nutrition.carbs_colour, nutrition.protein_colour), (3, 1, 2, 1))
+
+        nutrition.calories = 300
+        nutrition.save()
+        self.assertEqual(RecipeNutrition.objects.get(pk=nutrition.pk).calorie_colour, 1)
+
+    def test_command_recomputes_changed_rows(self):
+        for i, recipe in enumerate(self.recipes):
+            RecipeNutrition.objects.create(recipe=recipe, calories=100 * (i + 3), fat=1, carbs=1, protein=1)
+        versions = dict(Recipe.objects.values_list('id', 'version'))
+
+        # Stricter thresholds only change the recipes that cross them
+        thresholds = {'calories': (350, 450), 'fat': (10, 21), 'carbs': (45, 90), 'protein': (15, 30)}
+        with override_settings(NUTRITION_COLOUR_THRESHOLDS=thresholds):
+            out = StringIO()
+            call_command('recompute_nutrition_colours', batch_size=2, stdout=out)
+        self.assertIn('Updated the colours of 4 recipes', out.getvalue())
+        self.assertEqual(
+            list(RecipeNutrition.objects.order_by('recipe_id').values_list('calorie_colour', flat=True)), [1, 2, 3, 3, 3],
+        )
+        changed = {recipe_id for recipe_id, version in Recipe.objects.values_list('id', 'version') if versions[recipe_id] != version}
+        self.assertEqual(changed, {recipe.id for recipe in self.recipes[1:]})
+
+        with override_settings(NUTRITION_COLOUR_THRESHOLDS=thresholds):
+            self.assertEqual(colours_module.recompute_colours(), 0)
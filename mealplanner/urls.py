@@ -1,21 +1,38 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path("", views.recipe_list, name="recipe_list"),
     path('recipes/<int:recipe_id>/', views.recipe_detail, name='recipe_detail'),
     path('recipes/add/', views.add_recipe, name='add_recipe'),
+    path('recipes/pantry/', views.pantry_search, name='pantry_search'),
     path('recipes/delete/<int:recipe_id>/', views.delete_recipe, name='delete_recipe'),
     path('recipes/edit/<int:recipe_id>/', views.edit_recipe, name='edit_recipe'),
     path('recipes/<int:recipe_id>/add_ingredient/', views.add_ingredient, name='add_ingredient'),
     path('recipes/ingredient/delete/<int:ingredient_id>/', views.delete_ingredient, name='delete_ingredient'),
+    path('ingredients/autocomplete/', views.ingredient_autocomplete, name='ingredient_autocomplete'),
     path('recipes/<int:recipe_id>/add_tag/', views.add_tag, name='add_tag'),
     path('recipes/<int:recipe_id>/nutri_data/', views.get_nutri_for_recipe, name='get_nutri_data'),
+    path('recipes/<int:recipe_id>/nutrition_job/', views.nutrition_job, name='nutrition_job'),
+    path('nutrition/cache_stats/', views.nutrition_cache_stats, name='nutrition_cache_stats'),
+    path('recipes/export/', views.export_data, {'types': ('recipe',)}, name='export_recipes'),
+    path('export/', views.export_data, name='export_data'),
 
     path('mealplans/', views.mealplan_list, name='mealplan_list'),
     path('mealplans/add/', views.add_mealplan, name='add_mealplan'),
+    path('mealplans/generate/', views.generate_mealplan, name='generate_mealplan'),
+    path('mealplans/shopping_list/', views.shopping_list_export, name='shopping_list_export'),
+    path('mealplans/export/', views.export_data, {'types': ('meal_plan',)}, name='export_mealplans'),
     path('mealplans/<int:mealplan_id>/', views.mealplan_detail, name='mealplan_detail'),
+    path('mealplans/<int:mealplan_id>/whatif/', views.mealplan_whatif, name='mealplan_whatif'),
     path('mealplans/edit/<int:mealplan_id>/', views.mealplan_edit, name='mealplan_edit'),
     path('mealplans/addrecipe/<int:mealplan_id>', views.add_recipe_to_mealplan, name='add_recipe_to_mealplan'),
+
+    # Read-only JSON API
+    path('api/v1/recipes/', api.recipe_list, name='api_recipe_list'),
+    path('api/v1/recipes/<int:recipe_id>/', api.recipe_detail, name='api_recipe_detail'),
+    path('api/v1/pantry/', api.pantry_match, name='api_pantry_match'),
+    path('api/v1/mealplans/', api.mealplan_list, name='api_mealplan_list'),
+    path('api/v1/mealplans/<int:mealplan_id>/', api.mealplan_detail, name='api_mealplan_detail'),
 ]
\ No newline at end of file
@@ -0,0 +1,23 @@
+from .models import Recipe, MealPlan, new_version
+
+# Row versions for ETags and cache keys.
+#
+# Recipe.version and MealPlan.version are replaced with a new random value whenever the
+# row, or anything shown along with it, changes: a recipe's ingredients, tags and
+# nutrition, and a meal plan's items and the recipes in them. The signal handlers in
+# signals.py call these, and code that bulk edits those rows must call them itself.
+
+
+# Give meal plans new versions
+def touch_meal_plans(meal_plan_ids):
+    meal_plan_ids = list(meal_plan_ids)
+    if meal_plan_ids:
+        MealPlan.objects.filter(id__in=meal_plan_ids).update(version=new_version())
+
+# Give recipes, and the meal plans they are in, new versions
+def touch_recipes(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    Recipe.objects.filter(id__in=recipe_ids).update(version=new_version())
+    MealPlan.objects.filter(meal_plan_items__recipe_id__in=recipe_ids).update(version=new_version())
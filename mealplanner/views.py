@@ -1,44 +1,95 @@
 # Import necessary modules and libraries
-from django.shortcuts import render, get_object_or_404, redirect
-from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
-from django.db.models import Q, Sum
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Q
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from collections import defaultdict
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 
 import os
 from dotenv import load_dotenv
 import json
-import markdown
-import requests
 
 # Import models, forms, and filters used in the views
-from .models import Recipe, RecipeNutrition, IngredientInRecipe, Ingredient, RecipeTag, Tag, MealPlan, MealPlanItem
-from .forms import RecipeForm, MealPlanForm, RecipeNutritionForm, RecipeInstructionsForm, IngredientForm, TagForm, MealplanRecipeForm
+from .models import Recipe, RecipeNutrition, IngredientInRecipe, RecipeTag, Tag, MealPlan, MealPlanItem, MealPlanIngredientTotal, WEEKDAY_CHOICES
+from .forms import RecipeForm, MealPlanForm, GenerateMealPlanForm, RecipeNutritionForm, RecipeInstructionsForm, IngredientForm, TagForm, MealplanRecipeForm
 from .filters import RecipeFilter
+from .facets import get_facets
+from .pagination import akeyset_page
+from .search import search_recipes, autocomplete_ingredients
+from .nutrition import normalize_line, alookup_lines, total_nutrition, get_cache_stats
+from .nutritionix import get_client
+from .summaries import get_day_summaries, aget_day_summaries, swap_delta, move_planned_recipes
+from .shopping import iter_shopping_list, aiter_shopping_list, stream_csv, astream_csv, stream_json, astream_json
+from .exporting import EXPORT_TYPES, stream_export, astream_export
+from .versions import touch_meal_plans
+from .pagecache import cache_anonymous_page
+from .cards import arender_recipe_cards
+from .planning import generate_meal_plan
+from .similarity import similar_recipes_query
+from .pantry import match_pantry, parse_pantry
+from .jobs import NUTRITION_JOB, enqueue, get_latest_job, get_job_status
 
 # Load environment variables from env file
 load_dotenv()
 
-# View to list recipes with optional search and filtering
-def recipe_list(request):
-    # Show public recipes to non-logged-in users, and both public and user-specific recipes to logged-in users
+# Helper to build the URL of another page, keeping the current search and filters
+def get_page_url(request, param, cursor=None):
+    params = request.GET.copy()
+    if cursor:
+        params[param] = cursor
+    else:
+        params.pop(param, None)
+    return '?' + params.urlencode()
+
+# Helper to split recipes into the user's own recipes and other public recipes, returning one bounded page of each
+async def get_recipe_sections(request, recipes):
     if request.user.is_authenticated:
-        recipes = Recipe.objects.filter(user=request.user) | Recipe.objects.filter(public=True)
+        my_recipes = recipes.filter(user=request.user)
+        public_recipes = recipes.filter(public=True).exclude(user=request.user)
     else:
-        recipes = Recipe.objects.filter(public=True)
-    
+        my_recipes = recipes.none()
+        public_recipes = recipes.filter(public=True)
+
+    # Each section is paginated separately with its own cursor
+    my_cursor = request.GET.get('my_cursor')
+    public_cursor = request.GET.get('cursor')
+    my_recipes, my_next_cursor = await akeyset_page(my_recipes, my_cursor, settings.RECIPE_PAGE_SIZE)
+    public_recipes, public_next_cursor = await akeyset_page(public_recipes, public_cursor, settings.RECIPE_PAGE_SIZE)
+
+    # Recipe cards are cached, tags are only loaded for the cards that have to be rendered
+    return {
+        'my_recipes': my_recipes,
+        'my_recipe_cards': await arender_recipe_cards(my_recipes),
+        'my_next_url': get_page_url(request, 'my_cursor', my_next_cursor) if my_next_cursor else None,
+        'my_first_url': get_page_url(request, 'my_cursor') if my_cursor else None,
+        'public_recipes': public_recipes,
+        'public_recipe_cards': await arender_recipe_cards(public_recipes),
+        'public_next_url': get_page_url(request, 'cursor', public_next_cursor) if public_next_cursor else None,
+        'public_first_url': get_page_url(request, 'cursor') if public_cursor else None,
+    }
+
+# View to list recipes with optional search and filtering
+@cache_anonymous_page
+async def recipe_list(request):
+    # Load the user up front, templates can't load it lazily in an async view
+    request.user = await request.auser()
     query = request.GET.get('q')
 
-    # Create filters form and apply search query if provided
-    recipe_filter = RecipeFilter(request.GET, queryset=recipes)
+    # Create filters form, visibility is applied when the recipes are split into sections.
+    # Checking the chosen tags and counting the facets use the blocking ORM, so they run in a worker thread.
+    # A search ignores the filters, so the counts (which describe the filters) aren't shown with it.
+    recipe_filter = RecipeFilter(request.GET, queryset=Recipe.objects.all())
+    await sync_to_async(recipe_filter.form.is_valid)()
+    recipe_filter.apply_facets(await sync_to_async(get_facets)(request.GET, request.user), show_counts=not query)
 
     # If a search has been made
     if query:
-        # Filter recipes based on search term in the name field
-        recipes = recipes.filter(
-            Q(name__icontains=query) | Q(instructions__icontains=query)
-        ).distinct()
+        # Search the full-text index, best matches first
+        recipes = search_recipes(Recipe.objects.all(), query)
     else:
         # If no search, use the values from filter
         recipes = recipe_filter.qs
@@ -48,81 +99,68 @@ def recipe_list(request):
         'active_path': 'recipes',
         'new_recipe_form': RecipeForm(),
         'recipe_filter': recipe_filter,
-        'recipes': recipes,
         'query': query,
+        **await get_recipe_sections(request, recipes),
     }
 
     return render(request, 'mealplanner/recipe_list.html', context)
 
-# View to search for recipes by name
-def recipe_search(request, search_query):
-    # Filter recipes based on the search query and user authentication
-    if request.user.is_authenticated:
-        recipes = Recipe.objects.filter(user=request.user) | Recipe.objects.filter(public=True)
-        recipes = recipes.filter(name=search_query)
-    else:
-        recipes = Recipe.objects.filter(public=True).filter(name=search_query)
+# View to search for recipes
+async def recipe_search(request, search_query):
+    request.user = await request.auser()
+
+    # Search the full-text index, visibility is applied per section
+    recipes = search_recipes(Recipe.objects.all(), search_query)
 
     # Render the recipe list template with the search results
     context = {
         'active_path': 'recipes',
-        'recipes': recipes,
+        **await get_recipe_sections(request, recipes),
     }
 
     return render(request, 'mealplanner/recipe_list.html', context)
 
 # View to display the details of a specific recipe
-def recipe_detail(request, recipe_id):
-    # Fetch the recipe and ensure the user has permission to view it
-    recipe = get_object_or_404(Recipe, id=recipe_id)
+@cache_anonymous_page
+async def recipe_detail(request, recipe_id):
+    request.user = await request.auser()
+
+    # Fetch the recipe (with its owner, which the template shows) and ensure the user has permission to view it
+    recipe = await aget_object_or_404(Recipe.objects.select_related('user'), id=recipe_id)
     
     # Ensure the user can only view their own recipes or public ones
     if not recipe.public and recipe.user != request.user:
         return HttpResponseForbidden("You are not allowed to view this recipe.")
     
     # Retrieve associated ingredients and nutrition data
-    ingredients = IngredientInRecipe.objects.filter(recipe=recipe)
+    ingredients = [line async for line in IngredientInRecipe.objects.filter(recipe=recipe).select_related('ingredient')]
+    nutrition = await RecipeNutrition.objects.filter(recipe=recipe).afirst()
 
-    try:
-        nutrition = RecipeNutrition.objects.get(recipe=recipe)
-    except:
-        nutrition = None
+    # Suggestions are precomputed (see similarity.py), so this is one indexed read
+    similar_recipes = [suggestion.similar async for suggestion in similar_recipes_query(recipe)]
 
-    # Convert recipe instructions from Markdown to HTML
-    md = markdown.Markdown()
-    recipe.instructions = md.convert(recipe.instructions)
+    # Instructions are rendered from Markdown when saved, only render here if that was missed (e.g. admin edits)
+    if recipe.refresh_instructions_html():
+        await Recipe.objects.filter(id=recipe.id).aupdate(
+            instructions_html=recipe.instructions_html,
+            instructions_hash=recipe.instructions_hash,
+        )
 
     # Render the recipe detail template with the recipe data
     context = {
         'active_path': 'recipes',
         'recipe': recipe,
         'ingredients': ingredients,
-        'nutrition': nutrition
+        'nutrition': nutrition,
+        'similar_recipes': similar_recipes,
     }
 
     return render(request, 'mealplanner/recipe_detail.html', context)
 
 # Utility function to fetch nutrition data from an external API
 def get_nutrition_data(query, app_id, app_key):
-    # Define the API endpoint and headers
-    url = 'https://trackapi.nutritionix.com/v2/natural/nutrients'
-    headers = {
-        'Content-Type': 'application/json',
-        'x-app-id': app_id,
-        'x-app-key': app_key
-    }
-    body = {
-        "query": query
-    }
-
-    # Make a POST request to the API and handle errors
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(body))
-        response.raise_for_status()  # Raise an HTTPError for bad responses (4xx and 5xx)
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred: {e}")
-        return None
+    # Use the shared client, which reuses connections and handles timeouts and retries
+    return get_client(app_id, app_key).nutrients(query)
 
 # View to add a new recipe
 @login_required
@@ -156,6 +194,27 @@ def add_mealplan(request):
     form = MealPlanForm()
     return render(request, 'mealplanner/add_mealplan.html', {'new_mealplan_form': form})
 
+# View to generate a meal plan that comes close to daily nutrition targets
+@login_required
+def generate_mealplan(request):
+    form = GenerateMealPlanForm(request.POST or None)
+    if request.method == 'POST' and form.is_valid():
+        targets = {name: form.cleaned_data[name] for name in ('calories', 'fat', 'carbs', 'protein')}
+        mealplan = generate_meal_plan(
+            request.user,
+            form.cleaned_data['name'],
+            targets,
+            meals_per_day=form.cleaned_data['meals_per_day'],
+            tags=form.cleaned_data['tags'],
+            max_difficulty=form.cleaned_data['max_difficulty'],
+            max_time=form.cleaned_data['max_time'],
+        )
+        if mealplan:
+            return redirect('mealplan_edit', mealplan_id=mealplan.id)
+        form.add_error(None, "No recipes with nutrition information match those choices.")
+
+    return render(request, 'mealplanner/generate_mealplan.html', {'generate_mealplan_form': form})
+
 # View to add a recipe to a meal plan
 @login_required
 def add_recipe_to_mealplan(request, mealplan_id):
@@ -174,7 +233,6 @@ def add_recipe_to_mealplan(request, mealplan_id):
 def edit_recipe(request, recipe_id):
     # Fetch the recipe and ensure the user has permission to edit it
     recipe = get_object_or_404(Recipe, id=recipe_id)
-    ingredients = Ingredient.objects.all().order_by('name')
 
     # Ensure the user can only edit their own recipes
     if recipe.user != request.user:
@@ -223,7 +281,6 @@ def edit_recipe(request, recipe_id):
         'recipedetailsform': recipedetailsform,
         'recipeinstructionsform': recipeinstructionsform,
         'receipenutritionform': receipenutritionform,
-        'ingredients': ingredients,
         'recipe': recipe
     }
 
@@ -231,45 +288,72 @@ def edit_recipe(request, recipe_id):
 
 # Utility view to fetch nutrition data for a recipe
 @login_required
-def get_nutri_for_recipe(request, recipe_id):
+async def get_nutri_for_recipe(request, recipe_id):
     # Fetch the recipe and its ingredients
-    recipe = get_object_or_404(Recipe, id=recipe_id)
-    ingredients_in_recipe = IngredientInRecipe.objects.filter(recipe=recipe)
+    recipe = await aget_object_or_404(Recipe, id=recipe_id)
+    ingredients_in_recipe = IngredientInRecipe.objects.filter(recipe=recipe).select_related('ingredient')
 
     APP_ID = os.getenv('APP_ID')
     APP_KEY = os.getenv('APP_KEY')
 
-    # String to store the natural language list of ingredients
-    ingredients_natural = ""
-    
-    # Iterate through ingredients and add to string
-    for ingredient in ingredients_in_recipe:
-        ingredients_natural += str(ingredient.measurement_amount) + ' ' + str(ingredient.ingredient.measurement_unit) + ' of ' + str(ingredient.ingredient.name) + '; '
-
-    # Call the external API to retrieve nutrition data
-    nutrition_data = get_nutrition_data(ingredients_natural, APP_ID, APP_KEY)
-
-    # Vars to store the nutrition parameters
-    calories = 0
-    fat = 0
-    carbs = 0
-    protein = 0
-
-    if nutrition_data:
-        # Iterate through response and extract nutri params
-        for food in nutrition_data['foods']:
-            calories += food['nf_calories']
-            fat += food['nf_total_fat']
-            carbs += food['nf_total_carbohydrate']
-            protein += food['nf_protein']
-
-        # Provide response in JSON format for easy JS interpretation
-        return JsonResponse({
-            'calories': round(calories, 1),
-            'fat': round(fat, 1),
-            'carbs': round(carbs, 1),
-            'protein': round(protein, 1),
-        })
+    # Normalized "amount unit of ingredient" line for each ingredient
+    lines = [
+        normalize_line(ingredient.measurement_amount, ingredient.ingredient.measurement_unit, ingredient.ingredient.name)
+        async for ingredient in ingredients_in_recipe
+    ]
+
+    # Look the lines up in the cache, only calling the external API for lines it hasn't seen (all at once).
+    # The worker is free to serve other requests while it waits for the API.
+    client = get_client(APP_ID, APP_KEY)
+    line_nutrition = await alookup_lines(lines, client.nutrients_many)
+
+    if None in line_nutrition.values():
+        return JsonResponse({'error': 'Nutrition data is unavailable, try again later.'}, status=502)
+
+    # Provide response in JSON format for easy JS interpretation
+    return JsonResponse(total_nutrition(lines, line_nutrition))
+
+# Utility view to queue a nutrition estimate for a recipe (POST), or check on the latest one (GET).
+# The estimate is made by a background worker (see jobs.py) and saved straight to the recipe's nutrition.
+@login_required
+def nutrition_job(request, recipe_id):
+    recipe = get_object_or_404(Recipe, id=recipe_id)
+
+    # Only the owner of the recipe can change its nutrition
+    if recipe.user != request.user:
+        return HttpResponseForbidden("You are not allowed to edit this recipe.")
+
+    if request.method == 'POST':
+        job = enqueue(NUTRITION_JOB, recipe.id)
+        return JsonResponse(get_job_status(job), status=202)
+
+    return JsonResponse(get_job_status(get_latest_job(NUTRITION_JOB, recipe.id)))
+
+# Utility view showing how much work the nutrition cache is saving
+@user_passes_test(lambda user: user.is_staff)
+def nutrition_cache_stats(request):
+    return JsonResponse(get_cache_stats())
+
+# View to find the recipes the user can make with the ingredients they have
+def pantry_search(request):
+    pantry_text = request.GET.get('ingredients', '')
+    names = parse_pantry(pantry_text)
+    recipes, unknown = match_pantry(names, request.user) if names else ([], [])
+
+    context = {
+        'active_path': 'pantry',
+        'pantry_text': pantry_text,
+        'searched': bool(names),
+        'recipes': recipes,
+        'unknown': unknown,
+    }
+    return render(request, 'mealplanner/pantry.html', context)
+
+# Utility view listing the ingredients matching what the user has typed, as options for the add ingredient picker
+@login_required
+def ingredient_autocomplete(request):
+    ingredients = autocomplete_ingredients(request.GET.get('q', ''), settings.INGREDIENT_AUTOCOMPLETE_LIMIT)
+    return render(request, 'mealplanner/ingredient_options.html', {'ingredients': ingredients})
 
 # View to add an ingredient to a recipe
 @login_required
@@ -366,60 +450,38 @@ def mealplan_list(request):
 
 # View to display the details of a specific meal plan
 @login_required
-def mealplan_detail(request, mealplan_id):
-    # Fetch the meal plan and ensure the user has permission to view it
-    mealplan = get_object_or_404(MealPlan, id=mealplan_id)
+async def mealplan_detail(request, mealplan_id):
+    request.user = await request.auser()
+
+    # Fetch the meal plan (with its owner, which the template checks) and ensure the user has permission to view it
+    mealplan = await aget_object_or_404(MealPlan.objects.select_related('user'), id=mealplan_id)
 
     # Ensure the user can only view their own meal plans
     if mealplan.user != request.user:
         return HttpResponseForbidden("You are not allowed to view this meal plan.")
     
-    # Retrieve associated meal plan items and aggregate shopping list data
-    mealplanitems = MealPlanItem.objects.filter(meal_plan=mealplan)
-
-    # Aggregate ingredients for the shopping list
-    shopping_list = (
-        IngredientInRecipe.objects
-        .filter(recipe__meal_plan_items__meal_plan=mealplan)
-        .values('ingredient__name', 'ingredient__measurement_unit')
-        .annotate(total_amount=Sum('measurement_amount'))
+    # Retrieve associated meal plan items (with their recipes)
+    mealplanitems = [item async for item in MealPlanItem.objects.filter(meal_plan=mealplan).select_related('recipe')]
+
+    # Read the shopping list from the plan's stored ingredient totals
+    shopping_list = [
+        total async for total in
+        MealPlanIngredientTotal.objects
+        .filter(meal_plan=mealplan)
+        .values('ingredient__name', 'ingredient__measurement_unit', 'total_amount')
         .order_by('ingredient__name')
-    )
-
-    WEEKDAY_CHOICES = [
-        (0, 'Monday'),
-        (1, 'Tuesday'),
-        (2, 'Wednesday'),
-        (3, 'Thursday'),
-        (4, 'Friday'),
-        (5, 'Saturday'),
-        (6, 'Sunday'),
     ]
 
-    WEEKDAY_NAMES = dict(WEEKDAY_CHOICES)
-
-    # Initialize nutrition data with all days (ensures all weekdays are included)
-    nutrition_data = {day: {'calories': 0, 'fat': 0, 'carbs': 0, 'protein': 0} for day in WEEKDAY_NAMES}
-
-    # Count occurrences of each recipe per weekday
-    recipe_counts = defaultdict(lambda: defaultdict(int))  # {weekday: {recipe_id: count}}
-
-    for item in mealplanitems:
-        recipe_counts[item.weekday][item.recipe.id] += 1  # Count how many times each recipe appears
-
-    # Populate nutrition data with correct multipliers
-    for weekday, recipes in recipe_counts.items():
-        for recipe_id, count in recipes.items():
-            recipe_nutrition = RecipeNutrition.objects.filter(recipe_id=recipe_id).first()
-            if recipe_nutrition:
-                nutrition_data[weekday]['calories'] += recipe_nutrition.calories * count
-                nutrition_data[weekday]['fat'] += recipe_nutrition.fat * count
-                nutrition_data[weekday]['carbs'] += recipe_nutrition.carbs * count
-                nutrition_data[weekday]['protein'] += recipe_nutrition.protein * count
-
-    # Convert to list for template rendering
+    # Read the nutrition for each day from the plan's stored day summaries
     nutrition_summary = [
-        {'day': WEEKDAY_NAMES[day], **values} for day, values in sorted(nutrition_data.items())
+        {
+            'day': day.get_weekday_display(),
+            'calories': day.calories,
+            'fat': day.fat,
+            'carbs': day.carbs,
+            'protein': day.protein,
+        }
+        for day in await aget_day_summaries(mealplan)
     ]
 
     # Render the meal plan detail template with the meal plan data
@@ -434,27 +496,121 @@ def mealplan_detail(request, mealplan_id):
 
     return render(request, 'mealplanner/mealplan_detail.html', context)
 
+# Helper to tell whether a request came through the ASGI handler. Under ASGI a streamed response has to
+# be an async iterator to go out as it is produced (a sync one is read to the end first), while under
+# WSGI an async iterator would be read to the end first, so streaming views pick the one that fits.
+def is_asgi(request):
+    return isinstance(request, ASGIRequest)
+
+# View to export the combined shopping list of one or more meal plans as CSV or JSON
+@login_required
+async def shopping_list_export(request):
+    request.user = await request.auser()
+
+    # Plans are given as ?plan=1&plan=2, and only the user's own plans are included
+    try:
+        plan_ids = [int(plan_id) for plan_id in request.GET.getlist('plan')]
+    except ValueError:
+        return HttpResponse("Invalid meal plan.", status=400)
+
+    mealplans = MealPlan.objects.filter(user=request.user, id__in=plan_ids)
+    if not plan_ids or len(set(plan_ids)) != await mealplans.acount():
+        return HttpResponse("Choose one or more of your meal plans.", status=400)
+
+    # Stream the rows out as they are read, so large lists never sit fully in memory
+    if is_asgi(request):
+        rows, to_csv, to_json = aiter_shopping_list(mealplans), astream_csv, astream_json
+    else:
+        rows, to_csv, to_json = iter_shopping_list(mealplans), stream_csv, stream_json
+    if request.GET.get('format') == 'json':
+        response = StreamingHttpResponse(to_json(rows), content_type='application/json')
+        response['Content-Disposition'] = 'attachment; filename="shopping_list.json"'
+    else:
+        response = StreamingHttpResponse(to_csv(rows), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="shopping_list.csv"'
+    return response
+
+# View to download the user's recipes and/or meal plans as JSON Lines, in the format import_recipes reads
+@login_required
+async def export_data(request, types=EXPORT_TYPES):
+    request.user = await request.auser()
+
+    # Stream the records out as they are read, so large libraries never sit fully in memory
+    stream = astream_export if is_asgi(request) else stream_export
+    response = StreamingHttpResponse(stream(request.user, types), content_type='application/x-ndjson')
+    response['Content-Disposition'] = f'attachment; filename="{request.user.username}-export.jsonl"'
+    return response
+
+# Utility view to preview how swapping one recipe for another on a weekday would change a meal plan's totals
+@login_required
+def mealplan_whatif(request, mealplan_id):
+    mealplan = get_object_or_404(MealPlan, id=mealplan_id)
+
+    # Ensure the user can only preview their own meal plans
+    if mealplan.user != request.user:
+        return HttpResponseForbidden("You are not allowed to view this meal plan.")
+
+    try:
+        weekday = int(request.GET['weekday'])
+        remove_id = int(request.GET['remove']) if request.GET.get('remove') else None
+        add_id = int(request.GET['add']) if request.GET.get('add') else None
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'weekday is required, remove and add must be recipe ids.'}, status=400)
+
+    # The removed recipe has to be planned on that day, and the added recipe has to be visible to the user
+    if weekday not in dict(WEEKDAY_CHOICES):
+        return JsonResponse({'error': 'Unknown weekday.'}, status=400)
+    if remove_id and not MealPlanItem.objects.filter(meal_plan=mealplan, weekday=weekday, recipe_id=remove_id).exists():
+        return JsonResponse({'error': 'That recipe is not planned on that day.'}, status=400)
+    if add_id and not Recipe.objects.filter(Q(user=request.user) | Q(public=True), id=add_id).exists():
+        return JsonResponse({'error': 'Recipe not found.'}, status=404)
+
+    # Make sure the stored summary exists, then compare against it
+    get_day_summaries(mealplan)
+    return JsonResponse(swap_delta(mealplan, weekday, remove_id, add_id))
+
 # View to edit a meal plan
 @csrf_exempt
 def mealplan_edit(request, mealplan_id):
     # Handle POST requests to update meal plan items
     if request.method == "POST":
+        # Only the owner of the meal plan can change it
+        mealplan = get_object_or_404(MealPlan, id=mealplan_id)
+        if mealplan.user != request.user:
+            return HttpResponseForbidden("You are not allowed to edit this meal plan.")
+
+        # Validate the whole batch before changing anything
         try:
             data = json.loads(request.body)
-            meal_plan_items = data.get('meal_plan_items', [])
-
-            # Update each MealPlanItem's weekday
-            for item in meal_plan_items:
-                try:
-                    meal_item = MealPlanItem.objects.get(id=item['id'])
-                    meal_item.weekday = item['weekday']
-                    meal_item.save()
-                except MealPlanItem.DoesNotExist:
-                    continue
-
-            return JsonResponse({"status": "success"})
-        except:
-            return JsonResponse({"status": "error"}, status=400)
+            new_weekdays = {int(item['id']): int(item['weekday']) for item in data.get('meal_plan_items', [])}
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return JsonResponse({"status": "error", "error": "Invalid meal plan items."}, status=400)
+
+        if not set(new_weekdays.values()) <= set(dict(WEEKDAY_CHOICES)):
+            return JsonResponse({"status": "error", "error": "Unknown weekday."}, status=400)
+
+        # Fetch every item in one query, scoped to this plan
+        meal_items = list(MealPlanItem.objects.filter(meal_plan=mealplan, id__in=new_weekdays))
+        if len(meal_items) != len(new_weekdays):
+            return JsonResponse({"status": "error", "error": "Some items are not in this meal plan."}, status=400)
+
+        # Only write the items that actually moved, all in one transaction
+        moves = []
+        changed_items = []
+        for meal_item in meal_items:
+            if meal_item.weekday != new_weekdays[meal_item.id]:
+                moves.append((meal_item.recipe_id, meal_item.weekday, new_weekdays[meal_item.id]))
+                meal_item.weekday = new_weekdays[meal_item.id]
+                changed_items.append(meal_item)
+
+        with transaction.atomic():
+            MealPlanItem.objects.bulk_update(changed_items, ['weekday'])
+            # bulk_update doesn't send signals, so update the stored summary and version here
+            move_planned_recipes(mealplan.id, moves)
+            if changed_items:
+                touch_meal_plans([mealplan.id])
+
+        return JsonResponse({"status": "success", "updated": len(changed_items)})
 
     # Handle GET requests to fetch meal plan data for editing
     elif request.method == "GET":
@@ -468,16 +624,6 @@ def mealplan_edit(request, mealplan_id):
         # Get the meal plan items associated with this meal plan
         mealplanitems = MealPlanItem.objects.filter(meal_plan=mealplan)
 
-        WEEKDAY_CHOICES = [
-            (0, 'Monday'),
-            (1, 'Tuesday'),
-            (2, 'Wednesday'),
-            (3, 'Thursday'),
-            (4, 'Friday'),
-            (5, 'Saturday'),
-            (6, 'Sunday'),
-        ]
-
         context = {
             'active_path': 'mealplans',
             'mealplan': mealplan,
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mealplanner.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -133,4 +134,94 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_REDIRECT_URL = "/"
 LOGOUT_REDIRECT_URL = "/"
 
-CRISPY_TEMPLATE_PACK = 'bootstrap5'
\ No newline at end of file
+CRISPY_TEMPLATE_PACK = 'bootstrap5'
+
+# Number of recipes shown per page in each section of the recipe list
+RECIPE_PAGE_SIZE = 24
+
+# Nutritionix lookup cache: entries expire after this many seconds, and the least recently used are evicted past the limit
+NUTRITION_CACHE_TTL = 60 * 60 * 24 * 30
+NUTRITION_CACHE_MAX_ENTRIES = 50000
+
+# Nutritionix API client: timeouts are in seconds, failed requests are retried with jittered backoff
+NUTRITIONIX_URL = 'https://trackapi.nutritionix.com/v2/natural/nutrients'
+NUTRITIONIX_CONNECT_TIMEOUT = 3.05
+NUTRITIONIX_READ_TIMEOUT = 10
+NUTRITIONIX_RETRIES = 2
+NUTRITIONIX_BACKOFF = 0.5
+NUTRITIONIX_MAX_CONCURRENCY = 8
+
+# Cache backend, a per-process memory cache by default. Use a shared backend such as Redis or
+# Memcached in production so every worker sees the same cached pages.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mealplanner',
+    },
+}
+
+# Full-page cache for anonymous visitors: pages are fresh for PAGE_CACHE_TIMEOUT seconds (0 turns it off),
+# then served stale for up to PAGE_CACHE_GRACE seconds while one worker renders them again
+PAGE_CACHE_ALIAS = 'default'
+PAGE_CACHE_TIMEOUT = 60
+PAGE_CACHE_GRACE = 300
+PAGE_CACHE_LOCK_TIMEOUT = 10
+
+# Cache backend for rendered recipe cards, and how long they are cached for, in seconds
+# (they are also replaced whenever the recipe changes)
+RECIPE_CARD_CACHE_ALIAS = 'default'
+RECIPE_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# How long recipe filter counts are cached for, in seconds, and how many tags are offered (most used first)
+FACET_CACHE_TIMEOUT = 300
+TAG_FACET_LIMIT = 30
+
+# How many matches the ingredient autocomplete returns
+INGREDIENT_AUTOCOMPLETE_LIMIT = 20
+
+# Background jobs (see mealplanner/jobs.py): failed jobs are retried with jittered backoff starting at
+# JOB_RETRY_BACKOFF seconds, and jobs still running after JOB_TIMEOUT seconds are assumed lost and run again.
+# Idle workers check for new jobs every JOB_POLL_INTERVAL seconds, trying up to JOB_CLAIM_BATCH due jobs each time,
+# and delete finished jobs more than JOB_RETENTION seconds old.
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF = 30
+JOB_TIMEOUT = 600
+JOB_POLL_INTERVAL = 1
+JOB_CLAIM_BATCH = 10
+JOB_RETENTION = 60 * 60 * 24 * 7
+
+# Similar recipe suggestions (see mealplanner/similarity.py): how many are stored and shown per recipe, how much
+# a shared tag counts for next to a shared ingredient, and how many recipes are compared at a time when rebuilding
+SIMILAR_RECIPES_STORED = 10
+SIMILAR_RECIPES_SHOWN = 4
+SIMILAR_TAG_WEIGHT = 0.5
+SIMILAR_BATCH_SIZE = 256
+
+# How often, in seconds, each process rebuilds its pantry index to pick up changes made by other processes
+PANTRY_INDEX_MAX_AGE = 300
+
+# Nutrition traffic-light thresholds per recipe (see mealplanner/colours.py): (low, high) for each nutrient, with values
+# up to low shown green, up to high amber and above high red. Run recompute_nutrition_colours after changing them.
+NUTRITION_COLOUR_THRESHOLDS = {
+    'calories': (400, 700),
+    'fat': (10, 21),
+    'carbs': (45, 90),
+    'protein': (15, 30),
+}
+
+# Time the database, template and view phases of every request, reported in a Server-Timing header and logged
+SERVER_TIMING = False
+
+# Send the request timing, background job and Nutritionix client log lines to the console
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'mealplanner.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'mealplanner.jobs': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'mealplanner.nutritionix': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}